@@ -32,6 +32,10 @@ def create_app():
 
     app.jinja_env.globals["safe_url_for"] = safe_url_for
 
+    # Jeton à usage unique des formulaires sensibles (anti double-soumission)
+    from app.services.form_once import issue_form_token
+    app.jinja_env.globals["form_token"] = issue_form_token
+
 
     @login_manager.user_loader
     def load_user(user_id):
@@ -50,6 +54,7 @@ def create_app():
     from app.participants.routes import bp as participants_bp
     from app.launcher import bp as launcher_bp
     from app.pedagogie.routes import bp as pedagogie_bp
+    from app.search import bp as search_bp
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(main_bp)
@@ -64,6 +69,10 @@ def create_app():
     app.register_blueprint(participants_bp)
     app.register_blueprint(launcher_bp)
     app.register_blueprint(pedagogie_bp)
+    app.register_blueprint(search_bp)
+
+    from app.cli import register_cli
+    register_cli(app)
 
 
     def ensure_schema():
@@ -184,8 +193,73 @@ def create_app():
                 db.session.commit()
         except Exception:
             db.session.rollback()
+
+        # 8) Kiosque : clé d'idempotence des émargements envoyés par lot (tablettes hors-ligne)
+        try:
+            cols_pr = [row[1] for row in db.session.execute(text("PRAGMA table_info(presence_activite)")).all()]
+            if cols_pr and "client_key" not in cols_pr:
+                db.session.execute(text("ALTER TABLE presence_activite ADD COLUMN client_key VARCHAR(64)"))
+            if cols_pr:
+                db.session.execute(text(
+                    "CREATE UNIQUE INDEX IF NOT EXISTS idx_uq_presence_client_key ON presence_activite(client_key)"
+                ))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+
+        # 9) Finance : engagé dénormalisé (rempli par ensure_engagement au premier passage)
+        try:
+            for table in ("ligne_budget", "subvention"):
+                cols_t = [row[1] for row in db.session.execute(text(f"PRAGMA table_info({table})")).all()]
+                if not cols_t:
+                    continue
+                if "engage_cache" not in cols_t:
+                    db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN engage_cache FLOAT NOT NULL DEFAULT 0"))
+                if "nb_depenses" not in cols_t:
+                    db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN nb_depenses INTEGER NOT NULL DEFAULT 0"))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
     with app.app_context():
+        # Triggers, FTS5, INSERT OR IGNORE, strftime : l'application ne tourne que sur SQLite
+        if db.engine.dialect.name != "sqlite":
+            raise RuntimeError(
+                f"Base non supportée ({db.engine.dialect.name}) : DATABASE_URL doit désigner une base SQLite."
+            )
+
+        # SQLite : WAL + busy_timeout sur chaque connexion (avant toute requête)
+        from app.services.db_write import install_sqlite_pragmas
+        install_sqlite_pragmas(
+            db.engine,
+            busy_timeout_ms=app.config.get("SQLITE_BUSY_TIMEOUT_MS", 10000),
+            wal=app.config.get("SQLITE_WAL", True),
+        )
         ensure_schema()
         db.create_all()
 
+        # Index plein texte (FTS5) : après create_all, car les triggers visent les tables
+        from app.search.index import ensure_search_index
+        ensure_search_index()
+
+        # Appartenance participant <-> secteur (triggers sur les présences)
+        from app.participants.membership import ensure_participant_secteur
+        ensure_participant_secteur()
+
+        # Engagé dénormalisé ligne / subvention (triggers sur les dépenses)
+        from app.budget.engagement import ensure_engagement
+        ensure_engagement()
+
+        # Versions de données (clés d'invalidation des caches de calcul)
+        from app.services.data_version import ensure_data_version
+        ensure_data_version()
+
+        # Grand livre agrégé par exercice (triggers : file des subventions à recalculer)
+        from app.budget.ledger import ensure_ledger
+        ensure_ledger()
+
+        # Alertes de gestion persistées (triggers : file des cibles à réévaluer)
+        from app.services.alertes import ensure_alertes, install_alertes_sync
+        ensure_alertes()
+        install_alertes_sync(app)
+
     return app
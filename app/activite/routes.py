@@ -1,18 +1,25 @@
 import os
 import base64
+import queue
 import secrets
+import time
 from datetime import datetime, date
 
-from flask import render_template, request, redirect, url_for, flash, current_app, send_file, abort
+from flask import (
+    render_template, request, redirect, url_for, flash, current_app, send_file, abort,
+    jsonify, Response, stream_with_context,
+)
 from werkzeug.utils import secure_filename
 from flask_login import login_required, current_user
 from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
 
 from app.extensions import db
 from app.models import (
     AtelierActivite,
     SessionActivite,
     Participant,
+    ParticipantSecteur,
     PresenceActivite,
     Quartier,
     AtelierCapaciteMois,
@@ -21,9 +28,21 @@ from app.models import (
     Objectif,
 )
 
+from app.kiosk.emargement import discard_signature
+from app.kiosk.state import bump_kiosk_state
+from app.participants.membership import has_visited
+from app.participants.retention import delete_presences, remove_signature_files
+from app.search.index import match_or_like
+from app.services.db_write import WriteBusyError, run_write
+from app.services.form_once import form_once
+from app.services.pagination import keyset_paginate, page_args
+
 from . import bp
 from .services.docx_utils import generate_collectif_docx_pdf, generate_individuel_mensuel_docx, finalize_individuel_mensuel_pdf
 from .services.mail_utils import send_email_with_attachment
+from .services import live
+from .services.historique import import_historique as import_historique_matrice
+from .services.live import session_presences
 
 
 # ------------------ Helpers ------------------
@@ -126,9 +145,98 @@ def index():
     )
 
 
+# ------------------ Reprise d'historique (matrice Excel) ------------------
+
+
+_HISTO_DIR = "imports_historique"
+
+
+@bp.route("/import_historique", methods=["GET", "POST"])
+@login_required
+def import_historique():
+    """Matrice participants x dates (format export historique) -> sessions + présences."""
+    secteur = _user_secteur()
+    ateliers = (
+        AtelierActivite.query.filter_by(secteur=secteur)
+        .filter(AtelierActivite.is_deleted.is_(False))
+        .order_by(AtelierActivite.nom.asc())
+        .all()
+    )
+    if request.method == "GET":
+        return render_template("activite/import_historique.html", secteur=secteur, ateliers=ateliers, report=None)
+
+    folder = os.path.join(current_app.instance_path, _HISTO_DIR)
+    stored = secure_filename(request.form.get("fichier_stocke") or "")
+    f = request.files.get("fichier")
+    if f and f.filename:
+        if not f.filename.lower().endswith(".xlsx"):
+            flash("Fichier XLSX attendu (export « Excel historique »).", "danger")
+            return redirect(url_for("activite.import_historique"))
+        os.makedirs(folder, exist_ok=True)
+        stored = f"{datetime.utcnow():%Y%m%d%H%M%S%f}_{secure_filename(f.filename) or 'historique.xlsx'}"
+        f.save(os.path.join(folder, stored))
+    path = os.path.join(folder, stored) if stored else ""
+    if not path or not os.path.isfile(path):
+        flash("Choisis un fichier.", "danger")
+        return redirect(url_for("activite.import_historique"))
+
+    atelier_force = None
+    atelier_id = request.form.get("atelier_id", type=int)
+    if atelier_id:
+        atelier_force = next((a for a in ateliers if a.id == atelier_id), None)
+        if atelier_force is None:
+            abort(403)
+
+    dry_run = request.form.get("mode") != "import"
+    try:
+        report = import_historique_matrice(
+            path, ateliers, dry_run=dry_run, atelier_force=atelier_force,
+            created_by_user_id=getattr(current_user, "id", None),
+        )
+    except WriteBusyError:
+        flash("Base occupée : import interrompu. Relance-le : les lignes déjà importées ne seront pas dupliquées.", "warning")
+        return redirect(url_for("activite.import_historique"))
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception("Import historique illisible")
+        flash("Fichier illisible (XLSX attendu, format export historique).", "danger")
+        return redirect(url_for("activite.import_historique"))
+
+    if not dry_run:
+        flash(
+            f"Historique importé : {report.total('sessions_creees')} session(s), "
+            f"{report.total('presences_creees')} présence(s), {report.total('participants_crees')} participant(s) créé(s).",
+            "success",
+        )
+    return render_template(
+        "activite/import_historique.html",
+        secteur=secteur,
+        ateliers=ateliers,
+        report=report,
+        fichier_stocke=stored,
+        atelier_id=atelier_id,
+    )
+
+
 # ------------------ Gestion Participants (par secteur) ------------------
 
 
+# Tri stable des listes de participants : nom, prénom, puis id
+_PARTICIPANT_KEYS = [(Participant.nom, False), (Participant.prenom, False), (Participant.id, False)]
+
+
+def _participant_search_clause(q: str):
+    """Filtre nom/prénom/email/téléphone : index FTS5 si dispo et s'il trouve, sinon LIKE."""
+    like = f"%{q.lower()}%"
+    clause = or_(
+        db.func.lower(Participant.nom).like(like),
+        db.func.lower(Participant.prenom).like(like),
+        db.func.lower(db.func.coalesce(Participant.email, "")).like(like),
+        db.func.lower(db.func.coalesce(Participant.telephone, "")).like(like),
+    )
+    return match_or_like("participant", Participant.id, q, clause)
+
+
 @bp.route("/participants")
 @login_required
 def participants():
@@ -136,48 +244,29 @@ def participants():
     secteur = _user_secteur()
     q = (request.args.get("q") or "").strip()
 
-    # Participants présents dans ce secteur (via sessions)
+    # Participants présents dans ce secteur (table d'appartenance, 1 ligne par participant)
     base = (
-        db.session.query(Participant)
-        .join(PresenceActivite, PresenceActivite.participant_id == Participant.id)
-        .join(SessionActivite, SessionActivite.id == PresenceActivite.session_id)
-        .filter(SessionActivite.secteur == secteur)
-        .distinct()
+        db.session.query(Participant, ParticipantSecteur)
+        .join(ParticipantSecteur, ParticipantSecteur.participant_id == Participant.id)
+        .filter(ParticipantSecteur.secteur == secteur)
     )
     if q:
-        like = f"%{q.lower()}%"
-        base = base.filter(
-            or_(
-                db.func.lower(Participant.nom).like(like),
-                db.func.lower(Participant.prenom).like(like),
-                db.func.lower(db.func.coalesce(Participant.email, "")).like(like),
-                db.func.lower(db.func.coalesce(Participant.telephone, "")).like(like),
-            )
-        )
+        base = base.filter(_participant_search_clause(q))
 
-    participants_list = base.order_by(Participant.nom.asc(), Participant.prenom.asc()).limit(500).all()
+    cursor, per_page = page_args()
+    page = keyset_paginate(base, _PARTICIPANT_KEYS, cursor, per_page)
+    rows = page.items
+    participants_list = [p for p, _ms in rows]
 
     # Mini-stats par participant dans le secteur (visites + dernière venue)
-    stats_map = {}
-    rows = (
-        db.session.query(
-            PresenceActivite.participant_id,
-            db.func.count(PresenceActivite.id).label("visites"),
-            db.func.max(PresenceActivite.created_at).label("last_seen"),
-        )
-        .join(SessionActivite, SessionActivite.id == PresenceActivite.session_id)
-        .filter(SessionActivite.secteur == secteur)
-        .group_by(PresenceActivite.participant_id)
-        .all()
-    )
-    for r in rows:
-        stats_map[r.participant_id] = {"visites": int(r.visites or 0), "last_seen": r.last_seen}
+    stats_map = {p.id: {"visites": int(ms.visits or 0), "last_seen": ms.last_seen} for p, ms in rows}
 
     return render_template(
         "activite/participants.html",
         secteur=secteur,
         q=q,
         participants=participants_list,
+        page=page,
         stats_map=stats_map,
         is_admin_global=_is_admin_global(),
     )
@@ -191,15 +280,7 @@ def participant_edit(participant_id: int):
 
     # Autorisation: doit être "dans" le secteur (au moins une présence) ou admin global
     if not _is_admin_global():
-        in_secteur = (
-            db.session.query(PresenceActivite.id)
-            .join(SessionActivite, SessionActivite.id == PresenceActivite.session_id)
-            .filter(PresenceActivite.participant_id == p.id)
-            .filter(SessionActivite.secteur == secteur)
-            .first()
-            is not None
-        )
-        if not in_secteur:
+        if not has_visited(p.id, secteur):
             flash("Accès refusé.", "danger")
             return redirect(url_for("activite.participants"))
 
@@ -241,15 +322,7 @@ def participant_anonymize(participant_id: int):
     p = Participant.query.get_or_404(participant_id)
 
     if not _is_admin_global():
-        in_secteur = (
-            db.session.query(PresenceActivite.id)
-            .join(SessionActivite, SessionActivite.id == PresenceActivite.session_id)
-            .filter(PresenceActivite.participant_id == p.id)
-            .filter(SessionActivite.secteur == secteur)
-            .first()
-            is not None
-        )
-        if not in_secteur:
+        if not has_visited(p.id, secteur):
             flash("Accès refusé.", "danger")
             return redirect(url_for("activite.participants"))
 
@@ -287,30 +360,20 @@ def participant_delete(participant_id: int):
     if not _is_admin_global():
         # Vérifie présence hors secteur
         other = (
-            db.session.query(PresenceActivite.id)
-            .join(SessionActivite, SessionActivite.id == PresenceActivite.session_id)
-            .filter(PresenceActivite.participant_id == p.id)
-            .filter(SessionActivite.secteur != secteur)
+            db.session.query(ParticipantSecteur.secteur)
+            .filter(ParticipantSecteur.participant_id == p.id)
+            .filter(ParticipantSecteur.secteur != secteur)
             .first()
         )
         if other is not None:
             flash("Suppression refusée : ce participant est utilisé dans d'autres secteurs. Utilise 'Anonymiser'.", "warning")
             return redirect(url_for("activite.participants"))
 
-    # Nettoie signatures puis supprime présences
-    presences = PresenceActivite.query.filter_by(participant_id=p.id).all()
-    for pr in presences:
-        if pr.signature_path:
-            try:
-                # signature_path est un chemin fichier
-                if os.path.exists(pr.signature_path):
-                    os.remove(pr.signature_path)
-            except Exception:
-                pass
-        db.session.delete(pr)
-
+    # Présences supprimées en masse ; fichiers de signature effacés après le commit
+    sig_paths = delete_presences([p.id])
     db.session.delete(p)
     db.session.commit()
+    remove_signature_files(sig_paths)
     flash("Participant supprimé définitivement.", "success")
     return redirect(url_for("activite.participants"))
 
@@ -507,6 +570,7 @@ def atelier_delete(atelier_id: int):
         s.kiosk_token = None
 
     db.session.commit()
+    bump_kiosk_state()
     flash("Atelier placé dans la corbeille (restaurable).", "success")
     return redirect(url_for("activite.index"))
 
@@ -556,6 +620,7 @@ def session_delete(session_id: int):
     s.kiosk_pin = None
     s.kiosk_token = None
     db.session.commit()
+    bump_kiosk_state()
 
     flash("Session placée dans la corbeille (restaurable).", "success")
     return redirect(url_for("activite.sessions", atelier_id=atelier.id))
@@ -629,6 +694,7 @@ def session_purge(session_id: int):
     # 3) supprime la session
     db.session.delete(s)
     db.session.commit()
+    bump_kiosk_state()
     flash("Session supprimée définitivement.", "success")
     return redirect(url_for("activite.sessions", atelier_id=atelier.id, corbeille=1))
 
@@ -743,185 +809,213 @@ def emargement(session_id: int):
 
     if request.method == "POST":
         action = request.form.get("action")
-        if action == "save_evaluation":
-            participant_id = request.form.get("participant_id")
-            if not participant_id:
-                flash("Participant manquant.", "danger")
-                return redirect(url_for("activite.emargement", session_id=session_id))
-            participant = Participant.query.get(int(participant_id))
-            if not participant:
-                flash("Participant introuvable.", "danger")
-                return redirect(url_for("activite.emargement", session_id=session_id))
-
-            eval_date = s.rdv_date or s.date_session or date.today()
-            competence_ids = [int(cid) for cid in request.form.getlist("competence_ids") if cid.isdigit()]
-            for comp_id in competence_ids:
-                etat = request.form.get(f"etat_{comp_id}")
-                if etat is None:
-                    continue
-                try:
-                    etat_value = int(etat)
-                except ValueError:
-                    continue
-                commentaire = (request.form.get(f"commentaire_{comp_id}") or "").strip() or None
-                evaluation = Evaluation.query.filter_by(
-                    participant_id=participant.id,
-                    competence_id=comp_id,
-                    session_id=s.id,
-                ).first()
-                if evaluation:
-                    evaluation.etat = etat_value
-                    evaluation.commentaire = commentaire
-                    evaluation.user_id = current_user.id
-                    evaluation.date_evaluation = eval_date
-                else:
-                    evaluation = Evaluation(
+        with form_once(request.form.get("form_token")) as sub:
+            # double clic : résultat d'origine, sans nouvelle écriture ni fichier signature
+            if sub.replayed:
+                return sub.replay()
+
+            if action == "save_evaluation":
+                participant_id = request.form.get("participant_id")
+                if not participant_id:
+                    flash("Participant manquant.", "danger")
+                    return redirect(url_for("activite.emargement", session_id=session_id))
+                participant = Participant.query.get(int(participant_id))
+                if not participant:
+                    flash("Participant introuvable.", "danger")
+                    return redirect(url_for("activite.emargement", session_id=session_id))
+
+                eval_date = s.rdv_date or s.date_session or date.today()
+                competence_ids = [int(cid) for cid in request.form.getlist("competence_ids") if cid.isdigit()]
+                for comp_id in competence_ids:
+                    etat = request.form.get(f"etat_{comp_id}")
+                    if etat is None:
+                        continue
+                    try:
+                        etat_value = int(etat)
+                    except ValueError:
+                        continue
+                    commentaire = (request.form.get(f"commentaire_{comp_id}") or "").strip() or None
+                    evaluation = Evaluation.query.filter_by(
                         participant_id=participant.id,
                         competence_id=comp_id,
                         session_id=s.id,
-                        user_id=current_user.id,
-                        etat=etat_value,
-                        date_evaluation=eval_date,
-                        commentaire=commentaire,
-                    )
-                    db.session.add(evaluation)
-            db.session.commit()
-            flash("Évaluation enregistrée.", "success")
-            return redirect(url_for("activite.emargement", session_id=session_id, highlight=participant.id))
-
-        if action == "bulk_validate":
-            eval_date = s.rdv_date or s.date_session or date.today()
-            session_objectifs = Objectif.query.filter_by(session_id=s.id, type="operationnel").all()
-            session_competences = {comp for obj in session_objectifs for comp in obj.competences}
-            presences = PresenceActivite.query.filter_by(session_id=session_id).all()
-            for pr in presences:
-                for comp in session_competences:
-                    evaluation = Evaluation.query.filter_by(
-                        participant_id=pr.participant_id,
-                        competence_id=comp.id,
-                        session_id=s.id,
                     ).first()
                     if evaluation:
-                        evaluation.etat = 2
+                        evaluation.etat = etat_value
+                        evaluation.commentaire = commentaire
                         evaluation.user_id = current_user.id
                         evaluation.date_evaluation = eval_date
                     else:
-                        db.session.add(Evaluation(
-                            participant_id=pr.participant_id,
-                            competence_id=comp.id,
+                        evaluation = Evaluation(
+                            participant_id=participant.id,
+                            competence_id=comp_id,
                             session_id=s.id,
                             user_id=current_user.id,
-                            etat=2,
+                            etat=etat_value,
                             date_evaluation=eval_date,
-                        ))
-            db.session.commit()
-            flash("Évaluation rapide appliquée.", "success")
-            return redirect(url_for("activite.emargement", session_id=session_id))
-
-        if action == "add_participant":
-            nom = (request.form.get("nom") or "").strip()
-            prenom = (request.form.get("prenom") or "").strip()
-            ville = (request.form.get("ville") or "").strip() or None
-            adresse = (request.form.get("adresse") or "").strip() or None
-            email = (request.form.get("email") or "").strip() or None
-            telephone = (request.form.get("telephone") or "").strip() or None
-            genre = (request.form.get("genre") or "").strip() or None
-            date_naissance = request.form.get("date_naissance") or None
-            type_public = (request.form.get("type_public") or "H").strip().upper() or "H"
-            quartier_id = request.form.get("quartier_id") or None
-
-            if not nom or not prenom:
-                flash("Nom et prénom obligatoires.", "danger")
+                            commentaire=commentaire,
+                        )
+                        db.session.add(evaluation)
+                db.session.commit()
+                flash("Évaluation enregistrée.", "success")
+                return redirect(url_for("activite.emargement", session_id=session_id, highlight=participant.id))
+
+            if action == "bulk_validate":
+                eval_date = s.rdv_date or s.date_session or date.today()
+                session_objectifs = Objectif.query.filter_by(session_id=s.id, type="operationnel").all()
+                session_competences = {comp for obj in session_objectifs for comp in obj.competences}
+                presences = PresenceActivite.query.filter_by(session_id=session_id).all()
+                for pr in presences:
+                    for comp in session_competences:
+                        evaluation = Evaluation.query.filter_by(
+                            participant_id=pr.participant_id,
+                            competence_id=comp.id,
+                            session_id=s.id,
+                        ).first()
+                        if evaluation:
+                            evaluation.etat = 2
+                            evaluation.user_id = current_user.id
+                            evaluation.date_evaluation = eval_date
+                        else:
+                            db.session.add(Evaluation(
+                                participant_id=pr.participant_id,
+                                competence_id=comp.id,
+                                session_id=s.id,
+                                user_id=current_user.id,
+                                etat=2,
+                                date_evaluation=eval_date,
+                            ))
+                db.session.commit()
+                flash("Évaluation rapide appliquée.", "success")
                 return redirect(url_for("activite.emargement", session_id=session_id))
 
-            dn = None
-            if date_naissance:
+            if action == "add_participant":
+                nom = (request.form.get("nom") or "").strip()
+                prenom = (request.form.get("prenom") or "").strip()
+                ville = (request.form.get("ville") or "").strip() or None
+                adresse = (request.form.get("adresse") or "").strip() or None
+                email = (request.form.get("email") or "").strip() or None
+                telephone = (request.form.get("telephone") or "").strip() or None
+                genre = (request.form.get("genre") or "").strip() or None
+                date_naissance = request.form.get("date_naissance") or None
+                type_public = (request.form.get("type_public") or "H").strip().upper() or "H"
+                quartier_id = request.form.get("quartier_id") or None
+
+                if not nom or not prenom:
+                    flash("Nom et prénom obligatoires.", "danger")
+                    return redirect(url_for("activite.emargement", session_id=session_id))
+
+                dn = None
+                if date_naissance:
+                    try:
+                        dn = datetime.strptime(date_naissance, "%Y-%m-%d").date()
+                    except Exception:
+                        dn = None
+
+                qid = int(quartier_id) if quartier_id else None
+                if (ville or "").strip().lower() != "creil":
+                    qid = None
+
+                p = Participant(
+                    nom=nom,
+                    prenom=prenom,
+                    ville=ville,
+                    adresse=adresse,
+                    email=email,
+                    telephone=telephone,
+                    genre=genre,
+                    date_naissance=dn,
+                    quartier_id=qid,
+                    type_public=type_public,
+                )
                 try:
-                    dn = datetime.strptime(date_naissance, "%Y-%m-%d").date()
-                except Exception:
-                    dn = None
-
-            qid = int(quartier_id) if quartier_id else None
-            if (ville or "").strip().lower() != "creil":
-                qid = None
+                    run_write(lambda: db.session.add(p))
+                except WriteBusyError:
+                    flash("Base occupée (émargements simultanés) : réessaie dans un instant.", "danger")
+                    return redirect(url_for("activite.emargement", session_id=session_id))
+                return sub.done(
+                    url_for("activite.emargement", session_id=session_id, highlight=p.id),
+                    ("Participant créé.", "success"),
+                )
 
-            p = Participant(
-                nom=nom,
-                prenom=prenom,
-                ville=ville,
-                adresse=adresse,
-                email=email,
-                telephone=telephone,
-                genre=genre,
-                date_naissance=dn,
-                quartier_id=qid,
-                type_public=type_public,
-            )
-            db.session.add(p)
-            db.session.commit()
-            flash("Participant créé.", "success")
-            return redirect(url_for("activite.emargement", session_id=session_id, highlight=p.id))
-
-        if action == "emarger":
-            participant_id = request.form.get("participant_id")
-            motif = request.form.get("motif") or None
-            motif_autre = (request.form.get("motif_autre") or "").strip() or None
-            signature_data = request.form.get("signature_data")
-
-            if not participant_id:
-                flash("Choisis un participant.", "danger")
-                return redirect(url_for("activite.emargement", session_id=session_id))
-            participant = Participant.query.get(int(participant_id))
-            if not participant:
-                flash("Participant introuvable.", "danger")
-                return redirect(url_for("activite.emargement", session_id=session_id))
+            if action == "emarger":
+                participant_id = request.form.get("participant_id")
+                motif = request.form.get("motif") or None
+                motif_autre = (request.form.get("motif_autre") or "").strip() or None
+                signature_data = request.form.get("signature_data")
+
+                if not participant_id:
+                    flash("Choisis un participant.", "danger")
+                    return redirect(url_for("activite.emargement", session_id=session_id))
+                participant = Participant.query.get(int(participant_id))
+                if not participant:
+                    flash("Participant introuvable.", "danger")
+                    return redirect(url_for("activite.emargement", session_id=session_id))
+
+                sig_path = None
+                if signature_data and signature_data.startswith("data:image"):
+                    try:
+                        header, b64data = signature_data.split(",", 1)
+                        binary = base64.b64decode(b64data)
+                        sig_dir = os.path.join(current_app.instance_path, "signatures_tmp")
+                        os.makedirs(sig_dir, exist_ok=True)
+                        sig_filename = f"sig_s{session_id}_p{participant.id}_{int(datetime.utcnow().timestamp())}.png"
+                        sig_path = os.path.join(sig_dir, sig_filename)
+                        with open(sig_path, "wb") as f:
+                            f.write(binary)
+                    except Exception:
+                        sig_path = None
+
+                def _upsert_presence():
+                    pr = PresenceActivite.query.filter_by(session_id=session_id, participant_id=participant.id).first()
+                    if pr:
+                        pr.motif = motif
+                        pr.motif_autre = motif_autre
+                        if sig_path:
+                            pr.signature_path = sig_path
+                    else:
+                        db.session.add(PresenceActivite(
+                            session_id=session_id,
+                            participant_id=participant.id,
+                            motif=motif,
+                            motif_autre=motif_autre,
+                            signature_path=sig_path,
+                        ))
 
-            sig_path = None
-            if signature_data and signature_data.startswith("data:image"):
                 try:
-                    header, b64data = signature_data.split(",", 1)
-                    binary = base64.b64decode(b64data)
-                    sig_dir = os.path.join(current_app.instance_path, "signatures_tmp")
-                    os.makedirs(sig_dir, exist_ok=True)
-                    sig_filename = f"sig_s{session_id}_p{participant.id}_{int(datetime.utcnow().timestamp())}.png"
-                    sig_path = os.path.join(sig_dir, sig_filename)
-                    with open(sig_path, "wb") as f:
-                        f.write(binary)
-                except Exception:
-                    sig_path = None
-
-            try:
-                pr = PresenceActivite.query.filter_by(session_id=session_id, participant_id=participant.id).first()
-                if pr:
-                    pr.motif = motif
-                    pr.motif_autre = motif_autre
-                    if sig_path:
-                        pr.signature_path = sig_path
-                else:
-                    pr = PresenceActivite(
-                        session_id=session_id,
-                        participant_id=participant.id,
-                        motif=motif,
-                        motif_autre=motif_autre,
-                        signature_path=sig_path,
+                    run_write(_upsert_presence, serialize=True)
+                except IntegrityError:
+                    discard_signature(sig_path)
+                    # course avec le kiosque : la présence vient d'être créée ailleurs
+                    return sub.done(
+                        url_for("activite.emargement", session_id=session_id),
+                        ("Ce participant vient d'être émargé sur cette session (kiosque).", "warning"),
                     )
-                    db.session.add(pr)
-                db.session.commit()
-            except Exception:
-                db.session.rollback()
-                flash("Impossible d'enregistrer l'émargement (conflit ou erreur).", "danger")
-                return redirect(url_for("activite.emargement", session_id=session_id))
-
-            # Post actions: update monthly docx for individuel
-            if s.session_type == "INDIVIDUEL_MENSUEL":
-                _ensure_month_capacity(atelier, s)
-                generate_individuel_mensuel_docx(app=current_app, atelier=atelier, annee=s.rdv_date.year, mois=s.rdv_date.month)
-
-            flash("Émargement enregistré.", "success")
-            return redirect(url_for("activite.emargement", session_id=session_id))
-
-    # participants list for autocomplete
-    participants = Participant.query.order_by(Participant.nom.asc(), Participant.prenom.asc()).limit(500).all()
+                except WriteBusyError:
+                    discard_signature(sig_path)
+                    flash("Base occupée (émargements simultanés) : réessaie dans un instant.", "danger")
+                    return redirect(url_for("activite.emargement", session_id=session_id))
+                except Exception:
+                    discard_signature(sig_path)
+                    flash("Impossible d'enregistrer l'émargement (erreur).", "danger")
+                    return redirect(url_for("activite.emargement", session_id=session_id))
+
+                live.publish_presences(s.id, PresenceActivite.query.filter_by(
+                    session_id=session_id, participant_id=participant.id).all())
+                sub.record({
+                    "redirect": url_for("activite.emargement", session_id=session_id),
+                    "flashes": [("Émargement enregistré.", "success")],
+                })
+
+                # Post actions: update monthly docx for individuel
+                if s.session_type == "INDIVIDUEL_MENSUEL":
+                    _ensure_month_capacity(atelier, s)
+                    generate_individuel_mensuel_docx(app=current_app, atelier=atelier, annee=s.rdv_date.year, mois=s.rdv_date.month)
+
+                return sub.replay()
+
+    highlight = request.args.get("highlight", type=int)
+    highlight_participant = db.session.get(Participant, highlight) if highlight else None
     motifs = atelier.motifs() or []
     presences = PresenceActivite.query.filter_by(session_id=session_id).order_by(PresenceActivite.created_at.asc()).all()
     session_objectifs = Objectif.query.filter_by(session_id=s.id, type="operationnel").order_by(Objectif.created_at.asc()).all()
@@ -944,7 +1038,7 @@ def emargement(session_id: int):
         secteur=secteur,
         atelier=atelier,
         session=s,
-        participants=participants,
+        highlight_participant=highlight_participant,
         presences=presences,
         motifs=motifs,
         quartiers=quartiers,
@@ -956,6 +1050,84 @@ def emargement(session_id: int):
 
 
 
+def _live_session_or_403(session_id: int) -> SessionActivite:
+    s = SessionActivite.query.get_or_404(session_id)
+    if not _is_admin_global() and s.secteur != _user_secteur():
+        abort(403)
+    return s
+
+
+@bp.route("/session/<int:session_id>/presences.json")
+@login_required
+def presences_json(session_id: int):
+    """Polling : présences de la session (repli quand le flux SSE n'est pas disponible)."""
+    s = _live_session_or_403(session_id)
+    return jsonify({"session_id": s.id, "presences": session_presences(s.id)})
+
+
+@bp.route("/session/<int:session_id>/participants.json")
+@login_required
+def participants_lookup(session_id: int):
+    """Auto-complétion du participant à émarger (recherche paginée par curseur)."""
+    _live_session_or_403(session_id)
+    q = (request.args.get("q") or "").strip()
+    if len(q) < 2:
+        return jsonify({"items": [], "next_cursor": None})
+    cursor, per_page = page_args(default_per_page=20)
+    page = keyset_paginate(
+        Participant.query.filter(_participant_search_clause(q)),
+        _PARTICIPANT_KEYS,
+        cursor,
+        per_page,
+        count=False,
+    )
+    return jsonify({
+        "items": [
+            {"id": p.id, "label": f"{p.nom} {p.prenom}" + (f" · {p.ville}" if p.ville else "")}
+            for p in page.items
+        ],
+        "next_cursor": page.next_cursor,
+    })
+
+
+@bp.route("/session/<int:session_id>/presences/stream")
+@login_required
+def presences_stream(session_id: int):
+    """Flux SSE des présences commitées (kiosque, lot tablette, animateur)."""
+    s = _live_session_or_403(session_id)
+    sid = s.id
+    db.session.rollback()  # ne pas garder de transaction ouverte pendant le flux
+
+    def _events():
+        with live.subscribe(sid) as q:
+            if q is None:
+                yield live.sse("fallback", {"poll": live.POLL_INTERVAL_SECONDS})
+                return
+            yield "retry: 3000\n\n"
+            fp = live.presence_fingerprint(sid)
+            db.session.rollback()
+            got_event = False
+            deadline = time.monotonic() + live.STREAM_LIFETIME_SECONDS
+            while time.monotonic() < deadline:
+                try:
+                    event, data = q.get(timeout=live.KEEPALIVE_SECONDS)
+                    got_event = True
+                    yield live.sse(event, data)
+                except queue.Empty:
+                    # écriture faite par un autre processus ? -> le client recharge la liste
+                    cur = live.presence_fingerprint(sid)
+                    db.session.rollback()
+                    if cur != fp and not got_event:
+                        yield live.sse("resync", {})
+                    fp, got_event = cur, False
+                    yield ": ping\n\n"
+
+    resp = Response(stream_with_context(_events()), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+
 @bp.route("/session/<int:session_id>/kiosk_open")
 @login_required
 def kiosk_open(session_id: int):
@@ -983,6 +1155,7 @@ def kiosk_open(session_id: int):
     s.kiosk_pin = pin
     s.kiosk_opened_at = datetime.utcnow()
     db.session.commit()
+    bump_kiosk_state()
 
     flash(f"Kiosque ouvert (code: {pin}).", "success")
     return redirect(url_for("activite.emargement", session_id=session_id))
@@ -1002,6 +1175,7 @@ def kiosk_close(session_id: int):
     s.kiosk_pin = None
     s.kiosk_token = None
     db.session.commit()
+    bump_kiosk_state()
 
     flash("Kiosque fermé.", "success")
     return redirect(url_for("activite.emargement", session_id=session_id))
@@ -0,0 +1,283 @@
+"""Reprise d'historique : matrice de présences (participants x dates) -> sessions + présences.
+
+Format attendu : celui de l'export "Excel historique" de statsimpact
+(`_build_magato_per_atelier_workbook`) : une feuille par atelier, ligne de titre
+"Secteur — Atelier", puis en-têtes "Nom", "Prénom", une colonne par date
+(jj/mm/aaaa ou cellule date), et une cellule non vide ("1", "x", "P"…) par présence.
+
+Idempotent : la clé est (atelier, date, participant). Une session existante à la
+même date est réutilisée, un participant est rapproché des fiches existantes
+(index des noms normalisés, voir participants/importer.py), une présence déjà
+saisie n'est pas dupliquée. Relancer le même fichier n'écrit rien.
+
+Écriture par lots (un commit par lot de lignes). Les tables dérivées
+(participant_secteur, index de recherche) suivent via leurs triggers ; le cache
+du kiosque est invalidé une seule fois, en fin d'import.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from datetime import date, datetime, time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.extensions import db
+from app.kiosk.state import bump_kiosk_state
+from app.models import AtelierActivite, Participant, PresenceActivite, SessionActivite
+from app.participants.dedup import normalize_name
+from app.participants.importer import NameIndex, normalize_row, parse_date
+from app.services.db_write import run_write
+
+
+CHUNK_ROWS = 300
+MAX_REPORT_ISSUES = 200
+_ABSENT = {"", "0", "NON", "ABS", "ABSENT", "A", "-"}
+_SKIP_SHEETS = {"SYNTHESE"}
+
+
+@dataclass
+class SheetReport:
+    feuille: str
+    atelier: str = ""
+    lignes: int = 0
+    sessions_creees: int = 0
+    participants_crees: int = 0
+    presences_creees: int = 0
+    presences_existantes: int = 0
+    erreur: str = ""
+
+
+@dataclass
+class HistoriqueReport:
+    dry_run: bool = True
+    feuilles: List[SheetReport] = field(default_factory=list)
+    issues: List[Dict[str, Any]] = field(default_factory=list)
+
+    def issue(self, feuille: str, ligne: int, message: str) -> None:
+        if len(self.issues) < MAX_REPORT_ISSUES:
+            self.issues.append({"feuille": feuille, "ligne": ligne, "message": message})
+
+    def total(self, attr: str) -> int:
+        return sum(getattr(f, attr) for f in self.feuilles)
+
+
+def _session_day(s: SessionActivite) -> Optional[date]:
+    return s.rdv_date or s.date_session
+
+
+def _is_present(v: Any) -> bool:
+    if v is None:
+        return False
+    if isinstance(v, (int, float)):
+        return v != 0
+    s = str(v).strip()
+    # normalize_name retire les chiffres : "1" et "0" sont testés avant
+    return s not in _ABSENT and (s[:1].isdigit() or normalize_name(s) not in _ABSENT)
+
+
+def _parse_header_date(v: Any) -> Optional[date]:
+    try:
+        return parse_date(v)
+    except ValueError:
+        return None
+
+
+def _find_atelier(title: str, sheet_name: str, ateliers: List[AtelierActivite]) -> Optional[AtelierActivite]:
+    """Atelier désigné par la ligne de titre ("Secteur — Atelier"), sinon par le nom de feuille."""
+    by_name = {normalize_name(a.nom): a for a in ateliers}
+    if title:
+        nom = title.split("—", 1)[-1] if "—" in title else title
+        hit = by_name.get(normalize_name(nom))
+        if hit:
+            return hit
+    sheet = normalize_name(sheet_name)
+    for key, a in by_name.items():
+        # le nom de feuille est tronqué à 31 caractères à l'export
+        if sheet and (key == sheet or key.startswith(sheet)):
+            return a
+    return None
+
+
+def _iter_sheets(path: str) -> Iterator[Tuple[str, Iterator[Tuple[Any, ...]]]]:
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            yield ws.title, ws.iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def import_historique(path: str, ateliers: List[AtelierActivite], dry_run: bool = True,
+                      atelier_force: Optional[AtelierActivite] = None,
+                      created_by_user_id: Optional[int] = None) -> HistoriqueReport:
+    """Importe les feuilles de `path` dans les `ateliers` autorisés (périmètre de l'appelant).
+
+    `atelier_force` : toutes les feuilles matrice vont dans cet atelier (fichier
+    d'un seul atelier dont le titre ne correspond pas).
+    """
+    report = HistoriqueReport(dry_run=dry_run)
+    index = NameIndex()
+    touched = False
+
+    for sheet_name, rows in _iter_sheets(path):
+        if normalize_name(sheet_name) in _SKIP_SHEETS:
+            continue
+        sr = SheetReport(feuille=sheet_name)
+
+        title, header, line = "", None, 0
+        for line, row in enumerate(rows, start=1):
+            cells = list(row or ())
+            if len(cells) >= 2 and normalize_name(str(cells[0] or "")) == "NOM" and normalize_name(str(cells[1] or "")) == "PRENOM":
+                header = cells
+                break
+            if not title and cells and cells[0]:
+                title = str(cells[0])
+        if header is None:
+            continue  # pas une matrice (feuille libre)
+
+        atelier = atelier_force or _find_atelier(title, sheet_name, ateliers)
+        if atelier is None:
+            sr.erreur = f"atelier introuvable pour « {title or sheet_name} » dans ce secteur"
+            report.feuilles.append(sr)
+            continue
+        sr.atelier = atelier.nom
+
+        columns: Dict[int, date] = {}
+        for idx, v in enumerate(header[2:], start=2):
+            d = _parse_header_date(v)
+            if d:
+                columns[idx] = d
+            elif v not in (None, ""):
+                report.issue(sheet_name, line, f"colonne « {v} » ignorée (date illisible)")
+
+        # sessions existantes de l'atelier, par jour
+        sessions: Dict[date, int] = {}
+        for s in (
+            SessionActivite.query.filter_by(atelier_id=atelier.id)
+            .filter(SessionActivite.is_deleted.is_(False))
+            .order_by(SessionActivite.id.asc())
+        ):
+            day = _session_day(s)
+            if day and day not in sessions:
+                sessions[day] = s.id
+        missing_days = sorted(set(columns.values()) - set(sessions))
+        sr.sessions_creees = len(missing_days)
+        if missing_days and not dry_run:
+            individuel = atelier.type_atelier == "INDIVIDUEL_MENSUEL"
+            new_sessions = [
+                {
+                    "atelier_id": atelier.id,
+                    "secteur": atelier.secteur,
+                    "session_type": "INDIVIDUEL_MENSUEL" if individuel else "COLLECTIF",
+                    "rdv_date" if individuel else "date_session": d,
+                    "statut": "realisee",
+                    "is_deleted": False,
+                    "created_at": datetime.utcnow(),
+                }
+                for d in missing_days
+            ]
+
+            def _write_sessions(new_sessions=new_sessions):
+                rows_ = [dict(m) for m in new_sessions]
+                db.session.bulk_insert_mappings(SessionActivite, rows_, return_defaults=True)
+                return rows_
+
+            for m in run_write(_write_sessions):
+                sessions[m["rdv_date" if individuel else "date_session"]] = m["id"]
+            touched = True
+
+        session_ids = [sid for sid in sessions.values() if sid]
+        existing_pairs = set(
+            db.session.query(PresenceActivite.participant_id, PresenceActivite.session_id)
+            .filter(PresenceActivite.session_id.in_(session_ids))
+            .all()
+        ) if session_ids else set()
+
+        # lignes participants, par lots
+        pending: List[Tuple[Dict[str, Any], List[date]]] = []
+
+        def _flush(pending: List[Tuple[Dict[str, Any], List[date]]]) -> None:
+            nonlocal touched
+            new_people = [v for v, _days in pending if not v.get("id")]
+            new_people = list({id(v): v for v in new_people}.values())
+            pairs: List[Tuple[Dict[str, Any], date]] = [(v, d) for v, days in pending for d in days]
+            if dry_run:
+                sr.participants_crees += len(new_people)
+                for v in new_people:
+                    v["id"] = -id(v)  # identifiant fictif pour dédoublonner la simulation
+                for v, d in pairs:
+                    key = (v["id"], sessions.get(d) or -d.toordinal())
+                    if key in existing_pairs:
+                        sr.presences_existantes += 1
+                    else:
+                        existing_pairs.add(key)
+                        sr.presences_creees += 1
+                return
+
+            def _write():
+                if new_people:
+                    rows_ = [{k: val for k, val in v.items() if k != "id"} for v in new_people]
+                    db.session.bulk_insert_mappings(Participant, rows_, return_defaults=True)
+                    for v, r in zip(new_people, rows_):
+                        v["id"] = r["id"]
+                presences, seen, already = [], set(), 0
+                for v, d in pairs:
+                    key = (v["id"], sessions[d])
+                    if key in existing_pairs or key in seen:
+                        already += 1
+                        continue
+                    seen.add(key)
+                    presences.append({
+                        "participant_id": v["id"],
+                        "session_id": sessions[d],
+                        "created_at": datetime.combine(d, time(12, 0)),
+                    })
+                if presences:
+                    db.session.bulk_insert_mappings(PresenceActivite, presences)
+                return seen, already
+
+            seen, already = run_write(_write)
+            existing_pairs.update(seen)
+            sr.participants_crees += len(new_people)
+            sr.presences_creees += len(seen)
+            sr.presences_existantes += already
+            touched = touched or bool(seen or new_people)
+
+        for line, row in enumerate(rows, start=line + 1):
+            cells = list(row or ())
+            if not any(c not in (None, "") for c in cells[:2]):
+                continue
+            sr.lignes += 1
+            res = normalize_row(line, {"nom": cells[0], "prenom": cells[1] if len(cells) > 1 else None}, {})
+            if res.error:
+                report.issue(sheet_name, line, res.error)
+                continue
+            days = sorted({d for idx, d in columns.items() if idx < len(cells) and _is_present(cells[idx])})
+            if not days:
+                continue
+            existing, ambiguous = index.match(res.values)
+            if ambiguous:
+                report.issue(sheet_name, line, f"{res.values['nom']} {res.values['prenom']} : plusieurs fiches possibles, ligne ignorée")
+                continue
+            if existing is None:
+                now = datetime.utcnow()
+                existing = dict(res.values)
+                existing.update(
+                    created_secteur=atelier.secteur,
+                    created_by_user_id=created_by_user_id,
+                    created_at=now,
+                    updated_at=now,
+                )
+                index.add(0, existing)
+            pending.append((existing, days))
+            if len(pending) >= CHUNK_ROWS:
+                _flush(pending)
+                pending = []
+        if pending:
+            _flush(pending)
+        report.feuilles.append(sr)
+
+    if touched and not dry_run:
+        bump_kiosk_state()
+    return report
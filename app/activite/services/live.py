@@ -0,0 +1,115 @@
+"""Présences en direct sur l'écran d'émargement de l'animateur.
+
+Pub/sub en mémoire (par session) : chaque écriture de présence commitée
+(kiosque, lot hors-ligne, émargement animateur) publie un événement, que le flux
+SSE `/activite/session/<id>/presences/stream` pousse aux écrans abonnés.
+
+Limites assumées :
+- en mémoire, donc par processus : le flux vérifie aussi périodiquement la base
+  (nb + dernier id) et envoie "resync" si une écriture venue d'ailleurs est détectée ;
+- chaque flux occupe un thread waitress : nombre de flux plafonné et durée de vie
+  courte (le navigateur se reconnecte), au-delà le client passe en polling JSON.
+"""
+from __future__ import annotations
+
+import json
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.extensions import db
+from app.models import Participant, PresenceActivite
+
+
+MAX_STREAMS = 4
+STREAM_LIFETIME_SECONDS = 120
+KEEPALIVE_SECONDS = 10
+POLL_INTERVAL_SECONDS = 10
+
+_lock = threading.Lock()
+_subscribers: Dict[int, List[queue.Queue]] = {}
+
+
+def presence_payload(pr: PresenceActivite, participant: Optional[Participant] = None) -> Dict[str, Any]:
+    p = participant or pr.participant
+    return {
+        "id": pr.id,
+        "participant_id": pr.participant_id,
+        "nom": p.nom if p else "",
+        "prenom": p.prenom if p else "",
+        "ville": (p.ville or "") if p else "",
+        "motif": pr.motif or "",
+        "motif_autre": pr.motif_autre or "",
+        "signature": bool(pr.signature_path),
+        "created_at": str(pr.created_at) if pr.created_at else "",
+    }
+
+
+def session_presences(session_id: int) -> List[Dict[str, Any]]:
+    """Présences de la session (1 requête, participant joint), pour le polling."""
+    rows = (
+        db.session.query(PresenceActivite, Participant)
+        .join(Participant, Participant.id == PresenceActivite.participant_id)
+        .filter(PresenceActivite.session_id == session_id)
+        .order_by(PresenceActivite.created_at.asc(), PresenceActivite.id.asc())
+        .all()
+    )
+    return [presence_payload(pr, p) for pr, p in rows]
+
+
+def presence_fingerprint(session_id: int) -> tuple:
+    """(nb, max id) des présences : détecte une écriture faite par un autre processus."""
+    row = (
+        db.session.query(db.func.count(PresenceActivite.id), db.func.max(PresenceActivite.id))
+        .filter(PresenceActivite.session_id == session_id)
+        .one()
+    )
+    return (int(row[0] or 0), int(row[1] or 0))
+
+
+def publish(session_id: int, event: str, data: Dict[str, Any]) -> None:
+    """Diffuse un événement aux écrans abonnés à la session (à appeler APRÈS commit)."""
+    with _lock:
+        targets = list(_subscribers.get(session_id, ()))
+    for q in targets:
+        try:
+            q.put_nowait((event, data))
+        except queue.Full:
+            # abonné trop lent : il recevra "resync" au prochain contrôle
+            pass
+
+
+def publish_presences(session_id: int, presences: List[PresenceActivite]) -> None:
+    for pr in presences:
+        publish(session_id, "presence", presence_payload(pr))
+
+
+def stream_count() -> int:
+    with _lock:
+        return sum(len(v) for v in _subscribers.values())
+
+
+@contextmanager
+def subscribe(session_id: int) -> Iterator[Optional[queue.Queue]]:
+    """Abonne un flux à la session. Donne None si le plafond de flux est atteint."""
+    q: queue.Queue = queue.Queue(maxsize=200)
+    with _lock:
+        if sum(len(v) for v in _subscribers.values()) >= MAX_STREAMS:
+            q = None
+        else:
+            _subscribers.setdefault(session_id, []).append(q)
+    try:
+        yield q
+    finally:
+        if q is not None:
+            with _lock:
+                subs = _subscribers.get(session_id, [])
+                if q in subs:
+                    subs.remove(q)
+                if not subs:
+                    _subscribers.pop(session_id, None)
+
+
+def sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
@@ -45,7 +45,7 @@ def dashboard():
     kpis = compute_kpis(year, scope)
     series = compute_depenses_mensuelles(year, scope)
     par_secteur = compute_depenses_par_secteur(year, scope)
-    alertes = compute_alertes(year, scope)
+    alertes = compute_alertes(year, scope, kpis=kpis)
 
     multi_secteurs = scope.secteurs is None
 
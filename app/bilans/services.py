@@ -1,11 +1,17 @@
 import datetime
+import threading
+import time
 from dataclasses import dataclass
+from functools import cached_property
 from typing import Dict, List, Optional, Tuple
 
-from sqlalchemy import func
+from flask import g, has_request_context
+from sqlalchemy import and_, case, exists, func, or_
 
 from app.extensions import db
 from app.models import Depense, FactureAchat, FactureLigne, LigneBudget, Subvention, InventaireItem
+from app.services.alertes import count_alertes
+from app.services.data_version import data_versions
 
 
 @dataclass
@@ -55,52 +61,193 @@ def list_exercice_years(scope: BilansScope) -> List[int]:
     return years
 
 
+# ---------------------------------------------------------------------------
+# Agrégats d'une année, par secteur
+#
+# Les vues bilans (tuiles, séries, répartition, qualité, alertes, bilan secteur)
+# dérivent toutes d'une poignée de requêtes groupées par secteur. Le résultat
+# d'une année est partagé entre les calculs d'une requête et mis en cache entre
+# requêtes, indexé par les versions de données (services/data_version.py) ; le
+# périmètre (scope) est appliqué ensuite, en filtrant les secteurs.
+
+CACHE_TTL_SECONDS = 300
+CACHE_MAX_ENTRIES = 32
+
+_lock = threading.Lock()
+# (année, versions) -> (horodatage, agrégats)
+_cache: Dict[Tuple[int, Tuple[Tuple[str, int], ...]], Tuple[float, "YearFacts"]] = {}
+
+
+def _charge_filter():
+    return func.coalesce(LigneBudget.nature, "charge") == "charge"
+
+
+def _in_scope(secteur: Optional[str], scope: BilansScope) -> bool:
+    return scope.secteurs is None or secteur in scope.secteurs
+
+
+class YearFacts:
+    """Agrégats d'une année par secteur ; chaque groupe est calculé à la première lecture."""
+
+    def __init__(self, year: int):
+        self.year = year
+        self.start, self.end = _year_bounds(year)
+
+    @cached_property
+    def depenses(self) -> List[Tuple[Optional[str], Optional[int], float, int, float]]:
+        """(secteur, mois, dépenses exercice, nb dépenses exercice, dépenses du mois dans l'année).
+
+        Dépenses validées de charges. "Exercice" : subvention de l'année ; "mois" :
+        date de facture, sinon de paiement, sinon de saisie, dans l'année civile.
+        """
+        date_expr = func.coalesce(
+            FactureAchat.date_facture,
+            Depense.date_paiement,
+            func.date(Depense.created_at),
+        )
+        in_year = and_(date_expr >= self.start, date_expr < self.end)
+        of_exercice = Subvention.annee_exercice == self.year
+        month_expr = func.strftime("%m", date_expr)
+        rows = (
+            db.session.query(
+                Subvention.secteur,
+                case((in_year, month_expr), else_=None).label("mois"),
+                func.sum(case((of_exercice, Depense.montant), else_=0.0)),
+                func.sum(case((of_exercice, 1), else_=0)),
+                func.sum(case((in_year, Depense.montant), else_=0.0)),
+            )
+            .select_from(Depense)
+            .join(LigneBudget, Depense.ligne_budget_id == LigneBudget.id)
+            .join(Subvention, LigneBudget.subvention_id == Subvention.id)
+            .outerjoin(FactureLigne, Depense.facture_ligne_id == FactureLigne.id)
+            .outerjoin(FactureAchat, FactureLigne.facture_id == FactureAchat.id)
+            .filter(Depense.est_supprimee.is_(False))
+            .filter(Depense.statut == "valide")
+            .filter(_charge_filter())
+            .filter(or_(of_exercice, in_year))
+            .group_by(Subvention.secteur, "mois")
+            .all()
+        )
+        return [
+            (sec, int(m) if m else None, float(dep or 0.0), int(nb or 0), float(dep_mois or 0.0))
+            for sec, m, dep, nb, dep_mois in rows
+        ]
+
+    @cached_property
+    def budget(self) -> Dict[Optional[str], float]:
+        """Budget réel des lignes de charge des subventions de l'année, par secteur."""
+        rows = (
+            db.session.query(Subvention.secteur, func.coalesce(func.sum(LigneBudget.montant_reel), 0.0))
+            .join(Subvention, LigneBudget.subvention_id == Subvention.id)
+            .filter(_charge_filter())
+            .filter(Subvention.annee_exercice == self.year)
+            .group_by(Subvention.secteur)
+            .all()
+        )
+        return {sec: float(v or 0.0) for sec, v in rows}
+
+    @cached_property
+    def a_ventiler(self) -> Dict[Optional[str], Tuple[int, float, float]]:
+        """Lignes de facture 'à ventiler' de l'année, par secteur : (nb, montant, somme des âges en jours)."""
+        rows = (
+            db.session.query(
+                FactureLigne.secteur,
+                func.count(FactureLigne.id),
+                func.coalesce(func.sum(FactureLigne.montant_ligne), 0.0),
+                func.sum(func.julianday(func.current_date()) - func.julianday(FactureAchat.date_facture)),
+            )
+            .join(FactureAchat, FactureLigne.facture_id == FactureAchat.id)
+            .filter(FactureLigne.a_ventiler.is_(True))
+            .filter(FactureAchat.date_facture >= self.start)
+            .filter(FactureAchat.date_facture < self.end)
+            .group_by(FactureLigne.secteur)
+            .all()
+        )
+        return {sec: (int(n or 0), float(mt or 0.0), float(age or 0.0)) for sec, n, mt, age in rows}
+
+    @cached_property
+    def factures(self) -> Dict[Optional[str], Tuple[int, int]]:
+        """Factures de l'année par secteur principal : (nb, nb sans inventaire lié).
+
+        "Sans inventaire" : anti-jointure (NOT EXISTS) sur lignes de facture ⨝ inventaire.
+        """
+        has_inventaire = (
+            exists()
+            .where(FactureLigne.facture_id == FactureAchat.id)
+            .where(InventaireItem.facture_ligne_id == FactureLigne.id)
+        )
+        rows = (
+            db.session.query(
+                FactureAchat.secteur_principal,
+                func.count(FactureAchat.id),
+                func.sum(case((~has_inventaire, 1), else_=0)),
+            )
+            .filter(FactureAchat.date_facture >= self.start)
+            .filter(FactureAchat.date_facture < self.end)
+            .group_by(FactureAchat.secteur_principal)
+            .all()
+        )
+        return {sec: (int(n or 0), int(sans or 0)) for sec, n, sans in rows}
+
+    @cached_property
+    def hors_subvention(self) -> Tuple[int, float]:
+        """Dépenses validées de l'année sans ligne budgétaire : (nb, montant), tous secteurs."""
+        date_expr = func.coalesce(Depense.date_paiement, func.date(Depense.created_at))
+        nb, mt = (
+            db.session.query(func.count(Depense.id), func.coalesce(func.sum(Depense.montant), 0.0))
+            .filter(Depense.est_supprimee.is_(False))
+            .filter(Depense.statut == "valide")
+            .filter(Depense.ligne_budget_id.is_(None))
+            .filter(date_expr >= self.start)
+            .filter(date_expr < self.end)
+            .one()
+        )
+        return int(nb or 0), float(mt or 0.0)
+
+
+def year_facts(year: int) -> YearFacts:
+    """Agrégats de l'année : un seul objet par requête HTTP, en cache entre requêtes
+    tant que les données n'ont pas changé."""
+    memo = g.setdefault("bilans_year_facts", {}) if has_request_context() else {}
+    if year in memo:
+        return memo[year]
+
+    versions = tuple(sorted(data_versions().items()))
+    key = (int(year), versions)
+    now = time.monotonic()
+    with _lock:
+        hit = _cache.get(key)
+        if hit and (now - hit[0]) < CACHE_TTL_SECONDS:
+            facts = hit[1]
+        else:
+            stale = [k for k in _cache if k[1] != versions or now - _cache[k][0] >= CACHE_TTL_SECONDS]
+            for k in stale:
+                del _cache[k]
+            if len(_cache) >= CACHE_MAX_ENTRIES:
+                _cache.clear()
+            facts = YearFacts(int(year))
+            _cache[key] = (now, facts)
+    memo[year] = facts
+    return facts
+
+
+def clear_cache() -> None:
+    with _lock:
+        _cache.clear()
+
+
 def compute_kpis(year: int, scope: BilansScope) -> Dict[str, float]:
     """KPIs globaux (tuiles)."""
-    start, end = _year_bounds(year)
-
-    # Dépenses validées (charges) sur l'année : via Depense + LigneBudget(nature=charge)
-    q_dep = (
-        db.session.query(func.coalesce(func.sum(Depense.montant), 0.0))
-        .join(LigneBudget, Depense.ligne_budget_id == LigneBudget.id)
-        .join(Subvention, LigneBudget.subvention_id == Subvention.id)
-        .filter(Depense.est_supprimee.is_(False))
-        .filter(Depense.statut == "valide")
-        .filter(func.coalesce(LigneBudget.nature, "charge") == "charge")
-        .filter(Subvention.annee_exercice == year)
-    )
-    q_dep = _apply_secteur_filter(q_dep, scope, Subvention.secteur)
-    depenses = float(q_dep.scalar() or 0.0)
+    facts = year_facts(year)
 
+    # Dépenses validées (charges) des subventions de l'année
+    depenses = sum(dep for sec, _m, dep, _nb, _dm in facts.depenses if _in_scope(sec, scope))
     # Budget disponible = total des lignes "montant_reel" (charges) sur les subventions de l'année
-    q_budget = (
-        db.session.query(func.coalesce(func.sum(LigneBudget.montant_reel), 0.0))
-        .join(Subvention, LigneBudget.subvention_id == Subvention.id)
-        .filter(func.coalesce(LigneBudget.nature, "charge") == "charge")
-        .filter(Subvention.annee_exercice == year)
-    )
-    q_budget = _apply_secteur_filter(q_budget, scope, Subvention.secteur)
-    budget = float(q_budget.scalar() or 0.0)
-
+    budget = sum(v for sec, v in facts.budget.items() if _in_scope(sec, scope))
     # À ventiler = somme des lignes de facture marquées a_ventiler sur l'année (date facture)
-    q_av = (
-        db.session.query(func.coalesce(func.sum(FactureLigne.montant_ligne), 0.0))
-        .join(FactureAchat, FactureLigne.facture_id == FactureAchat.id)
-        .filter(FactureLigne.a_ventiler.is_(True))
-        .filter(FactureAchat.date_facture >= start)
-        .filter(FactureAchat.date_facture < end)
-    )
-    q_av = _apply_secteur_filter(q_av, scope, FactureLigne.secteur)
-    a_ventiler = float(q_av.scalar() or 0.0)
-
+    a_ventiler = sum(mt for sec, (_n, mt, _age) in facts.a_ventiler.items() if _in_scope(sec, scope))
     # Nombre factures (sur l'année)
-    q_fact = (
-        db.session.query(func.count(FactureAchat.id))
-        .filter(FactureAchat.date_facture >= start)
-        .filter(FactureAchat.date_facture < end)
-    )
-    q_fact = _apply_secteur_filter(q_fact, scope, FactureAchat.secteur_principal)
-    nb_factures = int(q_fact.scalar() or 0)
+    nb_factures = sum(n for sec, (n, _sans) in facts.factures.items() if _in_scope(sec, scope))
 
     taux_exec = (depenses / budget * 100.0) if budget > 0 else 0.0
     reste = budget - depenses
@@ -116,62 +263,33 @@ def compute_kpis(year: int, scope: BilansScope) -> Dict[str, float]:
 
 
 def compute_depenses_mensuelles(year: int, scope: BilansScope) -> List[Dict[str, float]]:
-    """Séries mensuelles des dépenses (année en cours)."""
-    start, end = _year_bounds(year)
+    """Séries mensuelles des dépenses (année en cours).
 
-    # On essaye d'utiliser la date de facture si la dépense provient d'une ligne de facture,
-    # sinon fallback date_paiement, sinon created_at.
-    date_expr = func.coalesce(
-        FactureAchat.date_facture,
-        Depense.date_paiement,
-        func.date(Depense.created_at),
-    )
-    month_expr = func.strftime("%m", date_expr)
-
-    q = (
-        db.session.query(month_expr.label("mois"), func.coalesce(func.sum(Depense.montant), 0.0).label("total"))
-        .select_from(Depense)
-        .join(LigneBudget, Depense.ligne_budget_id == LigneBudget.id)
-        .join(Subvention, LigneBudget.subvention_id == Subvention.id)
-        .outerjoin(FactureLigne, Depense.facture_ligne_id == FactureLigne.id)
-        .outerjoin(FactureAchat, FactureLigne.facture_id == FactureAchat.id)
-        .filter(Depense.est_supprimee.is_(False))
-        .filter(Depense.statut == "valide")
-        .filter(func.coalesce(LigneBudget.nature, "charge") == "charge")
-        .filter(date_expr >= start)
-        .filter(date_expr < end)
-    )
-    # filtre secteur : via Subvention.secteur (car Depense rattachée à ligne budget)
-    q = _apply_secteur_filter(q, scope, Subvention.secteur)
-    q = q.group_by(month_expr).order_by(month_expr)
-
-    by_month = {int(m): float(t or 0.0) for m, t in q.all() if m is not None}
-    out = []
-    for m in range(1, 13):
-        out.append({"mois": m, "total": round(by_month.get(m, 0.0), 2)})
-    return out
+    Date de facture si la dépense provient d'une ligne de facture, sinon date de
+    paiement, sinon date de saisie.
+    """
+    by_month: Dict[int, float] = {}
+    for sec, m, _dep, _nb, dep_mois in year_facts(year).depenses:
+        if m is not None and _in_scope(sec, scope):
+            by_month[m] = by_month.get(m, 0.0) + dep_mois
+    return [{"mois": m, "total": round(by_month.get(m, 0.0), 2)} for m in range(1, 13)]
 
 
 def compute_depenses_par_secteur(year: int, scope: BilansScope) -> List[Dict[str, float]]:
     """Répartition des dépenses par secteur."""
-    q = (
-        db.session.query(Subvention.secteur, func.coalesce(func.sum(Depense.montant), 0.0))
-        .join(LigneBudget, Depense.ligne_budget_id == LigneBudget.id)
-        .join(Subvention, LigneBudget.subvention_id == Subvention.id)
-        .filter(Depense.est_supprimee.is_(False))
-        .filter(Depense.statut == "valide")
-        .filter(func.coalesce(LigneBudget.nature, "charge") == "charge")
-        .filter(Subvention.annee_exercice == year)
-        .group_by(Subvention.secteur)
-        .order_by(func.coalesce(func.sum(Depense.montant), 0.0).desc())
-    )
-    q = _apply_secteur_filter(q, scope, Subvention.secteur)
-    return [{"secteur": s, "total": round(float(t or 0.0), 2)} for s, t in q.all()]
-
-
-def compute_alertes(year: int, scope: BilansScope, seuil_ventiler: float = 500.0) -> List[Dict[str, str]]:
-    """Alertes 'aide' (non bloquantes)."""
-    kpis = compute_kpis(year, scope)
+    totals: Dict[Optional[str], float] = {}
+    for sec, _m, dep, nb, _dm in year_facts(year).depenses:
+        if nb and _in_scope(sec, scope):
+            totals[sec] = totals.get(sec, 0.0) + dep
+    ordered = sorted(totals.items(), key=lambda kv: (-kv[1], kv[0] or ""))
+    return [{"secteur": s, "total": round(t, 2)} for s, t in ordered]
+
+
+def compute_alertes(year: int, scope: BilansScope, seuil_ventiler: float = 500.0,
+                    kpis: Optional[Dict[str, float]] = None) -> List[Dict[str, str]]:
+    """Alertes 'aide' (non bloquantes). `kpis` : ceux déjà calculés par l'appelant."""
+    if kpis is None:
+        kpis = compute_kpis(year, scope)
     alertes: List[Dict[str, str]] = []
 
     # À ventiler
@@ -198,31 +316,14 @@ def compute_alertes(year: int, scope: BilansScope, seuil_ventiler: float = 500.0
             "detail": f"Taux d'exécution {kpis['taux_exec']:.1f}% au {today.strftime('%d/%m/%Y')}",
         })
 
-    # Factures sans inventaire associé (aide)
-    start, end = _year_bounds(year)
-    q_fact = (
-        db.session.query(FactureAchat.id)
-        .filter(FactureAchat.date_facture >= start)
-        .filter(FactureAchat.date_facture < end)
-    )
-    q_fact = _apply_secteur_filter(q_fact, scope, FactureAchat.secteur_principal)
-    facture_ids = [fid for (fid,) in q_fact.all()]
-    if facture_ids:
-        q_with_inv = (
-            db.session.query(FactureAchat.id)
-            .join(FactureLigne, FactureLigne.facture_id == FactureAchat.id)
-            .join(InventaireItem, InventaireItem.facture_ligne_id == FactureLigne.id)
-            .filter(FactureAchat.id.in_(facture_ids))
-            .distinct()
-        )
-        have_inv = set([fid for (fid,) in q_with_inv.all()])
-        missing = len([fid for fid in facture_ids if fid not in have_inv])
-        if missing > 0:
-            alertes.append({
-                "niveau": "info",
-                "titre": "Factures sans inventaire lié",
-                "detail": f"{missing} facture(s) sans entrée inventaire associée.",
-            })
+    # Factures sans inventaire associé (aide) : table `alerte`, tenue à jour par services/alertes.py
+    missing = count_alertes("facture_sans_inventaire", annee=year, secteurs=scope.secteurs)
+    if missing > 0:
+        alertes.append({
+            "niveau": "info",
+            "titre": "Factures sans inventaire lié",
+            "detail": f"{missing} facture(s) sans entrée inventaire associée.",
+        })
 
     return alertes
 
@@ -464,66 +565,32 @@ def compute_bilan_subvention(year: int, subvention_id: int, scope: BilansScope)
 
 def compute_qualite_gestion(year: int, scope: BilansScope) -> Dict[str, object]:
     """Indicateurs 'qualité de gestion' (aide, non bloquant)."""
-    start, end = _year_bounds(year)
+    facts = year_facts(year)
 
     # Lignes à ventiler (compteur, montant, ancienneté moyenne en jours)
-    q = (
-        db.session.query(
-            func.count(FactureLigne.id),
-            func.coalesce(func.sum(FactureLigne.montant_ligne), 0.0),
-            func.avg(func.julianday(func.current_date()) - func.julianday(FactureAchat.date_facture)),
-        )
-        .join(FactureAchat, FactureLigne.facture_id == FactureAchat.id)
-        .filter(FactureLigne.a_ventiler.is_(True))
-        .filter(FactureAchat.date_facture >= start)
-        .filter(FactureAchat.date_facture < end)
-    )
-    q = _apply_secteur_filter(q, scope, FactureLigne.secteur)
-    nb_av, mt_av, avg_days = q.one()
+    nb_av, mt_av, age_av = 0, 0.0, 0.0
+    for sec, (n, mt, age) in facts.a_ventiler.items():
+        if _in_scope(sec, scope):
+            nb_av += n
+            mt_av += mt
+            age_av += age
 
-    # Dépenses sans subvention (hors subvention / fonds propres)
-    q_hs = (
-        db.session.query(func.count(Depense.id), func.coalesce(func.sum(Depense.montant), 0.0))
-        .filter(Depense.est_supprimee.is_(False))
-        .filter(Depense.statut == "valide")
-        .filter(Depense.ligne_budget_id.is_(None))
-        .filter(func.coalesce(Depense.date_paiement, func.date(Depense.created_at)) >= start)
-        .filter(func.coalesce(Depense.date_paiement, func.date(Depense.created_at)) < end)
-    )
-    # Filtre secteur : on passe par Depense.secteur si présent, sinon rien
-    if hasattr(Depense, "secteur"):
-        q_hs = _apply_secteur_filter(q_hs, scope, Depense.secteur)
-    nb_hs, mt_hs = q_hs.one()
+    # Dépenses sans subvention (hors subvention / fonds propres) : Depense n'a pas
+    # de secteur, le compteur n'est donc pas filtré par périmètre
+    nb_hs, mt_hs = facts.hors_subvention
 
     # Factures sans inventaire
-    q_fact = (
-        db.session.query(FactureAchat.id)
-        .filter(FactureAchat.date_facture >= start)
-        .filter(FactureAchat.date_facture < end)
-    )
-    q_fact = _apply_secteur_filter(q_fact, scope, FactureAchat.secteur_principal)
-    facture_ids = [fid for (fid,) in q_fact.all()]
-    missing_inv = 0
-    if facture_ids:
-        q_with_inv = (
-            db.session.query(FactureAchat.id)
-            .join(FactureLigne, FactureLigne.facture_id == FactureAchat.id)
-            .join(InventaireItem, InventaireItem.facture_ligne_id == FactureLigne.id)
-            .filter(FactureAchat.id.in_(facture_ids))
-            .distinct()
-        )
-        have_inv = set([fid for (fid,) in q_with_inv.all()])
-        missing_inv = len([fid for fid in facture_ids if fid not in have_inv])
+    missing_inv = sum(sans for sec, (_n, sans) in facts.factures.items() if _in_scope(sec, scope))
 
     return {
         "a_ventiler": {
-            "nb": int(nb_av or 0),
-            "montant": round(float(mt_av or 0.0), 2),
-            "age_moyen_jours": int(round(float(avg_days or 0.0))) if avg_days is not None else 0,
+            "nb": int(nb_av),
+            "montant": round(mt_av, 2),
+            "age_moyen_jours": int(round(age_av / nb_av)) if nb_av else 0,
         },
         "hors_subvention": {
-            "nb": int(nb_hs or 0),
-            "montant": round(float(mt_hs or 0.0), 2),
+            "nb": int(nb_hs),
+            "montant": round(mt_hs, 2),
         },
         "factures": {
             "sans_inventaire": int(missing_inv),
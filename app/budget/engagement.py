@@ -0,0 +1,141 @@
+"""Engagé dénormalisé : `ligne_budget.engage_cache / nb_depenses` et cumul sur `subvention`.
+
+L'engagé d'une ligne (somme brute des dépenses non supprimées, arrondie à la
+lecture comme avant) et son nombre de dépenses sont stockés sur la ligne ; la subvention porte la somme
+des engagés de ses lignes de charge et le total des dépenses. `LigneBudget.engage`
+et `Subvention.total_engage` deviennent des lectures de colonne.
+
+Tenue à jour par des triggers SQLite (même principe que participant_secteur) :
+création, modification, suppression (ou soft-delete / restauration via
+`est_supprimee`) d'une dépense, y compris celles créées à la validation d'une
+facture, recalculent la ligne dans la même transaction ; la ligne recalcule sa
+subvention. Le recalcul est exact (pas d'incrément) et ne lit que les dépenses
+d'une ligne (index sur depense.ligne_budget_id).
+
+`flask finance check-engage` compare les colonnes au calcul direct et signale
+(ou corrige avec `--fix`) les écarts.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import List
+
+from sqlalchemy import text
+
+from app.extensions import db
+
+
+_ACTIVE = "COALESCE(d.est_supprimee, 0) = 0"
+
+
+def _recompute_ligne(ligne_expr: str, extra_where: str = "") -> str:
+    return (
+        "UPDATE ligne_budget SET"
+        f" engage_cache = (SELECT COALESCE(SUM(d.montant), 0) FROM depense d"
+        f" WHERE d.ligne_budget_id = {ligne_expr} AND {_ACTIVE}),"
+        f" nb_depenses = (SELECT COUNT(*) FROM depense d WHERE d.ligne_budget_id = {ligne_expr} AND {_ACTIVE})"
+        f" WHERE id = {ligne_expr}{extra_where};"
+    )
+
+
+def _recompute_subvention(sub_expr: str, extra_where: str = "") -> str:
+    return (
+        "UPDATE subvention SET"
+        f" engage_cache = (SELECT COALESCE(SUM(l.engage_cache), 0) FROM ligne_budget l"
+        f" WHERE l.subvention_id = {sub_expr} AND l.nature = 'charge'),"
+        f" nb_depenses = (SELECT COALESCE(SUM(l.nb_depenses), 0) FROM ligne_budget l WHERE l.subvention_id = {sub_expr})"
+        f" WHERE id = {sub_expr}{extra_where};"
+    )
+
+
+_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS engage_depense_ai AFTER INSERT ON depense BEGIN "
+    + _recompute_ligne("new.ligne_budget_id")
+    + " END",
+    "CREATE TRIGGER IF NOT EXISTS engage_depense_ad AFTER DELETE ON depense BEGIN "
+    + _recompute_ligne("old.ligne_budget_id")
+    + " END",
+    # montant modifié, soft-delete / restauration, dépense changée de ligne
+    "CREATE TRIGGER IF NOT EXISTS engage_depense_au AFTER UPDATE OF montant, est_supprimee, ligne_budget_id"
+    " ON depense BEGIN "
+    + _recompute_ligne("new.ligne_budget_id")
+    + " "
+    + _recompute_ligne("old.ligne_budget_id", " AND old.ligne_budget_id IS NOT new.ligne_budget_id")
+    + " END",
+    # ligne : engagé recalculé, nature changée, ligne déplacée -> cumul subvention
+    "CREATE TRIGGER IF NOT EXISTS engage_ligne_au AFTER UPDATE OF engage_cache, nb_depenses, nature, subvention_id"
+    " ON ligne_budget WHEN old.engage_cache IS NOT new.engage_cache OR old.nb_depenses IS NOT new.nb_depenses"
+    " OR old.nature IS NOT new.nature OR old.subvention_id IS NOT new.subvention_id BEGIN "
+    + _recompute_subvention("new.subvention_id")
+    + " "
+    + _recompute_subvention("old.subvention_id", " AND old.subvention_id IS NOT new.subvention_id")
+    + " END",
+    "CREATE TRIGGER IF NOT EXISTS engage_ligne_ad AFTER DELETE ON ligne_budget BEGIN "
+    + _recompute_subvention("old.subvention_id")
+    + " END",
+]
+
+
+def rebuild_engagement() -> None:
+    """Recalcule toutes les lignes puis toutes les subventions (sous-requêtes corrélées)."""
+    db.session.execute(text(_recompute_ligne("ligne_budget.id")))
+    db.session.execute(text(_recompute_subvention("subvention.id")))
+    db.session.commit()
+
+
+def ensure_engagement() -> None:
+    """Pose l'index et les triggers (après create_all) ; remplit les colonnes au premier passage."""
+    try:
+        db.session.execute(text("CREATE INDEX IF NOT EXISTS idx_depense_ligne ON depense(ligne_budget_id)"))
+        existing = {
+            row[0]
+            for row in db.session.execute(
+                text("SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE 'engage_%'")
+            ).all()
+        }
+        for sql in _TRIGGERS:
+            db.session.execute(text(sql))
+        db.session.commit()
+        if not existing:
+            rebuild_engagement()
+    except Exception:
+        db.session.rollback()
+
+
+@dataclass
+class Drift:
+    kind: str  # "ligne" | "subvention"
+    id: int
+    libelle: str
+    engage_cache: float
+    engage_reel: float
+    nb_cache: int
+    nb_reel: int
+
+
+def check_engagement() -> List[Drift]:
+    """Compare les colonnes dénormalisées au calcul direct depuis les dépenses."""
+    drifts: List[Drift] = []
+    rows = db.session.execute(text(
+        "SELECT l.id, l.compte || ' ' || l.libelle, COALESCE(l.engage_cache, 0), COALESCE(l.nb_depenses, 0),"
+        " COALESCE(SUM(d.montant), 0), COUNT(d.id)"
+        " FROM ligne_budget l LEFT JOIN depense d ON d.ligne_budget_id = l.id AND " + _ACTIVE +
+        " GROUP BY l.id"
+    )).all()
+    for lid, libelle, cache, nb_cache, reel, nb_reel in rows:
+        if abs(float(cache) - float(reel)) >= 0.005 or int(nb_cache) != int(nb_reel):
+            drifts.append(Drift("ligne", lid, libelle, float(cache), float(reel), int(nb_cache), int(nb_reel)))
+
+    # subventions : comparées au calcul direct (pas aux lignes, qui peuvent elles-mêmes dériver)
+    rows = db.session.execute(text(
+        "SELECT s.id, s.nom, COALESCE(s.engage_cache, 0), COALESCE(s.nb_depenses, 0),"
+        " (SELECT COALESCE(SUM(d.montant), 0) FROM depense d JOIN ligne_budget l ON l.id = d.ligne_budget_id"
+        "   WHERE l.subvention_id = s.id AND l.nature = 'charge' AND " + _ACTIVE + "),"
+        " (SELECT COUNT(d.id) FROM depense d JOIN ligne_budget l ON l.id = d.ligne_budget_id"
+        "   WHERE l.subvention_id = s.id AND " + _ACTIVE + ")"
+        " FROM subvention s"
+    )).all()
+    for sid, nom, cache, nb_cache, reel, nb_reel in rows:
+        if abs(float(cache) - float(reel)) >= 0.005 or int(nb_cache) != int(nb_reel):
+            drifts.append(Drift("subvention", sid, nom, float(cache), float(reel), int(nb_cache), int(nb_reel)))
+    return drifts
@@ -0,0 +1,120 @@
+"""Export comptable au format FEC (fichier des écritures comptables), pour le cabinet.
+
+Journal des achats d'un exercice (année d'exercice de la subvention), tous
+secteurs ou un seul : chaque dépense validée et non supprimée (les brouillons
+ne sont pas des écritures) donne une écriture à deux lignes, débit du compte
+de la ligne budgétaire et crédit du compte fournisseurs (401, compte
+auxiliaire = fournisseur). Pièce : référence de la dépense, sinon
+n° de la facture d'achat ; date : facture, sinon paiement, sinon saisie (comme
+le grand livre agrégé).
+
+Une seule requête, triée en ordre de journal (n° d'écriture, puis débit avant
+crédit) : les deux lignes d'une écriture se suivent et les écritures sont
+chronologiques. Les n° viennent d'une fonction de fenêtre ; le solde progressif
+de chaque compte est tenu par compte pendant l'envoi. Colonnes FEC standard
++ « Solde » (solde du compte de la ligne) en dernière colonne.
+"""
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import text
+
+from app.extensions import db
+
+JOURNAL_CODE = "AC"
+JOURNAL_LIB = "Achats"
+COMPTE_FOURNISSEURS = "401"
+COMPTE_FOURNISSEURS_LIB = "Fournisseurs"
+
+HEADER = [
+    "JournalCode", "JournalLib", "EcritureNum", "EcritureDate", "CompteNum", "CompteLib",
+    "CompAuxNum", "CompAuxLib", "PieceRef", "PieceDate", "EcritureLib", "Debit", "Credit",
+    "EcritureLet", "DateLet", "ValidDate", "Montantdevise", "Idevise", "Solde",
+]
+
+# sens 0 : ligne de charge, sens 1 : contrepartie fournisseur
+_SQL = (
+    "WITH e AS ("
+    " SELECT d.id AS id,"
+    "  ROW_NUMBER() OVER (ORDER BY COALESCE(fa.date_facture, d.date_paiement, date(d.created_at)), d.id) AS num,"
+    "  COALESCE(fa.date_facture, d.date_paiement, date(d.created_at)) AS dt,"
+    "  l.compte AS compte, l.libelle AS compte_lib,"
+    "  COALESCE(NULLIF(d.fournisseur, ''), fa.fournisseur) AS fournisseur,"
+    "  COALESCE(NULLIF(d.reference_piece, ''), fa.reference_facture) AS piece,"
+    "  fa.date_facture AS piece_date,"
+    "  d.libelle AS libelle, COALESCE(d.montant, 0) AS montant"
+    " FROM depense d"
+    " JOIN ligne_budget l ON l.id = d.ligne_budget_id"
+    " JOIN subvention s ON s.id = l.subvention_id"
+    " LEFT JOIN facture_ligne fl ON fl.id = d.facture_ligne_id"
+    " LEFT JOIN facture_achat fa ON fa.id = fl.facture_id"
+    " WHERE COALESCE(d.est_supprimee, 0) = 0 AND d.statut = 'valide' AND s.annee_exercice = :annee{secteur}"
+    ")"
+    " SELECT compte, compte_lib, 0 AS sens, num, id, dt, fournisseur, piece, piece_date, libelle, montant FROM e"
+    " UNION ALL"
+    " SELECT :cpt_four, :cpt_four_lib, 1, num, id, dt, fournisseur, piece, piece_date, libelle, montant FROM e"
+    " ORDER BY num, sens"
+)
+
+
+def _fec_date(value: Any) -> str:
+    """AAAAMMJJ (les dates arrivent en texte ISO depuis SQLite)."""
+    if not value:
+        return ""
+    return str(value)[:10].replace("-", "")
+
+
+def _cents(cents: int) -> str:
+    sign = "-" if cents < 0 else ""
+    cents = abs(cents)
+    return f"{sign}{cents // 100},{cents % 100:02d}"
+
+
+def _aux_num(fournisseur: Optional[str]) -> str:
+    """Code auxiliaire stable dérivé du nom du fournisseur."""
+    if not fournisseur:
+        return ""
+    return ("F" + re.sub(r"[^A-Z0-9]", "", fournisseur.upper()))[:17]
+
+
+def iter_fec_rows(annee: int, secteur: Optional[str] = None) -> Iterator[List[str]]:
+    """Lignes du FEC (sans en-tête) pour un exercice et, optionnellement, un secteur."""
+    params = {"annee": int(annee), "cpt_four": COMPTE_FOURNISSEURS, "cpt_four_lib": COMPTE_FOURNISSEURS_LIB}
+    sql = _SQL.format(secteur=" AND s.secteur = :secteur" if secteur else "")
+    if secteur:
+        params["secteur"] = secteur
+    result = db.session.execute(text(sql), params, execution_options={"yield_per": 1000})
+
+    soldes: Dict[str, int] = {}
+    for compte, compte_lib, sens, num, depense_id, dt, fournisseur, piece, piece_date, libelle, montant in result:
+        # une dépense négative (avoir) passe de l'autre côté
+        cents = int(round(float(montant) * 100))
+        if sens == 1:
+            cents = -cents
+        debit, credit = (cents, 0) if cents >= 0 else (0, -cents)
+        solde = soldes[compte] = soldes.get(compte, 0) + debit - credit
+        ecriture_date = _fec_date(dt)
+        aux = sens == 1 and fournisseur
+        yield [
+            JOURNAL_CODE,
+            JOURNAL_LIB,
+            f"{JOURNAL_CODE}{num:06d}",
+            ecriture_date,
+            compte or "",
+            compte_lib or "",
+            _aux_num(fournisseur) if aux else "",
+            fournisseur if aux else "",
+            piece or f"DEP{depense_id}",
+            _fec_date(piece_date) or ecriture_date,
+            libelle or "",
+            _cents(debit),
+            _cents(credit),
+            "",
+            "",
+            ecriture_date,
+            "",
+            "",
+            _cents(solde),
+        ]
@@ -0,0 +1,213 @@
+"""Grand livre agrégé : `ledger_rollup`, pour comparer plusieurs exercices.
+
+Grain : (subvention, compte, nature, mois), avec année d'exercice et secteur de
+la subvention. Les montants des lignes (base, réel) sont portés par mois = 0 ;
+l'engagé (dépenses non supprimées, comme `ligne_budget.engage_cache`) est
+ventilé par mois de la date de facture, sinon de paiement, sinon de saisie.
+Les subventions archivées sont incluses : ce sont souvent les exercices passés.
+
+Tenue à jour incrémentale : des triggers SQLite marquent les subventions
+touchées (dépense, ligne, subvention, date de facture) dans
+`ledger_a_recalculer` ; `sync_ledger()` recalcule uniquement ces subventions,
+en SQL ensembliste, avant chaque lecture (une requête si rien n'a changé).
+
+`flask finance rebuild-ledger` recalcule tout.
+"""
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import func, text
+
+from app.extensions import db
+from app.models import LedgerRollup
+from app.services.db_write import WriteBusyError, run_write
+
+log = logging.getLogger(__name__)
+
+AXES = {
+    "compte": LedgerRollup.compte,
+    "secteur": LedgerRollup.secteur,
+    "mois": LedgerRollup.mois,
+}
+METRICS = {
+    "base": LedgerRollup.base,
+    "reel": LedgerRollup.reel,
+    "engage": LedgerRollup.engage,
+}
+
+_DATE = "COALESCE(fa.date_facture, d.date_paiement, date(d.created_at))"
+
+# {where} filtre les lignes l (ligne_budget) à recalculer
+_RECOMPUTE = (
+    "INSERT INTO ledger_rollup(subvention_id, compte, nature, mois, annee_exercice, secteur,"
+    " base, reel, engage, nb_depenses)"
+    " SELECT x.sid, x.compte, x.nature, x.mois, s.annee_exercice, s.secteur,"
+    " SUM(x.base), SUM(x.reel), SUM(x.engage), SUM(x.nb)"
+    " FROM ("
+    "  SELECT l.subvention_id AS sid, l.compte AS compte, l.nature AS nature, 0 AS mois,"
+    "   COALESCE(l.montant_base, 0) AS base, COALESCE(l.montant_reel, 0) AS reel, 0.0 AS engage, 0 AS nb"
+    "  FROM ligne_budget l WHERE {where}"
+    "  UNION ALL"
+    "  SELECT l.subvention_id, l.compte, l.nature,"
+    f"   COALESCE(CAST(strftime('%m', {_DATE}) AS INTEGER), 0), 0.0, 0.0, COALESCE(d.montant, 0), 1"
+    "  FROM depense d JOIN ligne_budget l ON l.id = d.ligne_budget_id"
+    "  LEFT JOIN facture_ligne fl ON fl.id = d.facture_ligne_id"
+    "  LEFT JOIN facture_achat fa ON fa.id = fl.facture_id"
+    "  WHERE COALESCE(d.est_supprimee, 0) = 0 AND {where}"
+    " ) x JOIN subvention s ON s.id = x.sid"
+    " GROUP BY x.sid, x.compte, x.nature, x.mois"
+)
+
+_QUEUED = "l.subvention_id IN (SELECT subvention_id FROM ledger_a_recalculer)"
+
+
+def _mark_ligne(ligne_expr: str) -> str:
+    return (
+        "INSERT OR IGNORE INTO ledger_a_recalculer(subvention_id)"
+        f" SELECT subvention_id FROM ligne_budget WHERE id = {ligne_expr};"
+    )
+
+
+def _mark_sub(sub_expr: str) -> str:
+    return f"INSERT OR IGNORE INTO ledger_a_recalculer(subvention_id) VALUES ({sub_expr});"
+
+
+def _mark_depenses_of(where: str) -> str:
+    return (
+        "INSERT OR IGNORE INTO ledger_a_recalculer(subvention_id)"
+        " SELECT DISTINCT l.subvention_id FROM depense d JOIN ligne_budget l ON l.id = d.ligne_budget_id"
+        f" WHERE {where};"
+    )
+
+
+_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS ledger_depense_ai AFTER INSERT ON depense BEGIN "
+    + _mark_ligne("new.ligne_budget_id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS ledger_depense_ad AFTER DELETE ON depense BEGIN "
+    + _mark_ligne("old.ligne_budget_id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS ledger_depense_au AFTER UPDATE OF montant, est_supprimee, ligne_budget_id,"
+    " date_paiement, created_at, facture_ligne_id ON depense BEGIN "
+    + _mark_ligne("old.ligne_budget_id") + " " + _mark_ligne("new.ligne_budget_id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS ledger_ligne_ai AFTER INSERT ON ligne_budget BEGIN "
+    + _mark_sub("new.subvention_id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS ledger_ligne_ad AFTER DELETE ON ligne_budget BEGIN "
+    + _mark_sub("old.subvention_id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS ledger_ligne_au AFTER UPDATE OF subvention_id, compte, nature,"
+    " montant_base, montant_reel ON ligne_budget BEGIN "
+    + _mark_sub("old.subvention_id") + " " + _mark_sub("new.subvention_id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS ledger_subvention_au AFTER UPDATE OF annee_exercice, secteur ON subvention BEGIN "
+    + _mark_sub("new.id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS ledger_subvention_ad AFTER DELETE ON subvention BEGIN "
+    + _mark_sub("old.id") + " END",
+    # la date de facture date les dépenses issues de ses lignes
+    "CREATE TRIGGER IF NOT EXISTS ledger_facture_achat_au AFTER UPDATE OF date_facture ON facture_achat BEGIN "
+    + _mark_depenses_of("d.facture_ligne_id IN (SELECT id FROM facture_ligne WHERE facture_id = new.id)") + " END",
+    "CREATE TRIGGER IF NOT EXISTS ledger_facture_ligne_au AFTER UPDATE OF facture_id ON facture_ligne BEGIN "
+    + _mark_depenses_of("d.facture_ligne_id = new.id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS ledger_facture_ligne_ad AFTER DELETE ON facture_ligne BEGIN "
+    + _mark_depenses_of("d.facture_ligne_id = old.id") + " END",
+]
+
+
+def _recompute_queued() -> None:
+    # le DELETE prend le verrou d'écriture avant de lire la file : aucune marque
+    # posée pendant le recalcul ne peut être effacée sans avoir été traitée
+    db.session.execute(text("DELETE FROM ledger_rollup WHERE subvention_id IN (SELECT subvention_id FROM ledger_a_recalculer)"))
+    db.session.execute(text(_RECOMPUTE.format(where=_QUEUED)))
+    db.session.execute(text("DELETE FROM ledger_a_recalculer"))
+
+
+def sync_ledger() -> bool:
+    """Recalcule les subventions marquées. Retourne False si la base était occupée."""
+    if db.session.execute(text("SELECT 1 FROM ledger_a_recalculer LIMIT 1")).first() is None:
+        return True
+    try:
+        run_write(_recompute_queued)
+        return True
+    except WriteBusyError:
+        log.warning("Grand livre agrégé : base occupée, recalcul reporté")
+        return False
+
+
+def rebuild_ledger() -> int:
+    """Reconstruit toute la table. Retourne le nombre de lignes."""
+    db.session.execute(text("DELETE FROM ledger_rollup"))
+    db.session.execute(text(_RECOMPUTE.format(where="1 = 1")))
+    db.session.execute(text("DELETE FROM ledger_a_recalculer"))
+    db.session.commit()
+    return db.session.query(func.count()).select_from(LedgerRollup).scalar() or 0
+
+
+def ensure_ledger() -> None:
+    """Pose les triggers (à appeler après create_all) ; remplit la table au premier passage."""
+    try:
+        existing = {
+            row[0]
+            for row in db.session.execute(
+                text("SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE 'ledger_%'")
+            ).all()
+        }
+        for sql in _TRIGGERS:
+            db.session.execute(text(sql))
+        db.session.commit()
+        if not existing:
+            rebuild_ledger()
+    except Exception:
+        db.session.rollback()
+
+
+# ---------------------------------------------------------------------------
+# Lecture
+
+def annees_disponibles() -> List[int]:
+    rows = db.session.query(LedgerRollup.annee_exercice).distinct().order_by(LedgerRollup.annee_exercice.desc())
+    return [a for (a,) in rows if a is not None]
+
+
+def compare_years(annees: Iterable[int], axis: str = "compte", metric: str = "reel",
+                  nature: Optional[str] = "charge", secteur: Optional[str] = None) -> Dict[str, Any]:
+    """Comparaison de plusieurs exercices côte à côte, lue uniquement dans `ledger_rollup`.
+
+    Retourne {"annees", "rows": [{"key", "values", "deltas"}], "total": {"values", "deltas"}} ;
+    `values` suit l'ordre croissant des années, `deltas[i]` compare l'année i+1 à l'année i :
+    (écart, écart en % ou None si l'année précédente est à 0).
+    """
+    annees = sorted({int(a) for a in annees})
+    axis_col = AXES.get(axis, LedgerRollup.compte)
+    metric_col = METRICS.get(metric, LedgerRollup.reel)
+    if not annees:
+        return {"annees": [], "rows": [], "total": {"values": [], "deltas": []}}
+
+    sync_ledger()
+    q = (
+        db.session.query(axis_col, LedgerRollup.annee_exercice, func.sum(metric_col))
+        .filter(LedgerRollup.annee_exercice.in_(annees))
+    )
+    if nature:
+        q = q.filter(LedgerRollup.nature == nature)
+    if secteur:
+        q = q.filter(LedgerRollup.secteur == secteur)
+    grid: Dict[Any, Dict[int, float]] = {}
+    for key, annee, total in q.group_by(axis_col, LedgerRollup.annee_exercice).all():
+        grid.setdefault(key, {})[annee] = float(total or 0.0)
+
+    def _line(by_year: Dict[int, float]) -> Dict[str, list]:
+        values = [round(by_year.get(a, 0.0), 2) for a in annees]
+        deltas = []
+        for prev, cur in zip(values, values[1:]):
+            diff = round(cur - prev, 2)
+            deltas.append((diff, round(diff / prev * 100.0, 1) if prev else None))
+        return {"values": values, "deltas": deltas}
+
+    rows = []
+    for key in sorted(grid, key=lambda k: (k is None, k)):
+        line = _line(grid[key])
+        if any(line["values"]):
+            rows.append({"key": key, **line})
+    totals: Dict[int, float] = {}
+    for by_year in grid.values():
+        for a, v in by_year.items():
+            totals[a] = totals.get(a, 0.0) + v
+    return {"annees": annees, "rows": rows, "total": _line(totals)}
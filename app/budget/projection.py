@@ -0,0 +1,336 @@
+"""Rythme de consommation et projection de fin d'exercice des subventions.
+
+Courbes : engagé cumulé jour par jour sur l'année d'exercice, par ligne de
+charge et par subvention (somme de ses lignes). Mêmes règles que l'engagé
+(dépenses non supprimées) et que le grand livre agrégé pour la date : facture,
+sinon paiement, sinon saisie ; une date hors de l'année est ramenée au premier
+ou au dernier jour. Les montants datés d'avant l'exercice comptent dans l'engagé
+mais pas dans le rythme (ni dans le profil saisonnier). Les courbes sont des `array('d')` (tampon contigu, lisible
+tel quel par numpy.frombuffer si besoin).
+
+Une passe : une requête pour les lignes de l'exercice, une requête pour les
+dépenses groupées par ligne et par jour (exercice et exercice précédent, qui
+donne le profil saisonnier de chaque secteur). Le résultat est mis en cache par
+exercice, indexé par les versions de données "finance" et "achats" ; les
+projections (peu coûteuses) sont recalculées à chaque lecture pour la date du jour.
+
+Méthodes :
+- "lineaire"   : rythme moyen depuis le 1er janvier prolongé jusqu'au 31 décembre ;
+- "saisonnier" : réalisé à date divisé par la part de l'exercice précédent
+  réalisée à la même date (profil du secteur, sinon de toute la structure) ;
+  linéaire si le profil manque ou n'est pas significatif.
+
+Avant MIN_JOURS d'exercice, une projection n'est pas un signal : seule une
+subvention dont l'engagé dépasse déjà le budget est signalée en surconsommation.
+"""
+from __future__ import annotations
+
+import datetime
+import threading
+import time
+from array import array
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.extensions import db
+from app.services.data_version import data_versions
+
+METHODES = {
+    "saisonnier": "Saisonnière (profil de l'exercice précédent)",
+    "lineaire": "Linéaire (rythme moyen depuis le 1er janvier)",
+}
+
+SEUIL_SUR = 1.05        # projeté > budget + 5 % : surconsommation
+SEUIL_SOUS = 0.85       # projeté < 85 % du budget : sous-consommation
+MIN_JOURS = 30          # pas de signal sur la projection avant un mois d'exercice
+MIN_PART_SAISON = 0.10  # profil ignoré si l'an dernier moins de 10 % était réalisé à cette date
+
+CACHE_TTL_SECONDS = 300
+CACHE_MAX_ENTRIES = 16
+
+_VERSION_DOMAINS = ("finance", "achats")
+
+_lock = threading.Lock()
+# (année, versions) -> (horodatage, courbes)
+_cache: Dict[Tuple[int, Tuple[int, ...]], Tuple[float, "ExerciceCourbes"]] = {}
+
+_LIGNES_SQL = (
+    "SELECT l.id, l.subvention_id, l.compte, l.libelle, COALESCE(l.montant_reel, 0),"
+    " s.nom, s.secteur, COALESCE(s.montant_attribue, 0)"
+    " FROM ligne_budget l JOIN subvention s ON s.id = l.subvention_id"
+    " WHERE s.annee_exercice = :annee AND COALESCE(s.est_archive, 0) = 0"
+    " AND COALESCE(l.nature, 'charge') = 'charge'"
+    " ORDER BY s.annee_exercice, s.nom, s.id, l.id"
+)
+
+# exercice précédent inclus, archivé ou non : il sert de profil saisonnier
+_DEPENSES_SQL = (
+    "SELECT d.ligne_budget_id, s.annee_exercice, s.secteur,"
+    " COALESCE(fa.date_facture, d.date_paiement, date(d.created_at)) AS jour, SUM(COALESCE(d.montant, 0))"
+    " FROM depense d"
+    " JOIN ligne_budget l ON l.id = d.ligne_budget_id"
+    " JOIN subvention s ON s.id = l.subvention_id"
+    " LEFT JOIN facture_ligne fl ON fl.id = d.facture_ligne_id"
+    " LEFT JOIN facture_achat fa ON fa.id = fl.facture_id"
+    " WHERE COALESCE(d.est_supprimee, 0) = 0 AND COALESCE(l.nature, 'charge') = 'charge'"
+    " AND s.annee_exercice IN (:annee, :precedent)"
+    " GROUP BY d.ligne_budget_id, jour"
+)
+
+
+def _nb_jours(annee: int) -> int:
+    return (datetime.date(annee + 1, 1, 1) - datetime.date(annee, 1, 1)).days
+
+
+def _decalage(jour, debut: datetime.date) -> int:
+    """Jours depuis `debut` (négatif avant) ; 0 si la date manque ou est illisible."""
+    if not jour:
+        return 0
+    try:
+        d = datetime.date.fromisoformat(str(jour)[:10])
+    except ValueError:
+        return 0
+    return (d - debut).days
+
+
+def _index(decalage: int, n: int) -> int:
+    return min(max(decalage, 0), n - 1)
+
+
+def _cumuler(a: array) -> array:
+    total = 0.0
+    for i, v in enumerate(a):
+        total += v
+        a[i] = total
+    return a
+
+
+@dataclass
+class Courbe:
+    """Engagé cumulé au soir de chaque jour de l'exercice (une ligne ou une subvention)."""
+
+    id: int
+    libelle: str
+    secteur: str
+    budget: float
+    cumul: array
+    anterieur: float = 0.0  # part du cumul datée d'avant l'exercice (ramenée au 1er jour)
+
+
+@dataclass
+class SubventionCourbe(Courbe):
+    lignes: List[Courbe] = field(default_factory=list)
+
+
+@dataclass
+class ExerciceCourbes:
+    annee: int
+    debut: datetime.date
+    nb_jours: int
+    subventions: List[SubventionCourbe]
+    # secteur (None = toute la structure) -> part cumulée de l'exercice précédent, de 0 à 1
+    profils: Dict[Optional[str], array]
+
+
+def _build(annee: int) -> ExerciceCourbes:
+    debut = datetime.date(annee, 1, 1)
+    n = _nb_jours(annee)
+    debut_prec = datetime.date(annee - 1, 1, 1)
+    n_prec = _nb_jours(annee - 1)
+
+    subs: Dict[int, SubventionCourbe] = {}
+    lignes: Dict[int, Courbe] = {}
+    for lid, sid, compte, libelle, reel, nom, secteur, attribue in db.session.execute(
+        text(_LIGNES_SQL), {"annee": annee}
+    ):
+        sub = subs.get(sid)
+        if sub is None:
+            sub = subs[sid] = SubventionCourbe(
+                id=sid, libelle=nom, secteur=secteur, budget=float(attribue), cumul=array("d", bytes(8 * n)),
+            )
+        ligne = lignes[lid] = Courbe(
+            id=lid, libelle=f"{compte} · {libelle}", secteur=secteur, budget=round(float(reel), 2),
+            cumul=array("d", bytes(8 * n)),
+        )
+        sub.lignes.append(ligne)
+
+    precedent: Dict[Optional[str], array] = {}
+    for lid, annee_sub, secteur, jour, montant in db.session.execute(
+        text(_DEPENSES_SQL), {"annee": annee, "precedent": annee - 1}
+    ):
+        montant = float(montant or 0)
+        if annee_sub == annee:
+            ligne = lignes.get(lid)
+            if ligne is not None:
+                decalage = _decalage(jour, debut)
+                ligne.cumul[_index(decalage, n)] += montant
+                if decalage < 0:
+                    ligne.anterieur += montant
+        else:
+            decalage = _decalage(jour, debut_prec)
+            if decalage < 0:
+                continue
+            i = _index(decalage, n_prec)
+            for key in (secteur, None):
+                if key not in precedent:
+                    precedent[key] = array("d", bytes(8 * n_prec))
+                precedent[key][i] += montant
+
+    for sub in subs.values():
+        reel_lignes = 0.0
+        for ligne in sub.lignes:
+            _cumuler(ligne.cumul)
+            reel_lignes += ligne.budget
+            sub.anterieur += ligne.anterieur
+            for i, v in enumerate(ligne.cumul):
+                sub.cumul[i] += v
+        # budget : réel ventilé des charges, sinon montant attribué
+        if reel_lignes > 0:
+            sub.budget = round(reel_lignes, 2)
+
+    profils: Dict[Optional[str], array] = {}
+    for key, jours in precedent.items():
+        _cumuler(jours)
+        total = jours[-1]
+        if total > 0:
+            profils[key] = array("d", (v / total for v in jours))
+
+    return ExerciceCourbes(annee=annee, debut=debut, nb_jours=n, subventions=list(subs.values()), profils=profils)
+
+
+def courbes_exercice(annee: int) -> ExerciceCourbes:
+    """Courbes de l'exercice, en cache tant que les données n'ont pas changé."""
+    versions = data_versions()
+    key = (int(annee), tuple(versions.get(d, 0) for d in _VERSION_DOMAINS))
+    now = time.monotonic()
+    with _lock:
+        hit = _cache.get(key)
+        if hit and (now - hit[0]) < CACHE_TTL_SECONDS:
+            return hit[1]
+    courbes = _build(int(annee))
+    with _lock:
+        stale = [k for k in _cache if now - _cache[k][0] >= CACHE_TTL_SECONDS or (k[0] == key[0] and k != key)]
+        for k in stale:
+            del _cache[k]
+        if len(_cache) >= CACHE_MAX_ENTRIES:
+            _cache.clear()
+        _cache[key] = (now, courbes)
+    return courbes
+
+
+def clear_cache() -> None:
+    with _lock:
+        _cache.clear()
+
+
+# ---------------------------------------------------------------------------
+# Projection
+
+@dataclass
+class Projection:
+    id: int
+    libelle: str
+    secteur: str
+    budget: float
+    engage: float           # toutes dates confondues
+    engage_a_date: float
+    jours: int              # jours d'exercice écoulés
+    nb_jours: int
+    rythme_jour: float
+    projete: float
+    methode: str            # "lineaire" | "saisonnier" | "realise"
+    statut: str             # "sur" | "sous" | "ok"
+    cumul: array
+    lignes: List["Projection"] = field(default_factory=list)
+
+    @property
+    def ecart(self) -> float:
+        return round(self.projete - self.budget, 2)
+
+    @property
+    def taux_projete(self) -> Optional[float]:
+        return round(self.projete / self.budget * 100.0, 1) if self.budget > 0 else None
+
+    def svg(self, width: int = 160, height: int = 32) -> Dict[str, str]:
+        """Coordonnées d'un mini graphique : réalisé, projection (tirets), budget."""
+        n = self.nb_jours
+        echelle = max(self.budget, self.projete, self.engage) or 1.0
+
+        def _pt(i: int, v: float) -> str:
+            return f"{i * width / (n - 1):.1f},{height - v * height / echelle:.1f}"
+
+        fin = min(self.jours, n) - 1
+        pts = [_pt(i, self.cumul[i]) for i in range(0, fin + 1, 7)]
+        if fin >= 0:
+            pts.append(_pt(fin, self.cumul[fin]))
+        debut_proj = _pt(max(fin, 0), self.engage_a_date)
+        return {
+            "realise": " ".join(pts),
+            "projection": f"{debut_proj} {_pt(n - 1, self.projete)}" if fin < n - 1 else "",
+            "budget_y": f"{height - self.budget * height / echelle:.1f}",
+        }
+
+
+def _projeter(c: Courbe, jour: int, n: int, profil: Optional[array], methode: str) -> Projection:
+    engage = round(c.cumul[-1], 2)
+    if jour >= n - 1:
+        jours, a_date, projete, methode_ok = n, engage, engage, "realise"
+    else:
+        jours = jour + 1 if jour >= 0 else 0
+        a_date = c.cumul[jour] if jour >= 0 else 0.0
+        # l'antérieur est acquis : seul l'engagé de l'exercice donne le rythme
+        courant = a_date - c.anterieur if jours else 0.0
+        projete = a_date + courant / jours * (n - jours) if jours else a_date
+        methode_ok = "lineaire"
+        if methode == "saisonnier" and profil is not None and jours:
+            part = profil[min(jour, len(profil) - 1)]
+            if part >= MIN_PART_SAISON:
+                projete, methode_ok = c.anterieur + courant / part, "saisonnier"
+    # les dépenses déjà datées après aujourd'hui sont acquises
+    projete = round(max(projete, engage), 2)
+    rythme = (a_date - c.anterieur) / jours if jours else 0.0
+
+    if jours >= MIN_JOURS:
+        sur = projete > c.budget * SEUIL_SUR and projete > 0
+    else:
+        sur = engage > c.budget and engage > 0
+    if sur:
+        statut = "sur"
+    elif jours >= MIN_JOURS and c.budget > 0 and projete < c.budget * SEUIL_SOUS:
+        statut = "sous"
+    else:
+        statut = "ok"
+    return Projection(
+        id=c.id, libelle=c.libelle, secteur=c.secteur, budget=c.budget, engage=engage,
+        engage_a_date=round(a_date, 2), jours=jours, nb_jours=n, rythme_jour=round(rythme, 2),
+        projete=projete, methode=methode_ok, statut=statut, cumul=c.cumul,
+    )
+
+
+_ORDRE_STATUT = {"sur": 0, "sous": 1, "ok": 2}
+
+
+def projections(annee: int, secteurs: Optional[List[str]] = None, methode: str = "saisonnier",
+                as_of: Optional[datetime.date] = None) -> List[Projection]:
+    """Projection de fin d'exercice des subventions (et de leurs lignes) du périmètre.
+
+    `secteurs` : None = tous. Tri : surconsommations, puis sous-consommations,
+    par écart décroissant.
+    """
+    courbes = courbes_exercice(annee)
+    as_of = as_of or datetime.date.today()
+    jour = min((as_of - courbes.debut).days, courbes.nb_jours - 1)
+    n = courbes.nb_jours
+
+    out = []
+    for sub in courbes.subventions:
+        if secteurs is not None and sub.secteur not in secteurs:
+            continue
+        profil = courbes.profils.get(sub.secteur) or courbes.profils.get(None)
+        p = _projeter(sub, jour, n, profil, methode)
+        p.lignes = [_projeter(l, jour, n, profil, methode) for l in sub.lignes]
+        out.append(p)
+    out.sort(key=lambda p: (_ORDRE_STATUT[p.statut], -abs(p.ecart)))
+    return out
@@ -1,11 +1,13 @@
 import os
-from datetime import datetime
+from datetime import date, datetime
 from flask import Blueprint, render_template, request, redirect, url_for, flash, abort, current_app, send_from_directory
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 
 from app.extensions import db
 from app.models import Subvention, LigneBudget, Depense, DepenseDocument
+from app.services.pagination import keyset_paginate, page_args
+from app.services.finance_snapshot import FinanceSnapshot
 
 bp = Blueprint("budget", __name__)
 
@@ -179,9 +181,10 @@ def depense_edit(depense_id):
 
         abort(400)
 
+    lt = FinanceSnapshot.load(subvention_ids=[sub.id]).ligne(ligne.id)
     alloue = float(ligne.montant_reel or 0)
-    engage = float(ligne.engage or 0)
-    reste = float(ligne.reste or 0)
+    engage = lt.engage if lt else 0.0
+    reste = lt.reste if lt else 0.0
     existing_inv = list(getattr(dep, "inventaire_items", []) or [])
 
     return render_template(
@@ -296,7 +299,15 @@ def depenses_list():
     if ligne_id:
         dep_q = dep_q.filter(Depense.ligne_budget_id == ligne_id)
 
-    deps = dep_q.order_by(Depense.date_paiement.desc().nullslast(), Depense.id.desc()).all()
+    # plus récentes d'abord, sans date en fin de liste (coalesce : clé de curseur non NULL)
+    cursor, per_page = page_args()
+    page = keyset_paginate(
+        dep_q,
+        [(db.func.coalesce(Depense.date_paiement, date(1, 1, 1)), True), (Depense.id, True)],
+        cursor,
+        per_page,
+    )
+    deps = page.items
 
     # lignes possibles si une subvention est sélectionnée
     lignes = []
@@ -310,6 +321,7 @@ def depenses_list():
         selected_sub_id=sub_id,
         selected_ligne_id=ligne_id,
         deps=deps,
+        page=page,
     )
 
 
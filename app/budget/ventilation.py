@@ -0,0 +1,223 @@
+"""Ventilation du réel des lignes budgétaires, sur une ou plusieurs subventions.
+
+Méthodes (mêmes règles que la ventilation automatique de la page pilotage) :
+- "copy_base"    : réel = base, toutes les lignes ;
+- "prorata_base" : le montant cible (reçu ou attribué) réparti au pro-rata des
+  bases, la dernière ligne absorbe l'arrondi au centime ;
+- "reset"        : réel = 0 ;
+- "cap_recu"     : si le réel des charges dépasse le montant cible, il est
+  ramené au montant cible au pro-rata du réel actuel ; sinon rien ne change.
+
+`simulate()` charge subventions et lignes en deux requêtes colonnes et calcule
+le plan en mémoire (réel, engagé, reste avant / après, par ligne et par
+subvention) sans rien écrire. `apply()` écrit toutes les lignes modifiées en un
+seul UPDATE groupé (executemany), dans une transaction.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import update
+
+from app.extensions import db
+from app.models import LigneBudget, Subvention
+from app.services.db_write import run_write
+
+MODES = {
+    "prorata_base": "Pro-rata du montant sur les bases",
+    "copy_base": "Copier base → réel",
+    "reset": "Réinitialiser (réel = 0)",
+    "cap_recu": "Plafonner le réel des charges au montant",
+}
+TARGETS = {
+    "recu": "Montant reçu",
+    "attribue": "Montant attribué",
+}
+
+
+def repartir(poids: Sequence[Tuple[int, float]], montant_cible: float) -> Dict[int, float]:
+    """Répartit `montant_cible` au pro-rata des poids [(id, poids)] ; total exact au centime."""
+    out: Dict[int, float] = {}
+    if not poids:
+        return out
+    total = sum(float(p or 0) for _, p in poids)
+    if total <= 0:
+        return {i: 0.0 for i, _ in poids}
+
+    ratio = float(montant_cible or 0) / total
+    cumul = 0.0
+    for n, (i, p) in enumerate(poids):
+        part = round(float(p or 0) * ratio, 2)
+        if n == len(poids) - 1:
+            part = round(float(montant_cible or 0) - cumul, 2)
+        out[i] = float(part)
+        cumul += float(part)
+    return out
+
+
+def compute_prorata(lignes, montant_cible: float) -> Dict[int, float]:
+    """
+    Calcule une répartition pro-rata sur montant_base.
+    Ne modifie pas la DB : retourne un dict {ligne_id: montant_theorique}
+    Ajuste la dernière ligne pour tomber pile au centime.
+    """
+    return repartir([(l.id, l.montant_base) for l in lignes], montant_cible)
+
+
+@dataclass
+class LignePlan:
+    id: int
+    compte: str
+    libelle: str
+    nature: str
+    base: float
+    reel_avant: float
+    reel_apres: float
+    engage: float
+
+    @property
+    def est_charge(self) -> bool:
+        return self.nature == "charge"
+
+    @property
+    def modifiee(self) -> bool:
+        return round(self.reel_apres - self.reel_avant, 2) != 0
+
+    @property
+    def reste_avant(self) -> float:
+        return round(self.reel_avant - self.engage, 2) if self.est_charge else 0.0
+
+    @property
+    def reste_apres(self) -> float:
+        return round(self.reel_apres - self.engage, 2) if self.est_charge else 0.0
+
+
+@dataclass
+class SubventionPlan:
+    id: int
+    nom: str
+    secteur: str
+    annee_exercice: int
+    cible: float
+    lignes: List[LignePlan] = field(default_factory=list)
+    erreur: Optional[str] = None
+
+    def _charges(self, attr: str) -> float:
+        return round(sum(getattr(l, attr) for l in self.lignes if l.est_charge), 2)
+
+    @property
+    def reel_avant(self) -> float:
+        return self._charges("reel_avant")
+
+    @property
+    def reel_apres(self) -> float:
+        return self._charges("reel_apres")
+
+    @property
+    def engage(self) -> float:
+        return self._charges("engage")
+
+    @property
+    def reste_avant(self) -> float:
+        return self._charges("reste_avant")
+
+    @property
+    def reste_apres(self) -> float:
+        return self._charges("reste_apres")
+
+    @property
+    def delta_reel(self) -> float:
+        return round(self.reel_apres - self.reel_avant, 2)
+
+    @property
+    def nb_modifiees(self) -> int:
+        return sum(1 for l in self.lignes if l.modifiee)
+
+
+def _plan_reel(plan: SubventionPlan, mode: str) -> None:
+    lignes = plan.lignes
+    if mode == "reset":
+        for l in lignes:
+            l.reel_apres = 0.0
+    elif mode == "copy_base":
+        for l in lignes:
+            l.reel_apres = l.base
+    elif mode == "prorata_base":
+        if sum(l.base for l in lignes) <= 0:
+            plan.erreur = "Impossible : total des bases = 0."
+            return
+        parts = repartir([(l.id, l.base) for l in lignes], plan.cible)
+        for l in lignes:
+            l.reel_apres = parts.get(l.id, 0.0)
+    elif mode == "cap_recu":
+        charges = [l for l in lignes if l.est_charge]
+        if round(sum(l.reel_avant for l in charges), 2) > round(plan.cible, 2):
+            parts = repartir([(l.id, l.reel_avant) for l in charges], plan.cible)
+            for l in charges:
+                l.reel_apres = parts.get(l.id, 0.0)
+    else:
+        raise ValueError(f"méthode de ventilation inconnue : {mode}")
+
+
+def simulate(subvention_ids: Iterable[int], mode: str, target: str = "recu") -> List[SubventionPlan]:
+    """Plan de ventilation des subventions demandées (rien n'est écrit)."""
+    ids = sorted({int(i) for i in subvention_ids})
+    if not ids:
+        return []
+
+    plans: Dict[int, SubventionPlan] = {}
+    subs = (
+        db.session.query(
+            Subvention.id, Subvention.nom, Subvention.secteur, Subvention.annee_exercice,
+            Subvention.montant_recu, Subvention.montant_attribue,
+        )
+        .filter(Subvention.id.in_(ids))
+        .order_by(Subvention.annee_exercice.desc(), Subvention.nom.asc())
+    )
+    for sid, nom, secteur, annee, recu, attribue in subs:
+        cible = float((attribue if target == "attribue" else recu) or 0)
+        plans[sid] = SubventionPlan(id=sid, nom=nom, secteur=secteur, annee_exercice=annee, cible=cible)
+
+    lignes = (
+        db.session.query(
+            LigneBudget.subvention_id, LigneBudget.id, LigneBudget.compte, LigneBudget.libelle,
+            LigneBudget.nature, LigneBudget.montant_base, LigneBudget.montant_reel, LigneBudget.engage_cache,
+        )
+        .filter(LigneBudget.subvention_id.in_(ids))
+        .order_by(LigneBudget.subvention_id.asc(), LigneBudget.id.asc())
+    )
+    for sid, lid, compte, libelle, nature, base, reel, engage_cache in lignes:
+        nature = nature or "charge"
+        reel = float(reel or 0)
+        plans[sid].lignes.append(LignePlan(
+            id=lid, compte=compte, libelle=libelle, nature=nature, base=float(base or 0),
+            reel_avant=reel, reel_apres=reel,
+            engage=round(float(engage_cache or 0), 2) if nature == "charge" else 0.0,
+        ))
+
+    for plan in plans.values():
+        if not plan.lignes:
+            plan.erreur = "Aucune ligne à ventiler."
+            continue
+        _plan_reel(plan, mode)
+    return list(plans.values())
+
+
+def apply(plans: Iterable[SubventionPlan]) -> int:
+    """Écrit le réel de toutes les lignes modifiées en une transaction. Retourne le nombre de lignes."""
+    rows = [
+        {"id": l.id, "montant_reel": float(l.reel_apres)}
+        for plan in plans
+        if not plan.erreur
+        for l in plan.lignes
+        if l.modifiee
+    ]
+    if not rows:
+        return 0
+
+    def _write():
+        db.session.execute(update(LigneBudget), rows)
+        return len(rows)
+
+    return run_write(_write)
@@ -0,0 +1,123 @@
+"""Commandes `flask ...` d'exploitation (à lancer à la main ou depuis un planificateur).
+
+Exemple (tâche planifiée mensuelle) :
+    flask --app wsgi rgpd sweep --resume
+    flask --app wsgi finance check-engage
+    flask --app wsgi projets portfolio-snapshot   (chaque nuit)
+"""
+from __future__ import annotations
+
+import click
+from flask.cli import AppGroup
+
+from app.participants.retention import count_eligible, retention_cutoff, sweep
+
+
+rgpd_cli = AppGroup("rgpd", help="Conservation des données personnelles des participants.")
+
+
+@rgpd_cli.command("sweep")
+@click.option("--years", type=int, default=None, help="Inactivité en années (défaut : RGPD_RETENTION_YEARS).")
+@click.option("--strict", is_flag=True, help="Efface aussi genre, date de naissance, quartier.")
+@click.option("--dry-run", is_flag=True, help="Décompte seulement, aucune modification.")
+@click.option("--chunk", type=int, default=None, help="Participants par lot (défaut : RGPD_SWEEP_CHUNK).")
+@click.option("--pause", type=float, default=None, help="Pause entre lots, en secondes.")
+@click.option("--max-chunks", type=int, default=None, help="Nombre de lots maximum pour cette exécution.")
+@click.option("--resume", is_flag=True, help="Reprend la dernière passe non terminée.")
+def rgpd_sweep(years, strict, dry_run, chunk, pause, max_chunks, resume):
+    """Anonymise les participants sans venue depuis N années et purge leurs signatures."""
+    from flask import current_app
+
+    if dry_run:
+        cutoff = retention_cutoff(int(years or current_app.config.get("RGPD_RETENTION_YEARS", 3)))
+        summary = count_eligible(cutoff)
+        click.echo(f"Date limite : {cutoff:%d/%m/%Y}")
+        click.echo(f"Participants à anonymiser : {summary['participants']}")
+        for secteur, n in sorted(summary["par_secteur"].items()):
+            click.echo(f"  {secteur} : {n}")
+        click.echo(f"Signatures à purger : {summary['signatures']}")
+        return
+
+    run = sweep(years=years, strict=strict, chunk=chunk, pause=pause, max_chunks=max_chunks,
+                resume=resume, declenche_par="cli", log=click.echo)
+    click.echo(
+        f"Passe #{run.id} ({run.statut}) : {run.nb_anonymises} participant(s) anonymisé(s), "
+        f"{run.nb_signatures} signature(s) purgée(s), {run.nb_fichiers_absents} fichier(s) déjà absent(s)."
+    )
+
+
+@rgpd_cli.command("history")
+@click.option("--limit", type=int, default=10)
+def rgpd_history(limit):
+    """Journal des dernières passes (audit)."""
+    from app.models import RgpdSweep
+
+    for run in RgpdSweep.query.order_by(RgpdSweep.id.desc()).limit(limit):
+        click.echo(
+            f"#{run.id} {run.started_at:%d/%m/%Y %H:%M} {run.statut:<10} limite {run.cutoff:%d/%m/%Y} "
+            f"({run.years} an(s){', strict' if run.strict else ''}) : {run.nb_anonymises} anonymisé(s), "
+            f"{run.nb_signatures} signature(s) — {run.resume_json or '{}'}"
+        )
+
+
+finance_cli = AppGroup("finance", help="Contrôles des données financières.")
+
+
+@finance_cli.command("check-engage")
+@click.option("--fix", is_flag=True, help="Recalcule les colonnes dénormalisées en cas d'écart.")
+def finance_check_engage(fix):
+    """Compare l'engagé dénormalisé (lignes, subventions) au calcul depuis les dépenses."""
+    from app.budget.engagement import check_engagement, rebuild_engagement
+
+    drifts = check_engagement()
+    for d in drifts:
+        click.echo(
+            f"{d.kind} #{d.id} {d.libelle} : engagé {d.engage_cache:.2f} (calcul {d.engage_reel:.2f}), "
+            f"dépenses {d.nb_cache} (calcul {d.nb_reel})"
+        )
+    if not drifts:
+        click.echo("Aucun écart.")
+        return
+    click.echo(f"{len(drifts)} écart(s).")
+    if fix:
+        rebuild_engagement()
+        click.echo(f"Recalcul effectué : {len(check_engagement())} écart(s) restant(s).")
+    else:
+        raise SystemExit(1)
+
+
+@finance_cli.command("rebuild-alertes")
+def finance_rebuild_alertes():
+    """Réévalue les alertes de gestion de toutes les subventions et factures."""
+    from app.models import Alerte
+    from app.services.alertes import rebuild_alertes
+
+    n = rebuild_alertes()
+    click.echo(f"{n} cible(s) réévaluée(s), {Alerte.query.count()} alerte(s) active(s).")
+
+
+@finance_cli.command("rebuild-ledger")
+def finance_rebuild_ledger():
+    """Reconstruit le grand livre agrégé (comparaison pluriannuelle)."""
+    from app.budget.ledger import rebuild_ledger
+
+    click.echo(f"{rebuild_ledger()} ligne(s) agrégée(s).")
+
+
+projets_cli = AppGroup("projets", help="Projets et indicateurs.")
+
+
+@projets_cli.command("portfolio-snapshot")
+@click.option("--annee", type=int, default=None, help="Année d'exercice (défaut : toutes).")
+def projets_portfolio_snapshot(annee):
+    """Précalcule le portefeuille de projets (servi par /projets/portefeuille)."""
+    from app.projets.portfolio import save_snapshot
+
+    snap = save_snapshot(annee)
+    click.echo(f"Instantané #{snap.id} ({annee or 'toutes années'}) enregistré à {snap.computed_at:%d/%m/%Y %H:%M}.")
+
+
+def register_cli(app) -> None:
+    app.cli.add_command(rgpd_cli)
+    app.cli.add_command(finance_cli)
+    app.cli.add_command(projets_cli)
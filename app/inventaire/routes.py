@@ -7,6 +7,7 @@ from werkzeug.utils import secure_filename
 
 from app.extensions import db
 from app.models import Subvention, LigneBudget, Depense, FactureAchat, FactureLigne
+from app.services.pagination import keyset_paginate, page_args
 
 
 bp = Blueprint("inventaire", __name__, url_prefix="/factures")
@@ -119,8 +120,14 @@ def factures_list():
     if current_user.role == "responsable_secteur":
         q = q.filter(FactureAchat.secteur_principal == current_user.secteur_assigne)
 
-    factures = q.order_by(FactureAchat.created_at.desc()).all()
-    return render_template("factures_list.html", factures=factures)
+    cursor, per_page = page_args()
+    page = keyset_paginate(
+        q,
+        [(db.func.coalesce(FactureAchat.created_at, datetime(1, 1, 1)), True), (FactureAchat.id, True)],
+        cursor,
+        per_page,
+    )
+    return render_template("factures_list.html", factures=page.items, page=page)
 
 
 @bp.route("/nouvelle", methods=["GET", "POST"])
@@ -7,6 +7,8 @@ from flask_login import login_required, current_user
 
 from app.extensions import db
 from app.models import InventaireItem, FactureLigne, Depense
+from app.search.index import match_or_like
+from app.services.pagination import keyset_paginate, page_args
 
 
 bp = Blueprint("inventaire_materiel", __name__, url_prefix="/inventaire")
@@ -107,28 +109,40 @@ def list_items():
     if search:
         like = f"%{search.lower()}%"
         q = q.filter(
-            db.or_(
-                db.func.lower(InventaireItem.designation).like(like),
-                db.func.lower(db.coalesce(InventaireItem.id_interne, "")).like(like),
-                db.func.lower(db.coalesce(InventaireItem.numero_serie, "")).like(like),
-                db.func.lower(db.coalesce(InventaireItem.marque, "")).like(like),
-                db.func.lower(db.coalesce(InventaireItem.modele, "")).like(like),
+            match_or_like(
+                "inventaire",
+                InventaireItem.id,
+                search,
+                db.or_(
+                    db.func.lower(InventaireItem.designation).like(like),
+                    db.func.lower(db.func.coalesce(InventaireItem.id_interne, "")).like(like),
+                    db.func.lower(db.func.coalesce(InventaireItem.numero_serie, "")).like(like),
+                    db.func.lower(db.func.coalesce(InventaireItem.marque, "")).like(like),
+                    db.func.lower(db.func.coalesce(InventaireItem.modele, "")).like(like),
+                ),
             )
         )
 
+    # tri stable (id en dernier) pour la pagination par curseur
     if sort == "id":
-        q = q.order_by(InventaireItem.id.asc())
+        keys = [(InventaireItem.id, False)]
     elif sort == "designation":
-        q = q.order_by(InventaireItem.designation.asc())
+        keys = [(InventaireItem.designation, False), (InventaireItem.id, False)]
     elif sort == "categorie":
-        q = q.order_by(db.coalesce(InventaireItem.categorie, "").asc(), InventaireItem.designation.asc())
+        keys = [
+            (db.func.coalesce(InventaireItem.categorie, ""), False),
+            (InventaireItem.designation, False),
+            (InventaireItem.id, False),
+        ]
     else:
-        q = q.order_by(InventaireItem.created_at.desc())
+        keys = [(db.func.coalesce(InventaireItem.created_at, datetime(1, 1, 1)), True), (InventaireItem.id, True)]
 
-    items = q.all()
+    cursor, per_page = page_args()
+    page = keyset_paginate(q, keys, cursor, per_page)
     return render_template(
         "inventaire_list.html",
-        items=items,
+        items=page.items,
+        page=page,
         filtre_secteur=secteur,
         filtre_etat=etat,
         filtre_categorie=categorie,
@@ -0,0 +1,215 @@
+"""Émargement kiosque : helpers partagés entre le formulaire et l'API par lot.
+
+L'API par lot sert aux tablettes qui ont perdu le Wi-Fi : elles mettent les
+émargements en file locale puis les envoient d'un coup au retour du réseau.
+Chaque élément porte une clé d'idempotence (`client_key`) générée côté tablette :
+un lot rejoué (réponse perdue, double envoi) ne crée jamais de doublon.
+"""
+from __future__ import annotations
+
+import base64
+import os
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import db
+from app.models import AtelierActivite, Participant, PresenceActivite, SessionActivite
+
+
+MAX_BATCH_ITEMS = 200
+
+_CLIENT_KEY_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+_TYPES_PUBLIC = {"H", "S", "B", "A", "P"}
+
+
+def participant_from_data(data) -> Participant:
+    """Construit un Participant depuis un formulaire ou un dict JSON (non ajouté à la session).
+
+    Lève ValueError si nom/prénom manquent.
+    """
+    def _get(key):
+        v = data.get(key)
+        return str(v).strip() if v is not None else ""
+
+    nom = _get("nom")
+    prenom = _get("prenom")
+    if not nom or not prenom:
+        raise ValueError("Nom et prénom obligatoires.")
+
+    ville = _get("ville") or None
+    qid = None
+    if (ville or "").lower() == "creil":
+        try:
+            qid = int(_get("quartier_id")) if _get("quartier_id") else None
+        except ValueError:
+            qid = None
+
+    dn = None
+    if _get("date_naissance"):
+        try:
+            dn = datetime.strptime(_get("date_naissance"), "%Y-%m-%d").date()
+        except ValueError:
+            dn = None
+
+    type_public = _get("type_public").upper() or "H"
+    if type_public not in _TYPES_PUBLIC:
+        type_public = "H"
+
+    return Participant(
+        nom=nom,
+        prenom=prenom,
+        ville=ville,
+        email=_get("email") or None,
+        telephone=_get("telephone") or None,
+        genre=_get("genre") or None,
+        date_naissance=dn,
+        quartier_id=qid,
+        type_public=type_public,
+    )
+
+
+def signature_filename(session_id: int, participant_id: int, client_key: Optional[str] = None) -> str:
+    # nom déterministe quand la tablette fournit une clé : un rejeu réécrit le même fichier
+    suffix = client_key or str(int(datetime.utcnow().timestamp()))
+    return f"sig_kiosk_s{session_id}_p{participant_id}_{suffix}.png"
+
+
+def write_signature(signature_data: Optional[str], filename: str) -> Optional[str]:
+    """Écrit une signature data:image/png;base64 dans instance/signatures_tmp. Retourne le chemin ou None."""
+    if not signature_data or not signature_data.startswith("data:image"):
+        return None
+    try:
+        _header, b64data = signature_data.split(",", 1)
+        binary = base64.b64decode(b64data)
+        sig_dir = os.path.join(current_app.instance_path, "signatures_tmp")
+        os.makedirs(sig_dir, exist_ok=True)
+        sig_path = os.path.join(sig_dir, filename)
+        with open(sig_path, "wb") as f:
+            f.write(binary)
+        return sig_path
+    except Exception:
+        return None
+
+
+def discard_signature(sig_path: Optional[str]) -> None:
+    """Supprime une signature écrite pour une présence finalement non enregistrée."""
+    if not sig_path:
+        return
+    try:
+        os.remove(sig_path)
+    except OSError:
+        pass
+
+
+def _clean_client_key(raw) -> Optional[str]:
+    key = str(raw or "").strip()
+    return key if _CLIENT_KEY_RE.match(key) else None
+
+
+def _result(key, status: str, message: str = "", **extra) -> Dict[str, Any]:
+    out = {"client_key": key, "status": status, "message": message}
+    out.update(extra)
+    return out
+
+
+def apply_batch(s: SessionActivite, atelier: AtelierActivite, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Enregistre un lot d'émargements dans une seule transaction.
+
+    Chaque élément : {client_key, participant_id | participant{nom, prenom, ...},
+    motif, motif_autre, signature_data}.
+
+    Statuts par élément :
+      - "ok"          : présence créée
+      - "rejoue"      : clé déjà reçue (lot renvoyé) -> résultat d'origine, rien n'est réécrit
+      - "deja_emarge" : la personne est déjà émargée sur cette session
+      - "erreur"      : élément invalide (message explicite)
+
+    Un élément en erreur n'annule pas les autres (SAVEPOINT par élément).
+    """
+    keys = [k for k in (_clean_client_key(it.get("client_key")) for it in items if isinstance(it, dict)) if k]
+    known: Dict[str, PresenceActivite] = {}
+    if keys:
+        known = {
+            pr.client_key: pr
+            for pr in PresenceActivite.query.filter(PresenceActivite.client_key.in_(keys)).all()
+        }
+
+    results: List[Dict[str, Any]] = []
+    written: List[str] = []
+    seen_keys = set()
+    created = 0
+
+    for it in items:
+        if not isinstance(it, dict):
+            results.append(_result(None, "erreur", "Élément invalide."))
+            continue
+        key = _clean_client_key(it.get("client_key"))
+        if not key:
+            results.append(_result(it.get("client_key"), "erreur", "client_key manquante ou invalide."))
+            continue
+        if key in seen_keys:
+            results.append(_result(key, "rejoue", "Clé en double dans le lot."))
+            continue
+        seen_keys.add(key)
+
+        prev = known.get(key)
+        if prev is not None:
+            if prev.session_id != s.id:
+                results.append(_result(key, "erreur", "Clé déjà utilisée sur une autre session."))
+            else:
+                results.append(_result(key, "rejoue", presence_id=prev.id, participant_id=prev.participant_id))
+            continue
+
+        motif = (str(it.get("motif") or "").strip() or None)
+        motif_autre = (str(it.get("motif_autre") or "").strip() or None)
+
+        try:
+            with db.session.begin_nested():
+                if it.get("participant_id"):
+                    participant = db.session.get(Participant, int(it["participant_id"]))
+                    if not participant:
+                        raise LookupError("Participant introuvable.")
+                elif isinstance(it.get("participant"), dict):
+                    participant = participant_from_data(it["participant"])
+                    db.session.add(participant)
+                    db.session.flush()
+                else:
+                    raise LookupError("Choisis un participant (ou crée-le).")
+
+                sig_name = signature_filename(s.id, participant.id, key)
+                pr = PresenceActivite(
+                    session_id=s.id,
+                    participant_id=participant.id,
+                    motif=motif,
+                    motif_autre=motif_autre,
+                    client_key=key,
+                )
+                db.session.add(pr)
+                db.session.flush()
+        except IntegrityError:
+            results.append(_result(key, "deja_emarge", "Déjà émargé(e) sur cette session."))
+            continue
+        except (LookupError, ValueError, TypeError) as exc:
+            results.append(_result(key, "erreur", str(exc) or "Élément invalide."))
+            continue
+
+        sig_path = write_signature(it.get("signature_data"), sig_name)
+        if sig_path:
+            pr.signature_path = sig_path
+            written.append(sig_path)
+        created += 1
+        results.append(_result(key, "ok", presence_id=pr.id, participant_id=participant.id))
+
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        for path in written:
+            discard_signature(path)
+        raise
+
+    return {"created": created, "results": results}
@@ -1,7 +1,4 @@
-import os
-import base64
-import secrets
-from datetime import datetime, date
+from datetime import date, timedelta
 
 from flask import (
     render_template,
@@ -12,9 +9,13 @@ from flask import (
     current_app,
     jsonify,
     flash,
+    make_response,
 )
 
-from app.extensions import db
+from sqlalchemy import case
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import db, csrf
 from app.models import (
     SessionActivite,
     AtelierActivite,
@@ -24,7 +25,22 @@ from app.models import (
     AtelierCapaciteMois,
 )
 
+from app.search.index import match_or_like
+from app.services.db_write import WriteBusyError, run_write
+from app.services.form_once import form_once
+from app.statsimpact.engine import _parse_time_minutes
+
 from . import bp
+from .emargement import (
+    MAX_BATCH_ITEMS,
+    apply_batch,
+    discard_signature,
+    participant_from_data,
+    signature_filename,
+    write_signature,
+)
+from .state import cached_open_sessions
+from app.activite.services import live
 from app.activite.services.docx_utils import generate_individuel_mensuel_docx
 
 
@@ -39,7 +55,11 @@ def _ensure_seed_quartiers():
     ]
     for ville, nom, is_qpv in seeds:
         db.session.add(Quartier(ville=ville, nom=nom, is_qpv=is_qpv))
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # premier passage simultané sur plusieurs tablettes : un autre thread a semé
+        db.session.rollback()
 
 
 def _ensure_month_capacity(atelier: AtelierActivite, session: SessionActivite):
@@ -85,8 +105,9 @@ def _get_open_session_by_token(token: str):
     )
 
 
-def _session_label(s: SessionActivite):
-    atelier = AtelierActivite.query.get(s.atelier_id)
+def _session_label(s: SessionActivite, atelier: AtelierActivite | None = None):
+    if atelier is None:
+        atelier = AtelierActivite.query.get(s.atelier_id)
     secteur = s.secteur
     nom = atelier.nom if atelier else "Atelier"
     if s.session_type == "COLLECTIF":
@@ -107,51 +128,54 @@ def _session_label(s: SessionActivite):
         return f"{secteur} — {nom} — RDV {d} {h}".strip()
 
 
-@bp.route("/", methods=["GET", "POST"])
-def kiosk_home():
-    """Page publique: saisie PIN + liste des sessions ouvertes."""
-    if request.method == "POST":
-        pin = (request.form.get("pin") or "").strip()
-        s = _get_open_session_by_pin(pin)
-        if not s:
-            flash("Code invalide ou session fermée.", "danger")
-            return redirect(url_for("kiosk.kiosk_home"))
-        return redirect(url_for("kiosk.kiosk_session", token=s.kiosk_token))
-
-    today = date.today()
-    # sessions ouvertes du jour (collectif: date_session, individuel: rdv_date)
-    sessions = (
-        SessionActivite.query.filter_by(kiosk_open=True)
+def _build_open_sessions(today: date) -> list[dict]:
+    """Sessions kiosque ouvertes du jour (1 requête, atelier joint), triées par heure de début."""
+    # date effective : collectif -> date_session, individuel -> rdv_date
+    date_effective = case(
+        (SessionActivite.session_type == "COLLECTIF", SessionActivite.date_session),
+        else_=SessionActivite.rdv_date,
+    )
+    rows = (
+        db.session.query(SessionActivite, AtelierActivite)
+        .join(AtelierActivite, AtelierActivite.id == SessionActivite.atelier_id)
+        .filter(SessionActivite.kiosk_open.is_(True))
         .filter(SessionActivite.is_deleted.is_(False))
-        .order_by(SessionActivite.created_at.desc())
-        .limit(300)
+        .filter(date_effective == today)
         .all()
     )
 
-    filtered = []
-    for s in sessions:
-        d = s.date_session if s.session_type == "COLLECTIF" else s.rdv_date
-        if d == today:
-            filtered.append(s)
-
-    # on inverse pour afficher dans l'ordre horaire approximatif
-    filtered = list(reversed(filtered))
-
     entries = []
-    for s in filtered:
-        atelier = AtelierActivite.query.get(s.atelier_id)
+    for s, atelier in rows:
+        debut = s.heure_debut or s.rdv_debut
         entries.append({
             "token": s.kiosk_token,
             "pin": s.kiosk_pin,
-            "label": _session_label(s),
+            "label": _session_label(s, atelier),
             "secteur": s.secteur,
-            "atelier": atelier.nom if atelier else "Atelier",
+            "atelier": atelier.nom,
             "type": s.session_type,
             "date": (s.date_session or s.rdv_date),
-            "debut": s.heure_debut or s.rdv_debut,
+            "debut": debut,
             "fin": s.heure_fin or s.rdv_fin,
+            # heures saisies librement ("14:30", "14h30") : tri sur les minutes parsées
+            "_start": _parse_time_minutes(debut),
         })
+    entries.sort(key=lambda e: (e["_start"] is None, e["_start"] or 0, e["label"]))
+    return entries
+
+
+@bp.route("/", methods=["GET", "POST"])
+def kiosk_home():
+    """Page publique: saisie PIN + liste des sessions ouvertes."""
+    if request.method == "POST":
+        pin = (request.form.get("pin") or "").strip()
+        s = _get_open_session_by_pin(pin)
+        if not s:
+            flash("Code invalide ou session fermée.", "danger")
+            return redirect(url_for("kiosk.kiosk_home"))
+        return redirect(url_for("kiosk.kiosk_session", token=s.kiosk_token))
 
+    entries = cached_open_sessions(date.today(), _build_open_sessions)
     return render_template("kiosk/index.html", sessions=entries)
 
 
@@ -165,13 +189,13 @@ def kiosk_search(token: str):
     if len(q) < 2:
         return jsonify({"results": []})
 
+    # Index FTS5 (préfixes, sans accents) sur nom/prénom uniquement : tablette publique,
+    # pas de recherche par email ou téléphone ; sous-chaînes via le LIKE nom/prénom
     q_norm = q.replace("%", "").replace("_", "")
-
-    # Recherche simple nom/prénom (LIKE). SQLite: case-insensitive sur ASCII, mais c'est ok.
+    like = (Participant.nom.ilike(f"%{q_norm}%")) | (Participant.prenom.ilike(f"%{q_norm}%"))
+    crit = match_or_like("participant", Participant.id, q, like, columns=("nom", "prenom"))
     candidates = (
-        Participant.query.filter(
-            (Participant.nom.ilike(f"%{q_norm}%")) | (Participant.prenom.ilike(f"%{q_norm}%"))
-        )
+        Participant.query.filter(crit)
         .order_by(Participant.nom.asc(), Participant.prenom.asc())
         .limit(12)
         .all()
@@ -186,6 +210,85 @@ def kiosk_search(token: str):
     return jsonify({"results": res})
 
 
+@bp.route("/session/<token>/roster")
+def kiosk_roster(token: str):
+    """Participants habituels de l'atelier, pour la recherche hors-ligne de la tablette."""
+    s = _get_open_session_by_token(token)
+    if not s:
+        return jsonify({"results": []})
+
+    since = date.today() - timedelta(days=365)
+    rows = (
+        db.session.query(Participant.id, Participant.nom, Participant.prenom, Participant.ville)
+        .join(PresenceActivite, PresenceActivite.participant_id == Participant.id)
+        .join(SessionActivite, SessionActivite.id == PresenceActivite.session_id)
+        .filter(SessionActivite.atelier_id == s.atelier_id)
+        .filter(PresenceActivite.created_at >= since)
+        .group_by(Participant.id, Participant.nom, Participant.prenom, Participant.ville)
+        .order_by(Participant.nom.asc(), Participant.prenom.asc())
+        .limit(1000)
+        .all()
+    )
+    res = []
+    for pid, nom, prenom, ville in rows:
+        label = f"{nom} {prenom}"
+        if ville:
+            label += f" · {ville}"
+        res.append({"id": pid, "label": label})
+    return jsonify({"results": res})
+
+
+@bp.route("/session/<token>/batch", methods=["POST"])
+@csrf.exempt
+def kiosk_batch(token: str):
+    """Émargements par lot (JSON), envoyés par la file locale des tablettes.
+
+    Pas de jeton CSRF : la file peut être vidée des heures plus tard, après expiration
+    du jeton. L'accès est protégé par le token de session kiosque et le corps doit être du JSON.
+    """
+    if not request.is_json:
+        return jsonify({"error": "json_attendu"}), 400
+    s = _get_open_session_by_token(token)
+    if not s:
+        # la tablette garde sa file : l'animateur peut rouvrir le kiosque
+        return jsonify({"error": "session_fermee"}), 410
+
+    payload = request.get_json(silent=True) or {}
+    items = payload.get("items")
+    if not isinstance(items, list):
+        return jsonify({"error": "items_attendus"}), 400
+    if len(items) > MAX_BATCH_ITEMS:
+        return jsonify({"error": "lot_trop_gros", "max": MAX_BATCH_ITEMS}), 413
+
+    atelier = AtelierActivite.query.get_or_404(s.atelier_id)
+    # apply_batch est rejouable (clés d'idempotence) : on le relance entier sur verrou
+    try:
+        out = run_write(lambda: apply_batch(s, atelier, items), serialize=True)
+    except WriteBusyError:
+        # la tablette garde sa file et renverra le lot
+        return jsonify({"error": "base_occupee"}), 503
+
+    created_ids = [r["presence_id"] for r in out["results"] if r["status"] == "ok"]
+    if created_ids:
+        live.publish_presences(s.id, PresenceActivite.query.filter(PresenceActivite.id.in_(created_ids)).all())
+
+    # Actions post (individuel mensuel) : une seule régénération par lot
+    if out["created"] and s.session_type == "INDIVIDUEL_MENSUEL":
+        _ensure_month_capacity(atelier, s)
+        generate_individuel_mensuel_docx(app=current_app, atelier=atelier, annee=s.rdv_date.year, mois=s.rdv_date.month)
+
+    return jsonify(out)
+
+
+@bp.route("/sw.js")
+def kiosk_service_worker():
+    """Service worker (portée /kiosk/) : garde la page d'émargement disponible hors-ligne."""
+    resp = make_response(render_template("kiosk/sw.js"))
+    resp.headers["Content-Type"] = "application/javascript; charset=utf-8"
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
 @bp.route("/session/<token>", methods=["GET", "POST"])
 def kiosk_session(token: str):
     """Page publique d'émargement d'une session précise."""
@@ -203,96 +306,80 @@ def kiosk_session(token: str):
     if request.method == "POST":
         action = request.form.get("action")
 
-        if action == "add_participant":
-            nom = (request.form.get("nom") or "").strip()
-            prenom = (request.form.get("prenom") or "").strip()
-            ville = (request.form.get("ville") or "").strip() or None
-            email = (request.form.get("email") or "").strip() or None
-            telephone = (request.form.get("telephone") or "").strip() or None
-            genre = (request.form.get("genre") or "").strip() or None
-            date_naissance = request.form.get("date_naissance") or None
-            quartier_id = request.form.get("quartier_id") or None
-
-            if not nom or not prenom:
-                flash("Nom et prénom obligatoires.", "danger")
-                return redirect(url_for("kiosk.kiosk_session", token=token))
-
-            qid = int(quartier_id) if quartier_id else None
-            if (ville or "").strip().lower() != "creil":
-                qid = None
-
-            dn = None
-            if date_naissance:
+        with form_once(request.form.get("form_token")) as sub:
+            # double tap : même résultat, sans nouvelle écriture ni fichier signature
+            if sub.replayed:
+                if sub.outcome.get("redirect"):
+                    return sub.replay()
+                message_ok = sub.outcome.get("message_ok")
+            elif action == "add_participant":
                 try:
-                    dn = datetime.strptime(date_naissance, "%Y-%m-%d").date()
-                except Exception:
-                    dn = None
-
-            p = Participant(
-                nom=nom,
-                prenom=prenom,
-                ville=ville,
-                email=email,
-                telephone=telephone,
-                genre=genre,
-                date_naissance=dn,
-                quartier_id=qid,
-            )
-            db.session.add(p)
-            db.session.commit()
-            flash("Participant créé. Sélectionne-le ci-dessous puis signe.", "success")
-            return redirect(url_for("kiosk.kiosk_session", token=token, highlight=p.id))
-
-        if action == "emarger":
-            participant_id = request.form.get("participant_id")
-            motif = request.form.get("motif") or None
-            motif_autre = (request.form.get("motif_autre") or "").strip() or None
-            signature_data = request.form.get("signature_data")
-
-            if not participant_id or str(participant_id).lower() in {"null", "undefined"}:
-                flash("Choisis ton nom dans la liste.", "danger")
-                return redirect(url_for("kiosk.kiosk_session", token=token))
-
-            participant = Participant.query.get(int(participant_id))
-            if not participant:
-                flash("Participant introuvable.", "danger")
-                return redirect(url_for("kiosk.kiosk_session", token=token))
-
-            sig_path = None
-            if signature_data and signature_data.startswith("data:image"):
+                    p = participant_from_data(request.form)
+                except ValueError as exc:
+                    flash(str(exc), "danger")
+                    return redirect(url_for("kiosk.kiosk_session", token=token))
+
                 try:
-                    header, b64data = signature_data.split(",", 1)
-                    binary = base64.b64decode(b64data)
-                    sig_dir = os.path.join(current_app.instance_path, "signatures_tmp")
-                    os.makedirs(sig_dir, exist_ok=True)
-                    sig_filename = f"sig_kiosk_s{s.id}_p{participant.id}_{int(datetime.utcnow().timestamp())}.png"
-                    sig_path = os.path.join(sig_dir, sig_filename)
-                    with open(sig_path, "wb") as f:
-                        f.write(binary)
-                except Exception:
-                    sig_path = None
-
-            try:
-                pr = PresenceActivite(
-                    session_id=s.id,
-                    participant_id=participant.id,
-                    motif=motif,
-                    motif_autre=motif_autre,
-                    signature_path=sig_path,
+                    run_write(lambda: db.session.add(p))
+                except WriteBusyError:
+                    discard_signature(sig_path)
+                    flash("Beaucoup de monde en même temps : réessaie dans un instant.", "danger")
+                    return redirect(url_for("kiosk.kiosk_session", token=token))
+                return sub.done(
+                    url_for("kiosk.kiosk_session", token=token, highlight=p.id),
+                    ("Participant créé. Sélectionne-le ci-dessous puis signe.", "success"),
                 )
-                db.session.add(pr)
-                db.session.commit()
-            except Exception:
-                db.session.rollback()
-                flash("Tu es déjà émargé(e) sur cette session.", "warning")
-                return redirect(url_for("kiosk.kiosk_session", token=token))
 
-            # Actions post (individuel mensuel)
-            if s.session_type == "INDIVIDUEL_MENSUEL":
-                _ensure_month_capacity(atelier, s)
-                generate_individuel_mensuel_docx(app=current_app, atelier=atelier, annee=s.rdv_date.year, mois=s.rdv_date.month)
+            elif action == "emarger":
+                participant_id = request.form.get("participant_id")
+                motif = request.form.get("motif") or None
+                motif_autre = (request.form.get("motif_autre") or "").strip() or None
+                signature_data = request.form.get("signature_data")
+
+                if not participant_id or str(participant_id).lower() in {"null", "undefined"}:
+                    flash("Choisis ton nom dans la liste.", "danger")
+                    return redirect(url_for("kiosk.kiosk_session", token=token))
+
+                participant = Participant.query.get(int(participant_id))
+                if not participant:
+                    flash("Participant introuvable.", "danger")
+                    return redirect(url_for("kiosk.kiosk_session", token=token))
+
+                sig_path = write_signature(signature_data, signature_filename(s.id, participant.id))
+
+                def _insert():
+                    pr = PresenceActivite(
+                        session_id=s.id,
+                        participant_id=participant.id,
+                        motif=motif,
+                        motif_autre=motif_autre,
+                        signature_path=sig_path,
+                    )
+                    db.session.add(pr)
+                    return pr
 
-            message_ok = "Merci, c’est bon !"
+                try:
+                    pr = run_write(_insert, serialize=True)
+                except IntegrityError:
+                    discard_signature(sig_path)
+                    return sub.done(
+                        url_for("kiosk.kiosk_session", token=token),
+                        ("Tu es déjà émargé(e) sur cette session.", "warning"),
+                    )
+                except WriteBusyError:
+                    discard_signature(sig_path)
+                    flash("Beaucoup de monde en même temps : réessaie dans un instant.", "danger")
+                    return redirect(url_for("kiosk.kiosk_session", token=token, highlight=participant.id))
+
+                live.publish_presences(s.id, [pr])
+                sub.record({"message_ok": "Merci, c’est bon !"})
+
+                # Actions post (individuel mensuel)
+                if s.session_type == "INDIVIDUEL_MENSUEL":
+                    _ensure_month_capacity(atelier, s)
+                    generate_individuel_mensuel_docx(app=current_app, atelier=atelier, annee=s.rdv_date.year, mois=s.rdv_date.month)
+
+                message_ok = sub.outcome["message_ok"]
 
     highlight = request.args.get("highlight")
     highlight_label = None
@@ -304,7 +391,7 @@ def kiosk_session(token: str):
         except Exception:
             highlight = None
 
-    label = _session_label(s)
+    label = _session_label(s, atelier)
 
     return render_template(
         "kiosk/session.html",
@@ -0,0 +1,54 @@
+"""État du kiosque partagé entre threads (cache de la page d'accueil).
+
+Les tablettes rechargent /kiosk en boucle : la liste des sessions ouvertes du jour
+est mise en cache en mémoire, indexée par une "version d'état kiosque".
+Toute ouverture / fermeture / mise en corbeille d'un kiosque appelle
+`bump_kiosk_state()`, ce qui invalide le cache immédiatement.
+
+Un TTL court reste en filet de sécurité (renommage d'atelier, écriture depuis
+un autre processus, changement de jour).
+"""
+from __future__ import annotations
+
+import threading
+import time
+from datetime import date
+from typing import Any, Callable, List, Optional, Tuple
+
+CACHE_TTL_SECONDS = 30
+
+_lock = threading.Lock()
+_version = 0
+# (version, jour, horodatage, valeur)
+_cached: Optional[Tuple[int, date, float, List[Any]]] = None
+
+
+def kiosk_state_version() -> int:
+    return _version
+
+
+def bump_kiosk_state() -> int:
+    """À appeler après chaque commit qui ouvre/ferme un kiosque."""
+    global _version, _cached
+    with _lock:
+        _version += 1
+        _cached = None
+        return _version
+
+
+def cached_open_sessions(today: date, builder: Callable[[date], List[Any]]) -> List[Any]:
+    """Retourne la liste du jour depuis le cache, ou la reconstruit via `builder`."""
+    global _cached
+    now = time.monotonic()
+    with _lock:
+        version = _version
+        hit = _cached
+    if hit and hit[0] == version and hit[1] == today and (now - hit[2]) < CACHE_TTL_SECONDS:
+        return hit[3]
+
+    value = builder(today)
+    with _lock:
+        # on n'écrase pas un cache invalidé entre-temps
+        if _version == version:
+            _cached = (version, today, now, value)
+    return value
@@ -1,63 +1,21 @@
-import csv
-from io import StringIO
 from datetime import date
 
-
-def _parse_iso_date(s: str):
-    try:
-        if not s:
-            return None
-        return date.fromisoformat(s)
-    except Exception:
-        return None
-
-def _indicator_date_range(params: dict, selected_annee: int | None):
-    period = (params.get("period") or "context").strip()
-    if period == "custom":
-        d1 = _parse_iso_date(params.get("start") or "")
-        d2 = _parse_iso_date(params.get("end") or "")
-        if d1 and d2 and d2 < d1:
-            d1, d2 = d2, d1
-        return d1, d2
-    if period == "year" or period == "context":
-        if selected_annee:
-            return date(selected_annee, 1, 1), date(selected_annee, 12, 31)
-    return None, None
-
-def _indicator_target_status(value, target, op: str):
-    if target is None or value is None:
-        return None
-    try:
-        v = float(value)
-        t = float(target)
-    except Exception:
-        return None
-    if t == 0:
-        return None
-    op = (op or "ge").strip()
-
-    # ge : on veut v >= t ; le : on veut v <= t
-    if op == "le":
-        ratio = t / v if v != 0 else float("inf")
-        ok = v <= t
-    else:
-        ratio = v / t
-        ok = v >= t
-
-    if ok:
-        return "ok"
-    if ratio >= 0.75:
-        return "warn"
-    return "bad"
 from flask import (
     Blueprint, render_template, request, redirect, url_for, flash,
-    abort, current_app, Response, jsonify
+    abort, current_app, jsonify
 )
 from flask_login import login_required, current_user
 
 from app.extensions import db
-from app.models import Subvention, LigneBudget, Depense, Projet, SubventionProjet, AtelierActivite, SessionActivite, PresenceActivite, ProjetAtelier, ProjetIndicateur
+from app.models import Subvention, LigneBudget, Depense, Projet, SubventionProjet
 from app.services.dashboard_service import build_dashboard_context
+from app.services.finance_snapshot import FinanceSnapshot
+from app.services import finance_aggregates, indicators
+from app.services.alertes import REGLES_BILAN, alertes_subventions
+from app.services.csv_export import csv_response, fr_amount
+from app.services.data_version import data_version
+from app.services.db_write import WriteBusyError
+from app.budget import fec, ledger, projection, ventilation
 
 bp = Blueprint("main", __name__)
 
@@ -70,37 +28,6 @@ def can_see_secteur(secteur: str) -> bool:
     return False  # admin_tech n'accède pas aux données budgétaires
 
 
-def _compute_prorata(lignes, montant_cible: float):
-    """
-    Calcule une répartition pro-rata sur montant_base.
-    Ne modifie pas la DB : retourne un dict {ligne_id: montant_theorique}
-    Ajuste la dernière ligne pour tomber pile au centime.
-    """
-    lignes = list(lignes)
-    out = {}
-    if not lignes:
-        return out
-
-    total_base = sum(float(l.montant_base or 0) for l in lignes)
-    if total_base <= 0:
-        for l in lignes:
-            out[l.id] = 0.0
-        return out
-
-    ratio = float(montant_cible or 0) / total_base
-
-    cumul = 0.0
-    for i, l in enumerate(lignes):
-        base = float(l.montant_base or 0)
-        part = round(base * ratio, 2)
-        if i == len(lignes) - 1:
-            part = round(float(montant_cible or 0) - cumul, 2)
-        out[l.id] = float(part)
-        cumul += float(part)
-
-    return out
-
-
 # --------- Setup start ---------
 @bp.route("/setup-start")
 def setup_start():
@@ -136,7 +63,8 @@ def subventions_list():
         subs_q = subs_q.filter(Subvention.secteur == current_user.secteur_assigne)
 
     subs = subs_q.order_by(Subvention.annee_exercice.desc(), Subvention.nom.asc()).all()
-    return render_template("subventions_list.html", subs=subs, secteurs=secteurs)
+    fin = FinanceSnapshot.load(subvention_ids=[s.id for s in subs])
+    return render_template("subventions_list.html", subs=subs, secteurs=secteurs, fin=fin)
 
 
 @bp.route("/subvention/nouvelle", methods=["POST"])
@@ -262,7 +190,7 @@ def subvention_pilotage(subvention_id):
                     flash("Impossible : total des bases = 0.", "danger")
                     return redirect(url_for("main.subvention_pilotage", subvention_id=sub.id))
 
-                theor = _compute_prorata(lignes, montant_cible)
+                theor = ventilation.compute_prorata(lignes, montant_cible)
                 for l in lignes:
                     l.montant_reel = float(theor.get(l.id, 0.0))
                 db.session.commit()
@@ -284,12 +212,13 @@ def subvention_pilotage(subvention_id):
     lignes = list(sub.lignes)
     total_base = round(sum(float(l.montant_base or 0) for l in lignes), 2)
 
-    theor_recu = _compute_prorata(lignes, float(sub.montant_recu or 0))
-    theor_attribue = _compute_prorata(lignes, float(sub.montant_attribue or 0))
+    theor_recu = ventilation.compute_prorata(lignes, float(sub.montant_recu or 0))
+    theor_attribue = ventilation.compute_prorata(lignes, float(sub.montant_attribue or 0))
 
+    fin = FinanceSnapshot.load(subvention_ids=[sub.id])
     recu = float(sub.montant_recu or 0)
-    reel_lignes = float(sub.total_reel_lignes or 0)
-    engage = float(sub.total_engage or 0)
+    reel_lignes = fin.sub(sub.id).total_reel_lignes
+    engage = fin.sub(sub.id).total_engage
 
     warnings = []
     if recu > 0 and reel_lignes == 0:
@@ -307,7 +236,79 @@ def subvention_pilotage(subvention_id):
         total_base=total_base,
         theor_recu=theor_recu,
         theor_attribue=theor_attribue,
-        warnings=warnings
+        warnings=warnings,
+        fin=fin,
+    )
+
+
+# --------- Ventilation groupée (fin d'exercice) ---------
+@bp.route("/subventions/ventilation", methods=["GET", "POST"])
+@login_required
+def subventions_ventilation():
+    """Simule une ventilation sur plusieurs subventions, puis applique le plan en une transaction."""
+    if current_user.role == "admin_tech":
+        abort(403)
+
+    src = request.form if request.method == "POST" else request.args
+    annee = src.get("annee", type=int)
+    secteur = (src.get("secteur") or "").strip() or None
+    if current_user.role == "responsable_secteur":
+        secteur = current_user.secteur_assigne
+    mode = src.get("mode") or "prorata_base"
+    if mode not in ventilation.MODES:
+        mode = "prorata_base"
+    target = src.get("target") or "recu"
+    if target not in ventilation.TARGETS:
+        target = "recu"
+
+    candidats_q = db.session.query(
+        Subvention.id, Subvention.nom, Subvention.secteur, Subvention.annee_exercice,
+        Subvention.montant_attribue, Subvention.montant_recu,
+    ).filter(Subvention.est_archive.is_(False))
+    if annee:
+        candidats_q = candidats_q.filter(Subvention.annee_exercice == annee)
+    if secteur:
+        candidats_q = candidats_q.filter(Subvention.secteur == secteur)
+    candidats = candidats_q.order_by(Subvention.annee_exercice.desc(), Subvention.nom.asc()).all()
+    visibles = {c.id for c in candidats}
+    selected_ids = [i for i in src.getlist("sid", type=int) if i in visibles]
+
+    if request.method == "POST":
+        # le plan validé à l'écran doit être celui qui sera écrit
+        if src.get("version", type=int) != data_version("finance"):
+            flash("Les données ont changé depuis la simulation : vérifie le nouveau plan avant d'appliquer.", "warning")
+        else:
+            plans = ventilation.simulate(selected_ids, mode, target)
+            try:
+                n = ventilation.apply(plans)
+            except WriteBusyError as exc:
+                flash(str(exc), "danger")
+            else:
+                nb_subs = sum(1 for p in plans if not p.erreur and p.nb_modifiees)
+                flash(f"Ventilation appliquée : {n} ligne(s) mise(s) à jour sur {nb_subs} subvention(s).", "success")
+        return redirect(url_for(
+            "main.subventions_ventilation", annee=annee, secteur=secteur, sid=selected_ids, mode=mode, target=target,
+        ))
+
+    version = data_version("finance")
+    plans = ventilation.simulate(selected_ids, mode, target)
+    secteurs = current_app.config.get("SECTEURS", [])
+    if current_user.role == "responsable_secteur":
+        secteurs = [current_user.secteur_assigne]
+
+    return render_template(
+        "subventions_ventilation.html",
+        candidats=candidats,
+        selected_ids=set(selected_ids),
+        plans=plans,
+        version=version,
+        modes=ventilation.MODES,
+        targets=ventilation.TARGETS,
+        mode=mode,
+        target=target,
+        annee=annee,
+        secteur=secteur,
+        secteurs=secteurs,
     )
 
 
@@ -440,16 +441,18 @@ def api_lignes(subvention_id):
         q = q.filter(LigneBudget.compte == compte)
 
     lignes = q.order_by(LigneBudget.compte.asc(), LigneBudget.libelle.asc()).all()
+    fin = FinanceSnapshot.load(subvention_ids=[sub.id])
 
     out = []
     for l in lignes:
+        lt = fin.ligne(l.id)
         out.append({
             "id": l.id,
             "compte": l.compte,
             "libelle": l.libelle,
             "montant_reel": float(l.montant_reel or 0),
-            "engage": float(l.engage or 0),
-            "reste": float(l.reste or 0),
+            "engage": lt.engage if lt else 0.0,
+            "reste": lt.reste if lt else 0.0,
         })
 
     return jsonify({"lignes": out})
@@ -522,56 +525,41 @@ def stats():
             if not p_tmp or p_tmp.secteur != current_user.secteur_assigne:
                 selected_projet_id = None
 
-    subs = sub_q.order_by(Subvention.annee_exercice.desc(), Subvention.nom.asc()).all()
     projets = proj_q.order_by(Projet.nom.asc()).all()
 
-    # Pré-calcul des années disponibles (pour sélecteur)
-    all_annees = sorted({s.annee_exercice for s in Subvention.query.filter_by(est_archive=False).all()}, reverse=True)
+    # Périmètre en sous-requête : les agrégats sont calculés en SQL groupé
+    # (un nombre fixe de requêtes, indépendant du nombre de lignes / dépenses)
+    sub_ids = sub_q.with_entities(Subvention.id).statement
+
+    # Années disponibles (pour sélecteur)
+    all_annees = finance_aggregates.annees_disponibles()
     all_secteurs = current_app.config.get("SECTEURS", [])
 
     # --- Totaux globaux ---
-    total_recu = round(sum(float(s.montant_recu or 0) for s in subs), 2)
-    total_engage = round(sum(float(s.total_engage or 0) for s in subs), 2)
-    total_reste = round(sum(float(s.total_reste or 0) for s in subs), 2)
+    tot = finance_aggregates.totals(sub_ids)
+    total_recu = tot["recu"]
+    total_engage = tot["engage"]
+    total_reste = tot["reste"]
 
     # --- Agrégation par secteur ---
-    by_secteur: dict[str, dict[str, float]] = {}
-    for s in subs:
-        d = by_secteur.setdefault(s.secteur, {"recu": 0.0, "engage": 0.0, "reste": 0.0})
-        d["recu"] += float(s.montant_recu or 0)
-        d["engage"] += float(s.total_engage or 0)
-        d["reste"] += float(s.total_reste or 0)
-    for sec, vals in by_secteur.items():
-        vals["recu"] = round(vals.get("recu", 0.0), 2)
-        vals["engage"] = round(vals.get("engage", 0.0), 2)
-        vals["reste"] = round(vals.get("reste", 0.0), 2)
+    by_secteur: dict[str, dict[str, float]] = {
+        sec: {"recu": v["recu"], "engage": v["engage"], "reste": v["reste"]}
+        for sec, v in finance_aggregates.by_secteur(sub_ids).items()
+    }
 
     # --- Agrégation par compte ---
-    by_compte: dict[str, dict[str, float]] = {}
-    for s in subs:
-        for l in s.lignes:
-            d = by_compte.setdefault(l.compte, {"reel": 0.0, "engage": 0.0, "reste": 0.0})
-            d["reel"] += float(l.montant_reel or 0)
-            d["engage"] += float(l.engage or 0)
-            d["reste"] += float(l.reste or 0)
-    for comp, vals in by_compte.items():
-        vals["reel"] = round(vals.get("reel", 0.0), 2)
-        vals["engage"] = round(vals.get("engage", 0.0), 2)
-        vals["reste"] = round(vals.get("reste", 0.0), 2)
+    by_compte: dict[str, dict[str, float]] = finance_aggregates.by_compte(sub_ids)
 
     # --- Détails par projet ---
+    projet_totals = finance_aggregates.by_projet([p.id for p in projets])
+    empty = dict.fromkeys(("demande", "attribue", "recu", "reel_lignes", "engage", "reste"), 0.0)
     by_projet: list[dict[str, float | str]] = []
     for p in projets:
         by_projet.append({
             "id": p.id,
             "nom": p.nom,
             "secteur": p.secteur,
-            "demande": p.total_demande,
-            "attribue": p.total_attribue,
-            "recu": p.total_recu,
-            "reel_lignes": p.total_reel_lignes,
-            "engage": p.total_engage,
-            "reste": p.total_reste,
+            **projet_totals.get(p.id, empty),
         })
 
     # Valeurs max pour barres proportionnelles
@@ -587,135 +575,15 @@ def stats():
         selected_projet = Projet.query.get(selected_projet_id)
 
     if selected_projet and can_see_secteur(selected_projet.secteur):
-        atelier_ids = [lnk.atelier_id for lnk in ProjetAtelier.query.filter_by(projet_id=selected_projet.id).all()]
-
-        # borne temporelle : année si fournie, sinon pas de filtre
-        date_min = date_max = None
-        if selected_annee:
-            date_min = date(selected_annee, 1, 1)
-            date_max = date(selected_annee, 12, 31)
-
-
-        # Valeurs calculées "par défaut" sur l'année sélectionnée (context)
-        base_date_min = base_date_max = None
-        if selected_annee:
-            base_date_min = date(selected_annee, 1, 1)
-            base_date_max = date(selected_annee, 12, 31)
-
-        def _compute_participants_metrics(atelier_ids_scope, dmin, dmax):
-            out = {
-                "participants_uniques": 0,
-                "presences_totales": 0,
-                "sessions_totales": 0,
-                "recurrence_2plus": 0,
-            }
-            if not atelier_ids_scope:
-                return out
-
-            sess_q = SessionActivite.query.filter(SessionActivite.atelier_id.in_(atelier_ids_scope))                 .filter(SessionActivite.is_deleted == False)                 .filter(SessionActivite.statut != "annulee")
-
-            session_date = db.func.coalesce(SessionActivite.date_session, SessionActivite.rdv_date)
-            if dmin and dmax:
-                sess_q = sess_q.filter(session_date >= dmin).filter(session_date <= dmax)
-
-            out["sessions_totales"] = int(sess_q.count())
-
-            sess_ids = [r[0] for r in sess_q.with_entities(SessionActivite.id).all()]
-            if not sess_ids:
-                return out
-
-            pres_q = PresenceActivite.query.filter(PresenceActivite.session_id.in_(sess_ids))
-            out["presences_totales"] = int(pres_q.count())
-            out["participants_uniques"] = int(
-                pres_q.with_entities(db.func.count(db.distinct(PresenceActivite.participant_id))).scalar() or 0
-            )
-
-            sub = pres_q.with_entities(
-                PresenceActivite.participant_id,
-                db.func.count(PresenceActivite.id).label("c"),
-            ).group_by(PresenceActivite.participant_id).having(db.func.count(PresenceActivite.id) >= 2)
-            out["recurrence_2plus"] = int(sub.count())
-            return out
-
         # Finances : charges / produits sur les subventions déjà filtrées (année/secteur/projet)
-        dep = 0.0
-        rec = 0.0
-        for s in subs:
-            for l in s.lignes:
-                mt = float(l.montant_reel or 0)
-                if (l.nature or "").lower() == "charge":
-                    dep += mt
-                elif (l.nature or "").lower() == "produit":
-                    rec += mt
-        dep = round(dep, 2)
-        rec = round(rec, 2)
-
-        inds = ProjetIndicateur.query.filter_by(projet_id=selected_projet.id, is_active=True)             .order_by(ProjetIndicateur.created_at.asc()).all()
-
-        unit_map = {
-            "depenses_totales": "€",
-            "recettes_totales": "€",
-            "cout_par_participant": "€",
-            "cout_par_presence": "€",
-        }
-
-        for ind in inds:
-            params = ind.params() or {}
-            dmin, dmax = _indicator_date_range(params, selected_annee)
-
-            # scope atelier (si défini)
-            scope_atelier_ids = list(atelier_ids)
-            atelier_id = params.get("atelier_id")
-            try:
-                if atelier_id:
-                    atelier_id_int = int(atelier_id)
-                    if atelier_id_int in atelier_ids:
-                        scope_atelier_ids = [atelier_id_int]
-            except Exception:
-                pass
-
-            metrics = _compute_participants_metrics(scope_atelier_ids, dmin, dmax)
-
-            # Valeur selon le code
-            val = None
-            code = ind.code
-
-            if code in ("participants_uniques", "presences_totales", "sessions_totales", "recurrence_2plus"):
-                val = metrics.get(code, 0)
-
-            elif code == "depenses_totales":
-                val = dep
-
-            elif code == "recettes_totales":
-                val = rec
-
-            elif code == "cout_par_participant":
-                u = metrics.get("participants_uniques", 0) or 0
-                val = round(dep / u, 2) if u else None
-
-            elif code == "cout_par_presence":
-                u = metrics.get("presences_totales", 0) or 0
-                val = round(dep / u, 2) if u else None
-
-            # objectifs (optionnels)
-            target = params.get("target", None)
-            op = params.get("target_op", "ge")
-            status = _indicator_target_status(val, target, op)
-
-            project_indicators.append({
-                "label": ind.label,
-                "code": ind.code,
-                "value": val,
-                "unit": unit_map.get(ind.code, ""),
-                "target": target,
-                "target_op": op,
-                "status": status,
-                "period": (params.get("period") or "context"),
-                "start": params.get("start"),
-                "end": params.get("end"),
-                "atelier_id": params.get("atelier_id"),
-            })
-        inds = ProjetIndicateur.query.filter_by(projet_id=selected_projet.id, is_active=True).order_by(ProjetIndicateur.created_at.asc()).all()
+        pid = selected_projet.id
+        results = indicators.evaluate(
+            indicators.active_indicators([pid]),
+            indicators.projet_atelier_ids([pid]),
+            {pid: finance_aggregates.reel_par_nature(sub_ids)},
+            selected_annee=selected_annee,
+        )
+        project_indicators = results.get(pid, [])
 
     return render_template(
         "stats.html",
@@ -739,6 +607,86 @@ def stats():
     )
 
 
+# --- Comparaison pluriannuelle (grand livre agrégé) ---
+@bp.route("/stats/comparaison")
+@login_required
+def stats_comparaison():
+    if current_user.role == "admin_tech":
+        abort(403)
+
+    # le sélecteur d'années lit aussi `ledger_rollup` : file vidée avant
+    ledger.sync_ledger()
+    all_annees = ledger.annees_disponibles()
+    annees = [a for a in request.args.getlist("annee", type=int) if a in all_annees]
+    if not annees:
+        annees = all_annees[:3]
+
+    axis = request.args.get("axe") or "compte"
+    if axis not in ledger.AXES:
+        axis = "compte"
+    metric = request.args.get("mesure") or "reel"
+    if metric not in ledger.METRICS:
+        metric = "reel"
+    if axis == "mois":
+        # base et réel sont annuels : seul l'engagé est ventilé par mois
+        metric = "engage"
+    nature = request.args.get("nature", "charge")
+    if nature not in ("charge", "produit", ""):
+        nature = "charge"
+
+    selected_secteur = (request.args.get("secteur") or "").strip() or None
+    if current_user.role == "responsable_secteur":
+        selected_secteur = current_user.secteur_assigne
+
+    comparaison = ledger.compare_years(annees, axis=axis, metric=metric, nature=nature or None,
+                                       secteur=selected_secteur)
+    return render_template(
+        "stats_comparaison.html",
+        comparaison=comparaison,
+        all_annees=all_annees,
+        all_secteurs=current_app.config.get("SECTEURS", []),
+        selected_secteur=selected_secteur,
+        axis=axis,
+        metric=metric,
+        nature=nature,
+    )
+
+
+@bp.route("/stats/projections")
+@login_required
+def stats_projections():
+    if current_user.role == "admin_tech":
+        abort(403)
+
+    all_annees = [
+        a for (a,) in db.session.query(Subvention.annee_exercice).distinct().order_by(Subvention.annee_exercice.desc())
+        if a is not None
+    ]
+    annee = request.args.get("annee", type=int)
+    if annee not in all_annees:
+        annee = date.today().year if date.today().year in all_annees else (all_annees[0] if all_annees else date.today().year)
+
+    methode = request.args.get("methode") or "saisonnier"
+    if methode not in projection.METHODES:
+        methode = "saisonnier"
+
+    selected_secteur = (request.args.get("secteur") or "").strip() or None
+    if current_user.role == "responsable_secteur":
+        selected_secteur = current_user.secteur_assigne
+
+    rows = projection.projections(annee, [selected_secteur] if selected_secteur else None, methode=methode)
+    return render_template(
+        "stats_projections.html",
+        rows=rows,
+        annee=annee,
+        all_annees=all_annees,
+        all_secteurs=current_app.config.get("SECTEURS", []),
+        selected_secteur=selected_secteur,
+        methode=methode,
+        methodes=projection.METHODES,
+    )
+
+
 # --- Hub ergonomique : 1 menu "Stats & bilans" ---
 @bp.route("/stats-bilans")
 @login_required
@@ -821,29 +769,17 @@ def bilan_global():
         Subvention.nom.asc()
     ).all()
 
-    # --- Totaux ---
-    totals = {
-        "demande": round(sum(float(s.montant_demande or 0) for s in subs), 2),
-        "attribue": round(sum(float(s.montant_attribue or 0) for s in subs), 2),
-        "recu": round(sum(float(s.montant_recu or 0) for s in subs), 2),
-        "reel_lignes": round(sum(float(s.total_reel_lignes or 0) for s in subs), 2),
-        "engage": round(sum(float(s.total_engage or 0) for s in subs), 2),
-        "reste": round(sum(float(s.total_reste or 0) for s in subs), 2),
-    }
+    # --- Totaux (instantané ensembliste, une requête groupée) ---
+    fin = FinanceSnapshot.load(subvention_ids=[s.id for s in subs])
+    totals = fin.total()
 
-    # --- Alertes simples (optionnel mais utile) ---
-    alertes = []
-    for s in subs:
-        recu = float(s.montant_recu or 0)
-        reel_lignes = float(s.total_reel_lignes or 0)
-        engage = float(s.total_engage or 0)
-
-        if recu > 0 and reel_lignes == 0:
-            alertes.append(f"{s.nom} : reçu {recu:.2f}€ mais lignes réel = 0€ (ventilation manquante).")
-        if recu > 0 and reel_lignes > 0 and reel_lignes < recu:
-            alertes.append(f"{s.nom} : reçu {recu:.2f}€ mais lignes réel = {reel_lignes:.2f}€ (ventilation incomplète).")
-        if reel_lignes > 0 and engage > reel_lignes:
-            alertes.append(f"{s.nom} : engagé {engage:.2f}€ > lignes réel {reel_lignes:.2f}€ (dépassement).")
+    # --- Alertes (table `alerte`, tenue à jour par services/alertes.py) ---
+    # même ordre que la liste des subventions, puis ordre des règles
+    rang = {s.id: i for i, s in enumerate(subs)}
+    alertes = [
+        a.message
+        for a in sorted(alertes_subventions(REGLES_BILAN, subvention_ids=list(rang)), key=lambda a: rang[a.cible_id])
+    ]
 
     # --- Listes de filtres affichées (secteurs / projets) ---
     # secteurs : soit config, soit distinct en base, MAIS filtré par rôle
@@ -863,7 +799,8 @@ def bilan_global():
     return render_template(
         "bilan.html",
         subs=subs,
-        totals=type("Obj", (), totals),  # petit hack pour totals.demande etc si ton template utilise des attributs
+        totals=totals,
+        fin=fin,
         alertes=alertes,
         secteurs=secteurs,
         projets=projets,
@@ -888,36 +825,47 @@ def export_depenses_csv():
     if current_user.role == "admin_tech":
         abort(403)
 
-    dep_q = Depense.query.join(LigneBudget).join(Subvention)
+    # une requête jointe, colonnes seulement, lue par paquets pendant l'envoi
+    dep_q = (
+        db.session.query(
+            Subvention.secteur,
+            Subvention.nom,
+            Subvention.annee_exercice,
+            LigneBudget.compte,
+            LigneBudget.libelle,
+            Depense.libelle,
+            Depense.montant,
+            Depense.date_paiement,
+            Depense.type_depense,
+        )
+        .select_from(Depense)
+        .join(LigneBudget, Depense.ligne_budget_id == LigneBudget.id)
+        .join(Subvention, LigneBudget.subvention_id == Subvention.id)
+    )
     if current_user.role == "responsable_secteur":
         dep_q = dep_q.filter(Subvention.secteur == current_user.secteur_assigne)
 
-    deps = dep_q.all()
-
-    out = StringIO()
-    writer = csv.writer(out, delimiter=";")
-    writer.writerow(["secteur", "subvention", "annee", "compte", "ligne", "depense", "montant", "date_paiement", "type"])
-
-    for d in deps:
-        l = d.budget_source
-        s = l.source_sub
-        writer.writerow([
-            s.secteur,
-            s.nom,
-            s.annee_exercice,
-            l.compte,
-            l.libelle,
-            d.libelle,
-            f"{float(d.montant or 0):.2f}".replace(".", ","),
-            d.date_paiement.isoformat() if d.date_paiement else "",
-            d.type_depense or ""
-        ])
-
-    content = out.getvalue().encode("utf-8-sig")  # Excel friendly
-    filename = f"depenses_{date.today().isoformat()}.csv"
-    return Response(content, mimetype="text/csv", headers={
-        "Content-Disposition": f"attachment; filename={filename}"
-    })
+    def rows():
+        for secteur, sub_nom, annee, compte, ligne, libelle, montant, date_paiement, type_depense in (
+            dep_q.order_by(Depense.id.asc()).yield_per(1000)
+        ):
+            yield [
+                secteur,
+                sub_nom,
+                annee,
+                compte,
+                ligne,
+                libelle,
+                fr_amount(montant),
+                date_paiement.isoformat() if date_paiement else "",
+                type_depense or "",
+            ]
+
+    return csv_response(
+        f"depenses_{date.today().isoformat()}.csv",
+        ["secteur", "subvention", "annee", "compte", "ligne", "depense", "montant", "date_paiement", "type"],
+        rows(),
+    )
 
 
 @bp.route("/export/subvention/<int:subvention_id>.csv")
@@ -929,28 +877,52 @@ def export_subvention_csv(subvention_id):
     s = Subvention.query.get_or_404(subvention_id)
     if not can_see_secteur(s.secteur):
         abort(403)
+    nom, secteur, annee = s.nom, s.secteur, s.annee_exercice
+
+    # engagé : colonne dénormalisée (budget/engagement.py), mêmes règles que FinanceSnapshot
+    lignes_q = (
+        db.session.query(
+            LigneBudget.compte,
+            LigneBudget.libelle,
+            LigneBudget.nature,
+            LigneBudget.montant_base,
+            LigneBudget.montant_reel,
+            LigneBudget.engage_cache,
+        )
+        .filter(LigneBudget.subvention_id == subvention_id)
+        .order_by(LigneBudget.id.asc())
+    )
+
+    def rows():
+        for compte, libelle, nature, base, reel, engage_cache in lignes_q.yield_per(1000):
+            engage = reste = 0.0
+            if (nature or "charge") == "charge":
+                engage = round(float(engage_cache or 0), 2)
+                reste = round(float(reel or 0) - engage, 2)
+            yield [nom, secteur, annee, compte, libelle, fr_amount(base), fr_amount(reel),
+                   fr_amount(engage), fr_amount(reste)]
+
+    return csv_response(
+        f"subvention_{subvention_id}.csv",
+        ["subvention", "secteur", "annee", "compte", "ligne", "base", "reel", "engage", "reste"],
+        rows(),
+    )
+
+
+@bp.route("/export/fec.csv")
+@login_required
+def export_fec_csv():
+    """Journal des achats d'un exercice au format FEC, pour le cabinet comptable."""
+    if current_user.role == "admin_tech":
+        abort(403)
+
+    annee = request.args.get("annee", type=int) or date.today().year
+    secteur = (request.args.get("secteur") or "").strip() or None
+    if current_user.role == "responsable_secteur":
+        secteur = current_user.secteur_assigne
 
-    out = StringIO()
-    writer = csv.writer(out, delimiter=";")
-    writer.writerow(["subvention", "secteur", "annee", "compte", "ligne", "base", "reel", "engage", "reste"])
-
-    for l in s.lignes:
-        writer.writerow([
-            s.nom,
-            s.secteur,
-            s.annee_exercice,
-            l.compte,
-            l.libelle,
-            f"{float(l.montant_base or 0):.2f}".replace(".", ","),
-            f"{float(l.montant_reel or 0):.2f}".replace(".", ","),
-            f"{float(l.engage or 0):.2f}".replace(".", ","),
-            f"{float(l.reste or 0):.2f}".replace(".", ","),
-        ])
-
-    content = out.getvalue().encode("utf-8-sig")
-    return Response(content, mimetype="text/csv", headers={
-        "Content-Disposition": f"attachment; filename=subvention_{s.id}.csv"
-    })
+    suffixe = f"_{secteur}" if secteur else ""
+    return csv_response(f"fec_{annee}{suffixe}.csv", fec.HEADER, fec.iter_fec_rows(annee, secteur))
 
 
 # --------- Bilan par subvention ---------
@@ -975,12 +947,13 @@ def subvention_bilan(subvention_id: int):
     lignes: list[dict[str, float | str]] = []
     # Calcul du montant maximum utilisé pour la largeur des barres
     max_total = 0.0
-    for l in sub.lignes:
-        base = float(l.montant_base or 0)
-        reel = float(l.montant_reel or 0)
-        engage = float(l.engage or 0)
-        reste = float(l.reste or 0)
-        nature = getattr(l, "nature", "charge")
+    fin = FinanceSnapshot.load(subvention_ids=[sub.id])
+    for l in sorted(fin.lignes_of(sub.id), key=lambda lt: lt.id):
+        base = l.montant_base
+        reel = l.montant_reel
+        engage = l.engage
+        reste = l.reste
+        nature = l.nature
         total_for_max = reel + engage + reste
         if total_for_max > max_total:
             max_total = total_for_max
@@ -217,6 +217,10 @@ class Subvention(db.Model):
     est_archive = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Cumuls dénormalisés (triggers, voir app/budget/engagement.py)
+    engage_cache = db.Column(db.Float, nullable=False, default=0.0)  # lignes de charge
+    nb_depenses = db.Column(db.Integer, nullable=False, default=0)
+
     lignes = db.relationship("LigneBudget", backref="source_sub", cascade="all, delete-orphan")
     projets = db.relationship("SubventionProjet", back_populates="subvention", cascade="all, delete-orphan")
 
@@ -250,7 +254,7 @@ class Subvention(db.Model):
         return round(float(self.total_reel_produits or 0) - float(self.total_reel_lignes or 0), 2)
     @property
     def total_engage(self):
-        return round(sum(float(l.engage or 0) for l in self.lignes if getattr(l, "nature", "charge") == "charge"), 2)
+        return round(float(self.engage_cache or 0), 2)
 
     @property
     def total_reste(self):
@@ -270,6 +274,10 @@ class LigneBudget(db.Model):
     montant_base = db.Column(db.Float, default=0.0)
     montant_reel = db.Column(db.Float, default=0.0)
 
+    # Engagé dénormalisé : dépenses non supprimées (triggers, voir app/budget/engagement.py)
+    engage_cache = db.Column(db.Float, nullable=False, default=0.0)
+    nb_depenses = db.Column(db.Integer, nullable=False, default=0)
+
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     depenses = db.relationship("Depense", backref="budget_source", cascade="all, delete-orphan")
@@ -279,8 +287,8 @@ class LigneBudget(db.Model):
         # engage / reste n'ont de sens que pour les CHARGES
         if getattr(self, "nature", "charge") != "charge":
             return 0.0
-        # BLINDAGE: on ne compte pas les dépenses soft-delete
-        return round(sum(float(d.montant or 0) for d in self.depenses if not d.est_supprimee), 2)
+        # BLINDAGE: les dépenses soft-delete ne sont pas comptées dans engage_cache
+        return round(float(self.engage_cache or 0), 2)
 
     @property
     def reste(self):
@@ -569,13 +577,161 @@ class PresenceActivite(db.Model):
     # signature: stockée en fichier (temp), ici juste le chemin
     signature_path = db.Column(db.String(255), nullable=True)
 
+    # Clé d'idempotence générée par la tablette (émargement hors-ligne rejoué)
+    client_key = db.Column(db.String(64), nullable=True)
+
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     __table_args__ = (
         db.UniqueConstraint("session_id", "participant_id", name="uq_presence_session_participant"),
+        db.Index("idx_uq_presence_client_key", "client_key", unique=True),
+    )
+
+
+class ParticipantSecteur(db.Model):
+    """Appartenance participant <-> secteur (présences agrégées), tenue à jour par triggers SQLite.
+
+    Voir app/participants/membership.py.
+    """
+    __tablename__ = "participant_secteur"
+    participant_id = db.Column(db.Integer, db.ForeignKey("participant.id"), primary_key=True)
+    secteur = db.Column(db.String(80), primary_key=True)
+    first_seen = db.Column(db.DateTime, nullable=True)
+    last_seen = db.Column(db.DateTime, nullable=True)
+    visits = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index("idx_participant_secteur_secteur", "secteur", "participant_id"),
     )
 
 
+class ParticipantImport(db.Model):
+    """Import de participants depuis un fichier CSV/XLSX (voir app/participants/importer.py).
+
+    `rows_done` sert de point de reprise : il est commité avec chaque lot de lignes.
+    """
+    __tablename__ = "participant_import"
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)
+    stored_path = db.Column(db.String(500), nullable=False)
+    created_secteur = db.Column(db.String(80), nullable=True)
+    created_by_user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=True)
+
+    statut = db.Column(db.String(20), nullable=False, default="analyse")  # analyse / pret / en_cours / termine / erreur
+    rows_total = db.Column(db.Integer, nullable=False, default=0)
+    rows_done = db.Column(db.Integer, nullable=False, default=0)
+    nb_crees = db.Column(db.Integer, nullable=False, default=0)
+    nb_completes = db.Column(db.Integer, nullable=False, default=0)
+    nb_inchanges = db.Column(db.Integer, nullable=False, default=0)
+    nb_erreurs = db.Column(db.Integer, nullable=False, default=0)
+    report_json = db.Column(db.Text, nullable=True)  # rapport d'analyse (simulation)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class RgpdSweep(db.Model):
+    """Journal des passes d'anonymisation RGPD (voir app/participants/retention.py).
+
+    `last_participant_id` est le point de reprise, commité avec chaque lot.
+    """
+    __tablename__ = "rgpd_sweep"
+    id = db.Column(db.Integer, primary_key=True)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    cutoff = db.Column(db.DateTime, nullable=False)
+    years = db.Column(db.Integer, nullable=False)
+    strict = db.Column(db.Boolean, nullable=False, default=False)
+    statut = db.Column(db.String(20), nullable=False, default="en_cours")  # en_cours / termine / interrompu
+    declenche_par = db.Column(db.String(80), nullable=True)  # cli / planifié / email utilisateur
+
+    last_participant_id = db.Column(db.Integer, nullable=False, default=0)
+    nb_anonymises = db.Column(db.Integer, nullable=False, default=0)
+    nb_signatures = db.Column(db.Integer, nullable=False, default=0)
+    nb_fichiers_absents = db.Column(db.Integer, nullable=False, default=0)
+    resume_json = db.Column(db.Text, nullable=True)  # répartition par secteur (audit)
+
+
+class DataVersion(db.Model):
+    """Compteurs de version par domaine ("activite", "finance"), incrémentés par triggers SQLite.
+
+    Clé d'invalidation des caches de calcul (voir app/services/data_version.py).
+    """
+    __tablename__ = "data_version"
+    name = db.Column(db.String(40), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class PortfolioSnapshot(db.Model):
+    """Portefeuille de projets précalculé (tâche nocturne), voir app/projets/portfolio.py."""
+    __tablename__ = "portfolio_snapshot"
+    id = db.Column(db.Integer, primary_key=True)
+    annee = db.Column(db.Integer, nullable=True, index=True)  # None = toutes périodes
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    versions_json = db.Column(db.Text, nullable=True)  # versions de données au moment du calcul
+    payload_json = db.Column(db.Text, nullable=False)
+
+
+class LedgerRollup(db.Model):
+    """Grand livre agrégé par (subvention, compte, nature, mois), voir app/budget/ledger.py.
+
+    mois = 0 porte les montants annuels des lignes (base, réel) et l'engagé des
+    dépenses sans date ; mois 1..12 : engagé des dépenses datées de ce mois.
+    Année d'exercice et secteur sont recopiés de la subvention.
+    """
+    __tablename__ = "ledger_rollup"
+    subvention_id = db.Column(db.Integer, primary_key=True)
+    compte = db.Column(db.String(20), primary_key=True)
+    nature = db.Column(db.String(10), primary_key=True)
+    mois = db.Column(db.Integer, primary_key=True)
+    annee_exercice = db.Column(db.Integer, nullable=False)
+    secteur = db.Column(db.String(80), nullable=True)
+    base = db.Column(db.Float, nullable=False, default=0.0)
+    reel = db.Column(db.Float, nullable=False, default=0.0)
+    engage = db.Column(db.Float, nullable=False, default=0.0)
+    nb_depenses = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index("idx_ledger_rollup_annee_secteur", "annee_exercice", "secteur"),
+    )
+
+
+class LedgerARecalculer(db.Model):
+    """Subventions dont le grand livre agrégé est à recalculer (alimentée par triggers SQLite)."""
+    __tablename__ = "ledger_a_recalculer"
+    subvention_id = db.Column(db.Integer, primary_key=True)
+
+
+class Alerte(db.Model):
+    """Alerte de gestion active (une par règle et par cible), voir app/services/alertes.py.
+
+    Une alerte résolue est supprimée ; `created_at` date sa première détection.
+    """
+    __tablename__ = "alerte"
+    id = db.Column(db.Integer, primary_key=True)
+    regle = db.Column(db.String(40), nullable=False)
+    cible_type = db.Column(db.String(20), nullable=False)  # subvention / facture
+    cible_id = db.Column(db.Integer, nullable=False)
+    secteur = db.Column(db.String(80), nullable=True, index=True)
+    annee = db.Column(db.Integer, nullable=True, index=True)
+    niveau = db.Column(db.String(10), nullable=False)  # danger / warning / info
+    message = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint("regle", "cible_type", "cible_id", name="uq_alerte_regle_cible"),
+        db.Index("idx_alerte_cible", "cible_type", "cible_id"),
+    )
+
+
+class AlerteAEvaluer(db.Model):
+    """File des cibles à réévaluer, alimentée par triggers SQLite (voir app/services/alertes.py)."""
+    __tablename__ = "alerte_a_evaluer"
+    cible_type = db.Column(db.String(20), primary_key=True)
+    cible_id = db.Column(db.Integer, primary_key=True)
+
+
 class Evaluation(db.Model):
     __tablename__ = "evaluation"
     id = db.Column(db.Integer, primary_key=True)
@@ -0,0 +1,288 @@
+"""Détection et fusion des doublons de participants.
+
+Détection par "blocs" : chaque participant reçoit quelques clés de blocage
+(nom normalisé + année de naissance, nom + prénom normalisés, clé phonétique,
+email, téléphone). Les paires ne sont comparées qu'à l'intérieur d'un même bloc :
+le coût reste quasi linéaire (20 000 fiches -> quelques dizaines de milliers de
+comparaisons au lieu de 200 millions).
+
+Fusion : `merge_participants(keep_id, drop_id)` repointe présences et évaluations
+en UPDATE/DELETE ensemblistes, en respectant les contraintes uniques
+(session, participant) et (participant, compétence, session).
+"""
+from __future__ import annotations
+
+import re
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+from itertools import combinations
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, exists, select, update
+from sqlalchemy.orm import aliased
+
+from app.extensions import db
+from app.models import Evaluation, Participant, PresenceActivite
+
+
+MIN_SCORE = 70
+MAX_BLOCK_SIZE = 60  # bloc plus gros = clé non discriminante (ex: téléphone de la structure)
+
+_NON_ALPHA = re.compile(r"[^A-Z ]+")
+_SPACES = re.compile(r"\s+")
+_DIGITS = re.compile(r"\D+")
+
+# Règles phonétiques (français simplifié), appliquées dans l'ordre
+_PHONETIC_RULES = [
+    (re.compile(r"PH"), "F"),
+    (re.compile(r"QU|Q"), "K"),
+    (re.compile(r"GU(?=[EI])"), "G"),
+    (re.compile(r"G(?=[EIY])"), "J"),
+    (re.compile(r"C(?=[EIY])"), "S"),
+    (re.compile(r"CH|SCH|SH"), "S"),
+    (re.compile(r"CK|C"), "K"),
+    (re.compile(r"EAU|AU|O"), "O"),
+    (re.compile(r"AI|EI|ET$|ER$|EZ$"), "E"),
+    (re.compile(r"Y"), "I"),
+    (re.compile(r"Z"), "S"),
+    (re.compile(r"W"), "V"),
+    (re.compile(r"TH"), "T"),
+    (re.compile(r"H"), ""),
+]
+
+
+def normalize_name(value: Optional[str]) -> str:
+    """'  Dupont-Lefèvre ' -> 'DUPONT LEFEVRE' (sans accents, ponctuation en espaces)."""
+    if not value:
+        return ""
+    s = unicodedata.normalize("NFKD", value)
+    s = "".join(ch for ch in s if not unicodedata.combining(ch)).upper()
+    s = _NON_ALPHA.sub(" ", s)
+    return _SPACES.sub(" ", s).strip()
+
+
+def phonetic_key(value: Optional[str]) -> str:
+    """Clé phonétique grossière : 'Dupond' / 'Dupont' -> 'DPN', 'Philippe' / 'Filipe' -> 'FLP'."""
+    s = normalize_name(value).replace(" ", "")
+    if not s:
+        return ""
+    for rx, repl in _PHONETIC_RULES:
+        s = rx.sub(repl, s)
+    s = re.sub(r"(.)\1+", r"\1", s)       # lettres doublées
+    s = re.sub(r"[TDSX]$", "", s) or s    # finales muettes
+    if not s:
+        return ""
+    first, rest = s[0], re.sub(r"[AEIOU]", "", s[1:])
+    return (first + rest)[:6]
+
+
+def phone_digits(value: Optional[str]) -> str:
+    """9 derniers chiffres ('+33 6 12…' et '06 12…' donnent la même clé)."""
+    d = _DIGITS.sub("", value or "")
+    return d[-9:] if len(d) >= 9 else ""
+
+
+def _email_key(value: Optional[str]) -> str:
+    e = (value or "").strip().lower()
+    return e if "@" in e else ""
+
+
+@dataclass
+class _Row:
+    id: int
+    nom: str
+    prenom: str
+    date_naissance: object
+    email: str
+    tel: str
+    ville: str
+
+    @property
+    def full(self) -> str:
+        return f"{self.nom} {self.prenom}".strip()
+
+
+@dataclass
+class DuplicatePair:
+    a_id: int
+    b_id: int
+    score: int
+    reasons: List[str] = field(default_factory=list)
+
+
+def blocking_keys(r: _Row) -> List[str]:
+    keys = []
+    year = getattr(r.date_naissance, "year", None)
+    if r.nom and year:
+        keys.append(f"ny:{r.nom}|{year}")
+    if r.nom and r.prenom:
+        keys.append(f"nn:{r.nom}|{r.prenom}")
+        ph = f"{phonetic_key(r.nom)}|{phonetic_key(r.prenom)}"
+        if len(ph) > 2:
+            keys.append(f"ph:{ph}")
+    if r.email:
+        keys.append(f"em:{r.email}")
+    if r.tel:
+        keys.append(f"tel:{r.tel}")
+    return keys
+
+
+def score_pair(a: _Row, b: _Row) -> Tuple[int, List[str]]:
+    """Score 0..100 d'une paire candidate, avec les raisons lisibles."""
+    reasons: List[str] = []
+    name_ratio = SequenceMatcher(None, a.full, b.full).ratio()
+    swapped = SequenceMatcher(None, a.full, f"{b.prenom} {b.nom}".strip()).ratio()
+    name_ratio = max(name_ratio, swapped)
+    score = name_ratio * 60
+    if a.full == b.full:
+        score += 15
+        reasons.append("même nom/prénom")
+    else:
+        if name_ratio >= 0.85:
+            reasons.append(f"noms proches ({int(name_ratio * 100)}%)")
+        if phonetic_key(a.nom) == phonetic_key(b.nom) and phonetic_key(a.prenom) == phonetic_key(b.prenom):
+            score += 15
+            reasons.append("même prononciation")
+
+    if a.date_naissance and b.date_naissance:
+        if a.date_naissance == b.date_naissance:
+            score += 30
+            reasons.append("même date de naissance")
+        elif getattr(a.date_naissance, "year", 0) == getattr(b.date_naissance, "year", 1):
+            score += 5
+        else:
+            score -= 40  # deux dates différentes : très probablement deux personnes
+    if a.email and a.email == b.email:
+        score += 25
+        reasons.append("même email")
+    if a.tel and a.tel == b.tel:
+        score += 20
+        reasons.append("même téléphone")
+    if a.ville and a.ville == b.ville:
+        score += 5
+    return max(0, min(100, int(round(score)))), reasons
+
+
+def _load_rows(ids: Optional[Iterable[int]] = None) -> List[_Row]:
+    q = db.session.query(
+        Participant.id, Participant.nom, Participant.prenom, Participant.date_naissance,
+        Participant.email, Participant.telephone, Participant.ville,
+    ).filter(Participant.nom != "ANONYME")
+    if ids is not None:
+        q = q.filter(Participant.id.in_(list(ids)))
+    return [
+        _Row(
+            id=pid,
+            nom=normalize_name(nom),
+            prenom=normalize_name(prenom),
+            date_naissance=dn,
+            email=_email_key(email),
+            tel=phone_digits(tel),
+            ville=normalize_name(ville),
+        )
+        for pid, nom, prenom, dn, email, tel, ville in q.all()
+    ]
+
+
+def find_duplicates(min_score: int = MIN_SCORE, limit: Optional[int] = None) -> List[DuplicatePair]:
+    """Paires de doublons probables, triées par score décroissant."""
+    rows = _load_rows()
+    by_id = {r.id: r for r in rows}
+    blocks: Dict[str, List[int]] = defaultdict(list)
+    for r in rows:
+        for k in blocking_keys(r):
+            blocks[k].append(r.id)
+
+    seen = set()
+    pairs: List[DuplicatePair] = []
+    for ids in blocks.values():
+        if len(ids) < 2 or len(ids) > MAX_BLOCK_SIZE:
+            continue
+        for a_id, b_id in combinations(sorted(ids), 2):
+            if (a_id, b_id) in seen:
+                continue
+            seen.add((a_id, b_id))
+            score, reasons = score_pair(by_id[a_id], by_id[b_id])
+            if score >= min_score:
+                pairs.append(DuplicatePair(a_id, b_id, score, reasons))
+
+    pairs.sort(key=lambda p: (-p.score, p.a_id, p.b_id))
+    return pairs[:limit] if limit else pairs
+
+
+_FILL_FIELDS = ("adresse", "ville", "email", "telephone", "genre", "date_naissance", "quartier_id", "created_secteur")
+
+
+def merge_participants(keep_id: int, drop_id: int) -> Dict[str, int]:
+    """Fusionne `drop_id` dans `keep_id` (une transaction, ne commite pas).
+
+    - présences : repointées ; si les deux fiches sont présentes sur la même session,
+      la présence conservée récupère motif/signature manquants, l'autre est supprimée ;
+    - évaluations : idem, l'évaluation de la fiche conservée l'emporte ;
+    - champs vides de la fiche conservée complétés depuis l'autre ; puis suppression.
+    """
+    if keep_id == drop_id:
+        raise ValueError("Impossible de fusionner une fiche avec elle-même.")
+    keep = db.session.get(Participant, keep_id)
+    drop = db.session.get(Participant, drop_id)
+    if not keep or not drop:
+        raise LookupError("Participant introuvable.")
+
+    P = PresenceActivite
+    D = aliased(PresenceActivite)
+    same_session = and_(D.session_id == P.session_id, D.participant_id == drop_id)
+
+    # 1) présences en conflit : compléter la présence conservée
+    for col in ("motif", "motif_autre", "signature_path"):
+        db.session.execute(
+            update(P)
+            .where(P.participant_id == keep_id, getattr(P, col).is_(None), exists().where(same_session))
+            .values({col: select(getattr(D, col)).where(same_session).scalar_subquery()})
+            .execution_options(synchronize_session=False)
+        )
+    keep_sessions = select(P.session_id).where(P.participant_id == keep_id).scalar_subquery()
+    moved_presences = db.session.execute(
+        update(P)
+        .where(P.participant_id == drop_id, P.session_id.not_in(keep_sessions))
+        .values(participant_id=keep_id)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    dropped_presences = db.session.execute(
+        delete(P).where(P.participant_id == drop_id).execution_options(synchronize_session=False)
+    ).rowcount
+
+    # 2) évaluations : même compétence + même session déjà évaluée -> on garde celle de keep
+    E = Evaluation
+    K = aliased(Evaluation)
+    clash = exists().where(
+        K.participant_id == keep_id,
+        K.competence_id == E.competence_id,
+        # session_id peut être NULL (évaluation hors session)
+        db.or_(K.session_id == E.session_id, and_(K.session_id.is_(None), E.session_id.is_(None))),
+    )
+    moved_evals = db.session.execute(
+        update(E)
+        .where(E.participant_id == drop_id, ~clash)
+        .values(participant_id=keep_id)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    dropped_evals = db.session.execute(
+        delete(E).where(E.participant_id == drop_id).execution_options(synchronize_session=False)
+    ).rowcount
+
+    # 3) fiche conservée complétée, puis suppression du doublon
+    for f in _FILL_FIELDS:
+        if getattr(keep, f) in (None, "") and getattr(drop, f) not in (None, ""):
+            setattr(keep, f, getattr(drop, f))
+    db.session.delete(drop)
+    db.session.flush()
+    db.session.expire_all()
+
+    return {
+        "presences_repointees": moved_presences or 0,
+        "presences_fusionnees": dropped_presences or 0,
+        "evaluations_repointees": moved_evals or 0,
+        "evaluations_fusionnees": dropped_evals or 0,
+    }
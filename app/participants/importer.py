@@ -0,0 +1,477 @@
+"""Import en masse de participants depuis un fichier CSV ou XLSX.
+
+Pipeline (une passe, en flux) :
+- lecture ligne à ligne : csv (séparateur détecté, UTF-8 ou Windows-1252) ou
+  openpyxl en read_only (le classeur n'est jamais chargé entier en mémoire) ;
+- normalisation : nom en majuscules, prénom capitalisé, dates (jj/mm/aaaa,
+  aaaa-mm-jj, cellule Excel), ville, quartier de Creil -> `Quartier` ;
+- rapprochement avec les fiches existantes via l'index des noms normalisés
+  (`normalize_name` / `score_pair` de dedup.py) : même nom + prénom, départagé
+  par date de naissance, email, téléphone ;
+- écriture par lots : `bulk_insert_mappings` pour les nouvelles fiches,
+  `bulk_update_mappings` pour compléter les champs vides des fiches retrouvées
+  (jamais d'écrasement).
+
+Simulation (dry_run) : même traitement sans écriture, rapport des créations,
+compléments et erreurs. Reprise : `rows_done` est commité avec chaque lot ; une
+exécution interrompue reprend au lot suivant. Rejouer un lot déjà écrit est sans
+effet (les lignes sont alors rapprochées des fiches créées).
+"""
+from __future__ import annotations
+
+import csv
+import json
+import os
+import re
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.extensions import db
+from app.models import Participant, ParticipantImport, Quartier
+from app.participants.dedup import MIN_SCORE, _Row, normalize_name, phone_digits, score_pair
+from app.services.db_write import run_write
+
+
+CHUNK_SIZE = 500
+MAX_REPORT_ISSUES = 200
+ALLOWED_EXTENSIONS = {"csv", "xlsx"}
+
+# en-tête normalisé -> champ
+_HEADER_ALIASES = {
+    "NOM": "nom", "NOM DE FAMILLE": "nom", "NOM DE NAISSANCE": "nom",
+    "PRENOM": "prenom", "PRENOMS": "prenom",
+    "DATE DE NAISSANCE": "date_naissance", "DATE NAISSANCE": "date_naissance",
+    "NE LE": "date_naissance", "NE E LE": "date_naissance", "DDN": "date_naissance", "NAISSANCE": "date_naissance",
+    "EMAIL": "email", "E MAIL": "email", "MAIL": "email", "COURRIEL": "email",
+    "TELEPHONE": "telephone", "TEL": "telephone", "PORTABLE": "telephone", "MOBILE": "telephone",
+    "ADRESSE": "adresse",
+    "VILLE": "ville", "COMMUNE": "ville",
+    "QUARTIER": "quartier",
+    "GENRE": "genre", "SEXE": "genre",
+    "TYPE PUBLIC": "type_public", "TYPE DE PUBLIC": "type_public", "PUBLIC": "type_public",
+}
+
+_GENRES = {"H": "Homme", "HOMME": "Homme", "M": "Homme", "MASCULIN": "Homme",
+           "F": "Femme", "FEMME": "Femme", "FEMININ": "Femme", "AUTRE": "Autre"}
+_TYPES_PUBLIC = {"H", "S", "B", "A", "P"}
+_DATE_FORMATS = ("%d/%m/%Y", "%d/%m/%y", "%Y-%m-%d", "%d-%m-%Y", "%d.%m.%Y", "%Y/%m/%d")
+
+# champs complétés sur une fiche existante (si vides), comme pour la fusion de doublons
+_FILL_FIELDS = ("adresse", "ville", "email", "telephone", "genre", "date_naissance", "quartier_id")
+
+_SPACES = re.compile(r"\s+")
+
+
+class ImportFileError(ValueError):
+    """Fichier illisible ou sans colonnes nom/prénom."""
+
+
+# ---------------------------------------------------------------------------
+# Lecture
+# ---------------------------------------------------------------------------
+
+def _header_fields(header: List[Any]) -> List[Optional[str]]:
+    fields = [_HEADER_ALIASES.get(normalize_name(str(h or ""))) for h in header]
+    if "nom" not in fields or "prenom" not in fields:
+        raise ImportFileError("Colonnes « Nom » et « Prénom » introuvables dans la première ligne.")
+    return fields
+
+
+class _ExcelFr(csv.excel):
+    delimiter = ";"  # export Excel français par défaut
+
+
+def _read_csv(path: str) -> Iterator[List[Any]]:
+    with open(path, "rb") as fh:
+        head = fh.read(64 * 1024)
+    encoding = "utf-8-sig"
+    try:
+        head.decode(encoding)
+    except UnicodeDecodeError:
+        encoding = "cp1252"
+    sample = head.decode(encoding, errors="ignore")
+    try:
+        dialect = csv.Sniffer().sniff(sample.split("\n", 1)[0], delimiters=";,\t")
+    except csv.Error:
+        dialect = _ExcelFr
+    with open(path, newline="", encoding=encoding, errors="replace") as fh:
+        yield from csv.reader(fh, dialect)
+
+
+def _read_xlsx(path: str) -> Iterator[List[Any]]:
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for row in wb.active.iter_rows(values_only=True):
+            yield list(row)
+    finally:
+        wb.close()
+
+
+def iter_rows(path: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """(numéro de ligne du fichier, {champ: valeur brute}) ; lignes vides ignorées."""
+    ext = path.rsplit(".", 1)[-1].lower()
+    reader = _read_xlsx(path) if ext == "xlsx" else _read_csv(path)
+    fields = None
+    for line_no, row in enumerate(reader, start=1):
+        if not any(v not in (None, "") and str(v).strip() for v in row):
+            continue
+        if fields is None:
+            fields = _header_fields(row)
+            continue
+        yield line_no, {f: v for f, v in zip(fields, row) if f}
+    if fields is None:
+        raise ImportFileError("Fichier vide.")
+
+
+# ---------------------------------------------------------------------------
+# Normalisation
+# ---------------------------------------------------------------------------
+
+def _clean(v: Any) -> str:
+    if v is None:
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)
+    return _SPACES.sub(" ", str(v)).strip()
+
+
+def _title(v: str) -> str:
+    # "jean-pierre DE la tour" -> "Jean-Pierre De La Tour"
+    return "-".join(" ".join(w.capitalize() for w in part.split(" ")) for part in v.split("-"))
+
+
+def parse_date(v: Any) -> Optional[date]:
+    if isinstance(v, datetime):
+        d = v.date()
+    elif isinstance(v, date):
+        d = v
+    else:
+        s = _clean(v)
+        if not s:
+            return None
+        d = None
+        for fmt in _DATE_FORMATS:
+            try:
+                d = datetime.strptime(s[:10], fmt).date()
+                break
+            except ValueError:
+                continue
+        if d is None:
+            raise ValueError(f"date de naissance illisible « {s} »")
+    if d.year < 1900 or d > date.today():
+        raise ValueError(f"date de naissance invraisemblable ({d:%d/%m/%Y})")
+    return d
+
+
+@dataclass
+class RowResult:
+    line: int
+    values: Dict[str, Any] = field(default_factory=dict)
+    warnings: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+
+
+def normalize_row(line: int, raw: Dict[str, Any], quartiers: Dict[str, int]) -> RowResult:
+    res = RowResult(line=line)
+    nom = _clean(raw.get("nom")).upper()
+    prenom = _title(_clean(raw.get("prenom")).lower())
+    if not nom or not prenom:
+        res.error = "nom ou prénom manquant"
+        return res
+
+    try:
+        dn = parse_date(raw.get("date_naissance"))
+    except ValueError as exc:
+        dn = None
+        res.warnings.append(str(exc))
+
+    ville = _title(_clean(raw.get("ville")).lower()) or None
+    quartier_id = None
+    q = normalize_name(_clean(raw.get("quartier")))
+    if q:
+        if (ville or "").lower() == "creil":
+            quartier_id = quartiers.get(q)
+            if quartier_id is None:
+                res.warnings.append(f"quartier inconnu « {_clean(raw.get('quartier'))} »")
+        else:
+            res.warnings.append("quartier ignoré (ville différente de Creil)")
+
+    email = _clean(raw.get("email")).lower() or None
+    if email and "@" not in email:
+        res.warnings.append(f"email invalide « {email} »")
+        email = None
+
+    genre_raw = normalize_name(_clean(raw.get("genre")))
+    genre = _GENRES.get(genre_raw) if genre_raw else None
+    if genre_raw and not genre:
+        res.warnings.append(f"genre inconnu « {_clean(raw.get('genre'))} »")
+
+    type_public = _clean(raw.get("type_public")).upper()[:1] or "H"
+    if type_public not in _TYPES_PUBLIC:
+        type_public = "H"
+
+    res.values = {
+        "nom": nom[:120],
+        "prenom": prenom[:120],
+        "date_naissance": dn,
+        "email": email[:180] if email else None,
+        "telephone": _clean(raw.get("telephone"))[:60] or None,
+        "adresse": _clean(raw.get("adresse"))[:255] or None,
+        "ville": ville[:120] if ville else None,
+        "quartier_id": quartier_id,
+        "genre": genre,
+        "type_public": type_public,
+    }
+    return res
+
+
+# ---------------------------------------------------------------------------
+# Rapprochement
+# ---------------------------------------------------------------------------
+
+def _score_row(values: Dict[str, Any], pid: int = 0) -> _Row:
+    return _Row(
+        id=pid,
+        nom=normalize_name(values.get("nom")),
+        prenom=normalize_name(values.get("prenom")),
+        date_naissance=values.get("date_naissance"),
+        email=(values.get("email") or "").strip().lower(),
+        tel=phone_digits(values.get("telephone")),
+        ville=normalize_name(values.get("ville")),
+    )
+
+
+class NameIndex:
+    """Fiches existantes indexées par "NOM|PRENOM" normalisés (une requête au départ)."""
+
+    def __init__(self):
+        self._by_name: Dict[str, List[Tuple[_Row, Dict[str, Any]]]] = defaultdict(list)
+        cols = [Participant.id, Participant.nom, Participant.prenom] + [getattr(Participant, f) for f in _FILL_FIELDS]
+        for row in db.session.query(*cols).filter(Participant.nom != "ANONYME"):
+            values = dict(zip(["id", "nom", "prenom", *_FILL_FIELDS], row))
+            self.add(values["id"], values)
+
+    @staticmethod
+    def key(values: Dict[str, Any]) -> str:
+        return f"{normalize_name(values.get('nom'))}|{normalize_name(values.get('prenom'))}"
+
+    def add(self, pid: int, values: Dict[str, Any]) -> None:
+        self._by_name[self.key(values)].append((_score_row(values, pid), values))
+
+    def match(self, values: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """(fiche retrouvée ou None, ambigu ?)."""
+        candidates = self._by_name.get(self.key(values))
+        if not candidates:
+            return None, False
+        me = _score_row(values)
+        scored = sorted(
+            ((score_pair(me, row)[0], existing) for row, existing in candidates),
+            key=lambda t: -t[0],
+        )
+        best_score, best = scored[0]
+        if best_score < MIN_SCORE:
+            return None, False  # homonyme, autre personne (ex: date de naissance différente)
+        if len(scored) > 1 and scored[1][0] == best_score:
+            return None, True
+        return best, False
+
+
+def _fill(existing: Dict[str, Any], values: Dict[str, Any]) -> Dict[str, Any]:
+    """Champs vides de la fiche existante que la ligne peut compléter."""
+    return {
+        f: values[f]
+        for f in _FILL_FIELDS
+        if existing.get(f) in (None, "") and values.get(f) not in (None, "")
+    }
+
+
+# ---------------------------------------------------------------------------
+# Exécution
+# ---------------------------------------------------------------------------
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    a_creer: int = 0
+    a_completer: int = 0
+    inchanges: int = 0
+    erreurs: int = 0
+    avertissements: int = 0
+    issues: List[Dict[str, Any]] = field(default_factory=list)
+
+    def issue(self, line: int, level: str, message: str) -> None:
+        if len(self.issues) < MAX_REPORT_ISSUES:
+            self.issues.append({"ligne": line, "niveau": level, "message": message})
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "rows": self.rows,
+            "a_creer": self.a_creer,
+            "a_completer": self.a_completer,
+            "inchanges": self.inchanges,
+            "erreurs": self.erreurs,
+            "avertissements": self.avertissements,
+            "issues": self.issues,
+        }
+
+
+def _quartiers_creil() -> Dict[str, int]:
+    return {normalize_name(nom): qid for qid, nom in db.session.query(Quartier.id, Quartier.nom).filter(Quartier.ville == "Creil")}
+
+
+def _chunks(rows: Iterator[Tuple[int, Dict[str, Any]]], size: int) -> Iterator[List[Tuple[int, Dict[str, Any]]]]:
+    chunk = []
+    for item in rows:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_import(job: ParticipantImport, dry_run: bool = True, chunk_size: int = CHUNK_SIZE,
+               created_by_user_id: Optional[int] = None) -> ImportReport:
+    """Analyse (dry_run) ou exécute l'import `job`, en reprenant à `job.rows_done`.
+
+    En exécution, chaque lot est commité avec le point de reprise et les compteurs
+    du job. Lève ImportFileError si le fichier est illisible.
+    """
+    report = ImportReport()
+    index = NameIndex()
+    quartiers = _quartiers_creil()
+    start = 0 if dry_run else (job.rows_done or 0)
+    now = datetime.utcnow()
+
+    if not dry_run:
+        job.statut = "en_cours"
+        db.session.commit()
+
+    n = 0
+    for chunk in _chunks(iter_rows(job.stored_path), chunk_size):
+        if n + len(chunk) <= start:
+            n += len(chunk)
+            continue
+        inserts: List[Dict[str, Any]] = []
+        updates: List[Dict[str, Any]] = []
+        errors = unchanged = 0
+        for line, raw in chunk:
+            n += 1
+            if n <= start:
+                continue
+            report.rows += 1
+            res = normalize_row(line, raw, quartiers)
+            if res.error:
+                errors += 1
+                report.issue(line, "erreur", res.error)
+                continue
+            for w in res.warnings:
+                report.avertissements += 1
+                report.issue(line, "avertissement", w)
+
+            existing, ambiguous = index.match(res.values)
+            if ambiguous:
+                errors += 1
+                report.issue(line, "erreur", f"{res.values['nom']} {res.values['prenom']} : plusieurs fiches possibles, à traiter à la main")
+                continue
+            if existing is None:
+                values = dict(res.values)
+                values.update(
+                    created_secteur=job.created_secteur,
+                    created_by_user_id=created_by_user_id,
+                    created_at=now,
+                    updated_at=now,
+                )
+                inserts.append(values)
+                # les lignes suivantes du fichier se rapprochent de cette nouvelle fiche
+                index.add(0, values)
+                continue
+            patch = _fill(existing, res.values)
+            if patch:
+                existing.update(patch)
+                if existing.get("id"):
+                    updates.append({"id": existing["id"], "updated_at": now, **patch})
+                report.a_completer += 1
+            else:
+                unchanged += 1
+
+        report.a_creer += len(inserts)
+        report.erreurs += errors
+        report.inchanges += unchanged
+        if dry_run:
+            continue
+
+        def _write(inserts=inserts, updates=updates, errors=errors, unchanged=unchanged, done=n):
+            rows = [dict(v) for v in inserts]
+            if rows:
+                db.session.bulk_insert_mappings(Participant, rows, return_defaults=True)
+            if updates:
+                db.session.bulk_update_mappings(Participant, updates)
+            job.rows_done = done
+            job.nb_crees = (job.nb_crees or 0) + len(rows)
+            job.nb_completes = (job.nb_completes or 0) + len(updates)
+            job.nb_inchanges = (job.nb_inchanges or 0) + unchanged
+            job.nb_erreurs = (job.nb_erreurs or 0) + errors
+            return rows
+
+        written = run_write(_write)
+        # ids réels des fiches créées : une ligne plus loin pourra les compléter
+        for values, row in zip(inserts, written):
+            values["id"] = row.get("id")
+
+    if dry_run:
+        job.rows_total = report.rows
+        job.statut = "pret" if job.statut == "analyse" else job.statut
+        job.report_json = json.dumps(report.as_dict(), ensure_ascii=False, default=str)
+    else:
+        job.statut = "termine"
+        job.rows_total = max(job.rows_total or 0, n)
+    db.session.commit()
+    return report
+
+
+_running_lock = threading.Lock()
+_running: set = set()
+
+
+@contextmanager
+def exclusive_job(job_id: int) -> Iterator[bool]:
+    """Un seul traitement à la fois par job dans ce processus (double clic sur "Importer")."""
+    with _running_lock:
+        acquired = job_id not in _running
+        if acquired:
+            _running.add(job_id)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with _running_lock:
+                _running.discard(job_id)
+
+
+def store_upload(file_storage, folder: str) -> Tuple[str, str]:
+    """Enregistre le fichier envoyé ; renvoie (nom d'origine, chemin stocké)."""
+    from werkzeug.utils import secure_filename
+
+    original = file_storage.filename or ""
+    ext = original.rsplit(".", 1)[-1].lower() if "." in original else ""
+    if ext not in ALLOWED_EXTENSIONS:
+        raise ImportFileError("Format non pris en charge (CSV ou XLSX).")
+    os.makedirs(folder, exist_ok=True)
+    stamp = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+    path = os.path.join(folder, f"{stamp}_{secure_filename(original) or 'import.' + ext}")
+    file_storage.save(path)
+    return original, path
+
+
+def load_report(job: ParticipantImport) -> Dict[str, Any]:
+    try:
+        return json.loads(job.report_json or "{}")
+    except ValueError:
+        return {}
@@ -0,0 +1,119 @@
+"""Table `participant_secteur` : qui est venu dans quel secteur.
+
+(participant_id, secteur, first_seen, last_seen, visits), agrégée depuis
+presence_activite ⨝ session_activite. Elle remplace les sous-requêtes
+"id IN (SELECT participant_id FROM presence JOIN session WHERE secteur = ...)"
+par une recherche indexée.
+
+Tenue à jour par des triggers SQLite (même principe que l'index FTS) : toute
+écriture de présence, y compris hors ORM (fusion de doublons, imports, DELETE en
+masse), met la table à jour dans la même transaction.
+"""
+from __future__ import annotations
+
+from sqlalchemy import text
+
+from app.extensions import db
+from app.models import ParticipantSecteur
+
+
+# Recalcule les lignes (participant, secteur) ciblées depuis les présences.
+# {where} filtre presence_activite p / session_activite s.
+_RECOMPUTE = (
+    "DELETE FROM participant_secteur WHERE {target};"
+    " INSERT INTO participant_secteur(participant_id, secteur, first_seen, last_seen, visits)"
+    " SELECT p.participant_id, s.secteur, MIN(p.created_at), MAX(p.created_at), COUNT(p.id)"
+    " FROM presence_activite p JOIN session_activite s ON s.id = p.session_id"
+    " WHERE {where} GROUP BY p.participant_id, s.secteur;"
+)
+
+
+def _recompute(participant_expr: str, secteur_expr: str) -> str:
+    target = f"participant_id = {participant_expr} AND secteur = {secteur_expr}"
+    where = f"p.participant_id = {participant_expr} AND s.secteur = {secteur_expr}"
+    return _RECOMPUTE.format(target=target, where=where)
+
+
+_OLD_SECTEUR = "(SELECT secteur FROM session_activite WHERE id = old.session_id)"
+_NEW_SECTEUR = "(SELECT secteur FROM session_activite WHERE id = new.session_id)"
+
+_TRIGGERS = [
+    # insertion : upsert incrémental (cas courant, O(1))
+    "CREATE TRIGGER IF NOT EXISTS participant_secteur_ai AFTER INSERT ON presence_activite BEGIN"
+    " INSERT INTO participant_secteur(participant_id, secteur, first_seen, last_seen, visits)"
+    " SELECT new.participant_id, s.secteur, new.created_at, new.created_at, 1"
+    " FROM session_activite s WHERE s.id = new.session_id AND s.secteur IS NOT NULL"
+    " ON CONFLICT(participant_id, secteur) DO UPDATE SET"
+    " visits = visits + 1,"
+    " first_seen = COALESCE(MIN(first_seen, excluded.first_seen), first_seen, excluded.first_seen),"
+    " last_seen = COALESCE(MAX(last_seen, excluded.last_seen), last_seen, excluded.last_seen);"
+    " END",
+    # suppression : recalcul exact de la ligne concernée
+    "CREATE TRIGGER IF NOT EXISTS participant_secteur_ad AFTER DELETE ON presence_activite BEGIN "
+    + _recompute("old.participant_id", _OLD_SECTEUR)
+    + " END",
+    # présence repointée (fusion) ou déplacée de session
+    "CREATE TRIGGER IF NOT EXISTS participant_secteur_au AFTER UPDATE OF participant_id, session_id, created_at"
+    " ON presence_activite BEGIN "
+    + _recompute("old.participant_id", _OLD_SECTEUR)
+    + " "
+    + _recompute("new.participant_id", _NEW_SECTEUR)
+    + " END",
+    # session changée de secteur : recalcul de ses participants dans les deux secteurs
+    "CREATE TRIGGER IF NOT EXISTS participant_secteur_su AFTER UPDATE OF secteur ON session_activite"
+    " WHEN old.secteur IS NOT new.secteur BEGIN "
+    + _RECOMPUTE.format(
+        target="secteur IN (old.secteur, new.secteur)"
+        " AND participant_id IN (SELECT participant_id FROM presence_activite WHERE session_id = new.id)",
+        where="s.secteur IN (old.secteur, new.secteur)"
+        " AND p.participant_id IN (SELECT participant_id FROM presence_activite WHERE session_id = new.id)",
+    )
+    + " END",
+]
+
+
+def rebuild_participant_secteur() -> int:
+    """Reconstruit toute la table depuis les présences. Retourne le nombre de lignes."""
+    db.session.execute(text("DELETE FROM participant_secteur"))
+    db.session.execute(text(
+        "INSERT INTO participant_secteur(participant_id, secteur, first_seen, last_seen, visits)"
+        " SELECT p.participant_id, s.secteur, MIN(p.created_at), MAX(p.created_at), COUNT(p.id)"
+        " FROM presence_activite p JOIN session_activite s ON s.id = p.session_id"
+        " WHERE s.secteur IS NOT NULL"
+        " GROUP BY p.participant_id, s.secteur"
+    ))
+    db.session.commit()
+    return db.session.query(db.func.count()).select_from(ParticipantSecteur).scalar() or 0
+
+
+def ensure_participant_secteur() -> None:
+    """Pose les triggers (à appeler après create_all) ; remplit la table au premier passage."""
+    try:
+        existing = {
+            row[0]
+            for row in db.session.execute(
+                text("SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE 'participant_secteur_%'")
+            ).all()
+        }
+        for sql in _TRIGGERS:
+            db.session.execute(text(sql))
+        db.session.commit()
+        if not existing:
+            rebuild_participant_secteur()
+    except Exception:
+        db.session.rollback()
+
+
+def secteur_participant_ids(secteur: str):
+    """Sous-requête des participants venus au moins une fois dans `secteur` (indexée)."""
+    return db.session.query(ParticipantSecteur.participant_id).filter(ParticipantSecteur.secteur == secteur)
+
+
+def has_visited(participant_id: int, secteur: str) -> bool:
+    # requête (pas session.get) : la ligne est écrite par trigger, hors identity map
+    return (
+        db.session.query(ParticipantSecteur.participant_id)
+        .filter(ParticipantSecteur.participant_id == participant_id, ParticipantSecteur.secteur == secteur)
+        .first()
+        is not None
+    )
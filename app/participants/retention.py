@@ -0,0 +1,223 @@
+"""Conservation RGPD : anonymisation des participants inactifs depuis N années.
+
+Inactif = aucune venue (participant_secteur.last_seen) depuis la date limite, et
+fiche ni créée ni modifiée depuis. Les fiches déjà anonymisées sont ignorées.
+
+La passe traite les participants par lots d'ids croissants ; chaque lot est une
+transaction courte (UPDATE ensemblistes : identité effacée, chemins de signature
+vidés) commitée avec le point de reprise `RgpdSweep.last_participant_id`. Les
+fichiers de signature sont supprimés APRÈS le commit (un rollback ne laisse pas de
+présence pointant vers un fichier effacé), puis une pause laisse passer les
+écritures du kiosque.
+
+Lancement : `flask rgpd sweep` (voir app/cli.py), à planifier (cron / planificateur
+de tâches Windows) ; `--dry-run` donne le décompte sans rien modifier.
+"""
+from __future__ import annotations
+
+import json
+import os
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import exists, or_, update
+
+from app.extensions import db
+from app.models import Participant, ParticipantSecteur, PresenceActivite, RgpdSweep
+from app.services.db_write import WriteBusyError, run_write
+
+
+ANONYME = "ANONYME"
+
+
+def retention_cutoff(years: int, now: Optional[datetime] = None) -> datetime:
+    now = now or datetime.utcnow()
+    try:
+        return now.replace(year=now.year - years)
+    except ValueError:  # 29 février
+        return now.replace(year=now.year - years, day=28)
+
+
+def _eligible(cutoff: datetime):
+    recent = exists().where(
+        ParticipantSecteur.participant_id == Participant.id,
+        ParticipantSecteur.last_seen >= cutoff,
+    )
+    touched = db.func.coalesce(Participant.updated_at, Participant.created_at)
+    return db.session.query(Participant.id).filter(
+        db.func.upper(Participant.nom) != ANONYME,
+        ~recent,
+        or_(touched.is_(None), touched < cutoff),
+    )
+
+
+def count_eligible(cutoff: datetime) -> Dict[str, Any]:
+    """Décompte (simulation) : participants concernés, par secteur de création, et signatures."""
+    ids = _eligible(cutoff).subquery()
+    par_secteur = dict(
+        db.session.query(db.func.coalesce(Participant.created_secteur, "—"), db.func.count(Participant.id))
+        .filter(Participant.id.in_(db.select(ids.c.id)))
+        .group_by(db.func.coalesce(Participant.created_secteur, "—"))
+        .all()
+    )
+    signatures = (
+        db.session.query(db.func.count(PresenceActivite.id))
+        .filter(PresenceActivite.participant_id.in_(db.select(ids.c.id)), PresenceActivite.signature_path.isnot(None))
+        .scalar()
+    ) or 0
+    return {
+        "cutoff": cutoff,
+        "participants": sum(par_secteur.values()),
+        "par_secteur": par_secteur,
+        "signatures": int(signatures),
+    }
+
+
+def remove_signature_files(paths: Iterable[str]) -> Tuple[int, int]:
+    """Supprime les fichiers (après commit). Retourne (supprimés, absents/illisibles)."""
+    removed = missing = 0
+    for path in paths:
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            missing += 1
+        except OSError:
+            missing += 1
+            current_app.logger.warning("Signature non supprimée : %s", path)
+    return removed, missing
+
+
+def delete_presences(participant_ids: List[int]) -> List[str]:
+    """Supprime en masse les présences des participants (sans commit) ; renvoie les chemins de signature.
+
+    Les fichiers sont à supprimer avec `remove_signature_files` une fois le commit fait.
+    """
+    if not participant_ids:
+        return []
+    paths = [
+        p for (p,) in db.session.query(PresenceActivite.signature_path).filter(
+            PresenceActivite.participant_id.in_(participant_ids),
+            PresenceActivite.signature_path.isnot(None),
+        )
+    ]
+    db.session.query(PresenceActivite).filter(
+        PresenceActivite.participant_id.in_(participant_ids)
+    ).delete(synchronize_session=False)
+    return paths
+
+
+def _anonymize_chunk(ids: List[int], strict: bool, now: datetime) -> List[str]:
+    """Efface l'identité des participants `ids` et détache leurs signatures (sans commit)."""
+    paths = [
+        p for (p,) in db.session.query(PresenceActivite.signature_path).filter(
+            PresenceActivite.participant_id.in_(ids),
+            PresenceActivite.signature_path.isnot(None),
+        )
+    ]
+    if paths:
+        db.session.execute(
+            update(PresenceActivite)
+            .where(PresenceActivite.participant_id.in_(ids), PresenceActivite.signature_path.isnot(None))
+            .values(signature_path=None)
+            .execution_options(synchronize_session=False)
+        )
+    values: Dict[str, Any] = {
+        "nom": ANONYME,
+        "prenom": db.literal("P") + db.cast(Participant.id, db.String),
+        "adresse": None,
+        "ville": None,
+        "email": None,
+        "telephone": None,
+        "updated_at": now,
+    }
+    if strict:
+        values.update(genre=None, date_naissance=None, quartier_id=None, type_public="H")
+    db.session.execute(
+        update(Participant)
+        .where(Participant.id.in_(ids))
+        .values(values)
+        .execution_options(synchronize_session=False)
+    )
+    return paths
+
+
+def sweep(years: Optional[int] = None, strict: bool = False, chunk: Optional[int] = None,
+          pause: Optional[float] = None, max_chunks: Optional[int] = None,
+          resume: bool = False, declenche_par: str = "cli", log=None) -> RgpdSweep:
+    """Passe d'anonymisation par lots. `resume` reprend la dernière passe non terminée.
+
+    `max_chunks` borne la durée d'une exécution (la passe reste "interrompu" et
+    reprend au prochain lancement avec `resume`).
+    """
+    cfg = current_app.config
+    chunk = max(1, int(chunk or cfg.get("RGPD_SWEEP_CHUNK", 200)))
+    pause = float(cfg.get("RGPD_SWEEP_PAUSE_SECONDS", 0.2) if pause is None else pause)
+
+    run = None
+    if resume:
+        run = (
+            RgpdSweep.query.filter(RgpdSweep.statut.in_(("en_cours", "interrompu")))
+            .order_by(RgpdSweep.id.desc())
+            .first()
+        )
+    if run is None:
+        years = int(years or cfg.get("RGPD_RETENTION_YEARS", 3))
+        run = RgpdSweep(
+            cutoff=retention_cutoff(years),
+            years=years,
+            strict=bool(strict),
+            declenche_par=declenche_par,
+        )
+        db.session.add(run)
+    run.statut = "en_cours"
+    db.session.commit()
+
+    par_secteur = Counter(json.loads(run.resume_json or "{}"))
+    done_chunks = 0
+    try:
+        while max_chunks is None or done_chunks < max_chunks:
+            rows = (
+                _eligible(run.cutoff)
+                .add_columns(Participant.created_secteur)
+                .filter(Participant.id > run.last_participant_id)
+                .order_by(Participant.id.asc())
+                .limit(chunk)
+                .all()
+            )
+            if not rows:
+                run.statut = "termine"
+                run.finished_at = datetime.utcnow()
+                break
+            ids = [pid for pid, _sec in rows]
+            chunk_secteurs = Counter((sec or "—") for _pid, sec in rows)
+
+            def _write(ids=ids, chunk_secteurs=chunk_secteurs):
+                paths = _anonymize_chunk(ids, run.strict, datetime.utcnow())
+                run.last_participant_id = ids[-1]
+                run.nb_anonymises = (run.nb_anonymises or 0) + len(ids)
+                run.nb_signatures = (run.nb_signatures or 0) + len(paths)
+                run.resume_json = json.dumps(dict(par_secteur + chunk_secteurs), ensure_ascii=False)
+                return paths
+
+            paths = run_write(_write)
+            par_secteur.update(chunk_secteurs)
+            _removed, missing = remove_signature_files(paths)
+            run.nb_fichiers_absents = (run.nb_fichiers_absents or 0) + missing
+            done_chunks += 1
+            if log:
+                log(f"lot {done_chunks} : {len(ids)} participant(s), {len(paths)} signature(s) (jusqu'à l'id {ids[-1]})")
+            if pause:
+                time.sleep(pause)  # laisse passer les écritures du kiosque
+        else:
+            run.statut = "interrompu"
+    except (WriteBusyError, KeyboardInterrupt):
+        db.session.rollback()
+        run.statut = "interrompu"
+        db.session.commit()
+        raise
+    db.session.commit()
+    return run
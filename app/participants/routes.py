@@ -1,16 +1,29 @@
 from __future__ import annotations
 
+import json
+import os
 from datetime import datetime
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, abort
+from flask import Blueprint, render_template, request, redirect, url_for, flash, abort, current_app
 from flask_login import login_required, current_user
 
 from app.extensions import db
-from app.models import Participant, PresenceActivite, SessionActivite
+from app.models import Participant, ParticipantImport, ParticipantSecteur, PresenceActivite
+from app.search.index import match_or_like
+from app.participants.dedup import MIN_SCORE, find_duplicates, merge_participants
+from app.participants.importer import ImportFileError, exclusive_job, load_report, run_import, store_upload
+from app.participants.membership import has_visited, secteur_participant_ids
+from app.participants.retention import delete_presences, remove_signature_files
+from app.services.db_write import WriteBusyError
+from app.services.form_once import form_once
+from app.services.pagination import keyset_paginate, page_args
 
 
 bp = Blueprint("participants", __name__, url_prefix="/participants")
 
+# Tri stable des listes : nom, prénom, puis id (départage les homonymes)
+_NAME_KEYS = [(Participant.nom, False), (Participant.prenom, False), (Participant.id, False)]
+
 
 def _current_secteur() -> str:
     return (getattr(current_user, "secteur_assigne", "") or "").strip()
@@ -50,17 +63,22 @@ def _can_see_participant(p: Participant) -> bool:
             return False
         if (p.created_secteur or "") == sec:
             return True
-        has_presence = (
-            db.session.query(PresenceActivite.id)
-            .join(SessionActivite, SessionActivite.id == PresenceActivite.session_id)
-            .filter(PresenceActivite.participant_id == p.id)
-            .filter(SessionActivite.secteur == sec)
-            .first()
-        )
-        return bool(has_presence)
+        return has_visited(p.id, sec)
     return False
 
 
+def _search_clause(q: str):
+    """Filtre nom/prénom/email/téléphone : FTS5 (préfixes) si dispo et s'il trouve, sinon LIKE."""
+    like = f"%{q.lower()}%"
+    clause = db.or_(
+        db.func.lower(Participant.nom).like(like),
+        db.func.lower(Participant.prenom).like(like),
+        db.func.lower(db.func.coalesce(Participant.email, "")).like(like),
+        db.func.lower(db.func.coalesce(Participant.telephone, "")).like(like),
+    )
+    return match_or_like("participant", Participant.id, q, clause)
+
+
 @bp.route("/")
 @login_required
 def list_participants():
@@ -87,14 +105,8 @@ def list_participants():
                 participants_q = participants_q.filter(Participant.created_secteur == sec)
             else:
                 # secteur = (créé par secteur) OU (a une présence dans secteur)
-                subq_presence_ids = (
-                    db.session.query(PresenceActivite.participant_id)
-                    .join(SessionActivite, SessionActivite.id == PresenceActivite.session_id)
-                    .filter(SessionActivite.secteur == sec)
-                    .distinct()
-                )
                 participants_q = participants_q.filter(
-                    (Participant.created_secteur == sec) | (Participant.id.in_(subq_presence_ids))
+                    (Participant.created_secteur == sec) | (Participant.id.in_(secteur_participant_ids(sec)))
                 )
     else:
         # finance/directrice : option filtre secteur
@@ -103,22 +115,16 @@ def list_participants():
             if sec:
                 participants_q = participants_q.filter(Participant.created_secteur == sec)
 
-    # filtre recherche (tous rôles)
+    # filtre recherche (tous rôles) : index FTS5, sinon LIKE
     if q:
-        like = f"%{q.lower()}%"
-        participants_q = participants_q.filter(
-            db.or_(
-                db.func.lower(Participant.nom).like(like),
-                db.func.lower(Participant.prenom).like(like),
-                db.func.lower(db.func.coalesce(Participant.email, "")).like(like),
-                db.func.lower(db.func.coalesce(Participant.telephone, "")).like(like),
-            )
-        )
+        participants_q = participants_q.filter(_search_clause(q))
 
-    items = participants_q.order_by(Participant.nom.asc(), Participant.prenom.asc()).limit(1000).all()
+    cursor, per_page = page_args()
+    page = keyset_paginate(participants_q, _NAME_KEYS, cursor, per_page)
     return render_template(
         "participants/list.html",
-        items=items,
+        items=page.items,
+        page=page,
         q=q,
         scope=scope,
         secteur=_current_secteur(),
@@ -136,15 +142,7 @@ def search_participants():
     if not q or len(q) < 2:
         return {"items": []}
 
-    like = f"%{q.lower()}%"
-    participants_q = Participant.query.filter(
-        db.or_(
-            db.func.lower(Participant.nom).like(like),
-            db.func.lower(Participant.prenom).like(like),
-            db.func.lower(db.func.coalesce(Participant.email, "")).like(like),
-            db.func.lower(db.func.coalesce(Participant.telephone, "")).like(like),
-        )
-    )
+    participants_q = Participant.query.filter(_search_clause(q))
 
     items = (
         participants_q.order_by(Participant.nom.asc(), Participant.prenom.asc())
@@ -180,40 +178,47 @@ def new_participant():
         abort(403)
 
     if request.method == "POST":
-        nom = (request.form.get("nom") or "").strip()
-        prenom = (request.form.get("prenom") or "").strip()
-        if not nom or not prenom:
-            flash("Nom et prénom obligatoires.", "err")
-            return redirect(url_for("participants.new_participant"))
-
-        p = Participant(
-            nom=nom,
-            prenom=prenom,
-            adresse=(request.form.get("adresse") or "").strip() or None,
-            ville=(request.form.get("ville") or "").strip() or None,
-            email=(request.form.get("email") or "").strip() or None,
-            telephone=(request.form.get("telephone") or "").strip() or None,
-            genre=(request.form.get("genre") or "").strip() or None,
-            type_public=(request.form.get("type_public") or "H").strip() or "H",
-            created_by_user_id=getattr(current_user, "id", None),
-            created_secteur=(
-                _current_secteur()
-                if current_user.role == "responsable_secteur"
-                else (request.form.get("created_secteur") or "").strip() or None
-            ),
-        )
-
-        d = (request.form.get("date_naissance") or "").strip()
-        if d:
-            try:
-                p.date_naissance = datetime.strptime(d, "%Y-%m-%d").date()
-            except Exception:
-                pass
+        with form_once(request.form.get("form_token")) as sub:
+            # double clic sur "Créer" : on renvoie vers la fiche déjà créée
+            if sub.replayed:
+                return sub.replay()
+
+            nom = (request.form.get("nom") or "").strip()
+            prenom = (request.form.get("prenom") or "").strip()
+            if not nom or not prenom:
+                flash("Nom et prénom obligatoires.", "err")
+                return redirect(url_for("participants.new_participant"))
+
+            p = Participant(
+                nom=nom,
+                prenom=prenom,
+                adresse=(request.form.get("adresse") or "").strip() or None,
+                ville=(request.form.get("ville") or "").strip() or None,
+                email=(request.form.get("email") or "").strip() or None,
+                telephone=(request.form.get("telephone") or "").strip() or None,
+                genre=(request.form.get("genre") or "").strip() or None,
+                type_public=(request.form.get("type_public") or "H").strip() or "H",
+                created_by_user_id=getattr(current_user, "id", None),
+                created_secteur=(
+                    _current_secteur()
+                    if current_user.role == "responsable_secteur"
+                    else (request.form.get("created_secteur") or "").strip() or None
+                ),
+            )
 
-        db.session.add(p)
-        db.session.commit()
-        flash("Participant créé.", "ok")
-        return redirect(url_for("participants.edit_participant", participant_id=p.id))
+            d = (request.form.get("date_naissance") or "").strip()
+            if d:
+                try:
+                    p.date_naissance = datetime.strptime(d, "%Y-%m-%d").date()
+                except Exception:
+                    pass
+
+            db.session.add(p)
+            db.session.commit()
+            return sub.done(
+                url_for("participants.edit_participant", participant_id=p.id),
+                ("Participant créé.", "ok"),
+            )
 
     return render_template("participants/form.html", item=None, secteur=_current_secteur(), is_editable=True)
 
@@ -308,18 +313,173 @@ def delete_participant(participant_id: int):
     if current_user.role == "responsable_secteur":
         sec = _current_secteur()
         other = (
-            db.session.query(PresenceActivite.id)
-            .join(SessionActivite, SessionActivite.id == PresenceActivite.session_id)
-            .filter(PresenceActivite.participant_id == p.id)
-            .filter(SessionActivite.secteur != sec)
+            db.session.query(ParticipantSecteur.secteur)
+            .filter(ParticipantSecteur.participant_id == p.id)
+            .filter(ParticipantSecteur.secteur != sec)
             .first()
         )
         if other:
             flash("Suppression refusée : participant présent dans d'autres secteurs. Utiliser 'Anonymiser'.", "err")
             return redirect(url_for("participants.edit_participant", participant_id=p.id))
 
-    db.session.query(PresenceActivite).filter(PresenceActivite.participant_id == p.id).delete(synchronize_session=False)
+    sig_paths = delete_presences([p.id])
     db.session.delete(p)
     db.session.commit()
+    remove_signature_files(sig_paths)
     flash("Participant supprimé définitivement.", "warning")
     return redirect(url_for("participants.list_participants"))
+
+
+@bp.route("/doublons")
+@login_required
+def duplicates():
+    """Doublons probables (détection par blocs), à fusionner manuellement."""
+    if not _is_global_role():
+        abort(403)
+
+    try:
+        min_score = max(50, min(int(request.args.get("min_score") or MIN_SCORE), 100))
+    except ValueError:
+        min_score = MIN_SCORE
+    pairs = find_duplicates(min_score=min_score, limit=300)
+
+    ids = {p.a_id for p in pairs} | {p.b_id for p in pairs}
+    people = {p.id: p for p in Participant.query.filter(Participant.id.in_(ids)).all()} if ids else {}
+    presence_counts = dict(
+        db.session.query(PresenceActivite.participant_id, db.func.count(PresenceActivite.id))
+        .filter(PresenceActivite.participant_id.in_(ids))
+        .group_by(PresenceActivite.participant_id)
+        .all()
+    ) if ids else {}
+
+    return render_template(
+        "participants/doublons.html",
+        pairs=pairs,
+        people=people,
+        presence_counts=presence_counts,
+        min_score=min_score,
+    )
+
+
+@bp.route("/merge", methods=["POST"])
+@login_required
+def merge():
+    if not _is_global_role():
+        abort(403)
+
+    try:
+        keep_id = int(request.form.get("keep_id") or 0)
+        drop_id = int(request.form.get("drop_id") or 0)
+        stats = merge_participants(keep_id, drop_id)
+        db.session.commit()
+    except (ValueError, LookupError) as exc:
+        db.session.rollback()
+        flash(str(exc) or "Fusion impossible.", "err")
+        return redirect(url_for("participants.duplicates"))
+
+    flash(
+        "Fiches fusionnées : {presences_repointees} présence(s) et {evaluations_repointees} évaluation(s) "
+        "reprises, {presences_fusionnees} présence(s) en double regroupée(s).".format(**stats),
+        "ok",
+    )
+    return redirect(url_for("participants.duplicates"))
+
+
+# ---------------------------------------------------------------------------
+# Import CSV / XLSX
+# ---------------------------------------------------------------------------
+
+def _can_access_import(job: ParticipantImport) -> bool:
+    if _is_global_role():
+        return True
+    return current_user.role == "responsable_secteur" and (job.created_secteur or "") == _current_secteur()
+
+
+@bp.route("/import", methods=["GET", "POST"])
+@login_required
+def import_upload():
+    """Dépôt d'un fichier : enregistré puis analysé à blanc (aucune écriture)."""
+    if current_user.role == "admin_tech":
+        abort(403)
+
+    if request.method == "POST":
+        if current_user.role == "responsable_secteur":
+            secteur = _current_secteur()
+            if not secteur:
+                abort(403)
+        else:
+            secteur = (request.form.get("created_secteur") or "").strip() or None
+
+        f = request.files.get("fichier")
+        if not f or not f.filename:
+            flash("Choisis un fichier CSV ou XLSX.", "err")
+            return redirect(url_for("participants.import_upload"))
+        try:
+            original, path = store_upload(f, os.path.join(current_app.instance_path, "imports"))
+        except ImportFileError as exc:
+            flash(str(exc), "err")
+            return redirect(url_for("participants.import_upload"))
+
+        job = ParticipantImport(
+            filename=original[:255],
+            stored_path=path,
+            created_secteur=secteur,
+            created_by_user_id=getattr(current_user, "id", None),
+        )
+        db.session.add(job)
+        db.session.commit()
+        try:
+            run_import(job, dry_run=True)
+        except ImportFileError as exc:
+            job.statut = "erreur"
+            job.report_json = json.dumps({"fatal": str(exc)}, ensure_ascii=False)
+            db.session.commit()
+        return redirect(url_for("participants.import_detail", job_id=job.id))
+
+    jobs_q = ParticipantImport.query
+    if current_user.role == "responsable_secteur":
+        jobs_q = jobs_q.filter(ParticipantImport.created_secteur == _current_secteur())
+    jobs = jobs_q.order_by(ParticipantImport.id.desc()).limit(20).all()
+    return render_template("participants/import.html", jobs=jobs, secteur=_current_secteur())
+
+
+@bp.route("/import/<int:job_id>")
+@login_required
+def import_detail(job_id: int):
+    job = ParticipantImport.query.get_or_404(job_id)
+    if current_user.role == "admin_tech" or not _can_access_import(job):
+        abort(403)
+    return render_template("participants/import_job.html", job=job, report=load_report(job))
+
+
+@bp.route("/import/<int:job_id>/run", methods=["POST"])
+@login_required
+def import_run(job_id: int):
+    """Exécute (ou reprend) l'import, lot par lot, depuis le dernier point de reprise."""
+    job = ParticipantImport.query.get_or_404(job_id)
+    if current_user.role == "admin_tech" or not _can_access_import(job):
+        abort(403)
+    if job.statut not in ("pret", "en_cours"):
+        flash("Cet import n'est pas exécutable.", "err")
+        return redirect(url_for("participants.import_detail", job_id=job.id))
+
+    with exclusive_job(job.id) as acquired:
+        if not acquired:
+            flash("Import déjà en cours de traitement.", "err")
+            return redirect(url_for("participants.import_detail", job_id=job.id))
+        try:
+            run_import(job, dry_run=False, created_by_user_id=getattr(current_user, "id", None))
+        except WriteBusyError:
+            flash(f"Base occupée : import interrompu à la ligne {job.rows_done}. Relance pour reprendre.", "err")
+            return redirect(url_for("participants.import_detail", job_id=job.id))
+        except ImportFileError as exc:
+            db.session.rollback()
+            flash(str(exc), "err")
+            return redirect(url_for("participants.import_detail", job_id=job.id))
+
+    flash(
+        f"Import terminé : {job.nb_crees} fiche(s) créée(s), {job.nb_completes} complétée(s), "
+        f"{job.nb_inchanges} inchangée(s), {job.nb_erreurs} ligne(s) en erreur.",
+        "ok",
+    )
+    return redirect(url_for("participants.import_detail", job_id=job.id))
@@ -0,0 +1,104 @@
+"""Portefeuille de projets : tous les projets, leurs finances et leurs indicateurs.
+
+Le calcul est ensembliste, quel que soit le nombre de projets :
+- totaux financiers par projet, sur l'année choisie, hors subventions archivées
+  (services/finance_aggregates.by_projet) ;
+- réel charges / produits par projet pour les indicateurs financiers ;
+- liens projet <-> ateliers et indicateurs actifs (une requête chacun) ;
+- métriques participants par périmètre distinct (services/indicators).
+
+Option : un instantané précalculé (`flask projets portfolio-snapshot`, à planifier
+la nuit) est servi tel quel ; il est signalé comme "à actualiser" si les versions
+de données ont changé depuis son calcul, et `?live=1` force le calcul.
+"""
+from __future__ import annotations
+
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.extensions import db
+from app.models import PortfolioSnapshot, Projet
+from app.services import finance_aggregates, indicators
+from app.services.data_version import data_versions
+
+
+SNAPSHOTS_KEPT = 10
+
+
+def _same_annee(annee: Optional[int]):
+    return PortfolioSnapshot.annee.is_(None) if annee is None else PortfolioSnapshot.annee == annee
+
+
+def build_portfolio(projets: List[Projet], annee: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Lignes du portefeuille (dicts sérialisables), dans l'ordre de `projets`."""
+    pids = [p.id for p in projets]
+    if not pids:
+        return []
+    finance = finance_aggregates.by_projet(pids, annee, exclude_archived=True)
+    reel = finance_aggregates.reel_par_nature_par_projet(pids, annee)
+    evaluated = indicators.evaluate(
+        indicators.active_indicators(pids),
+        indicators.projet_atelier_ids(pids),
+        reel,
+        selected_annee=annee,
+    )
+    empty = dict.fromkeys(("demande", "attribue", "recu", "reel_lignes", "engage", "reste"), 0.0)
+    rows = []
+    for p in projets:
+        inds = evaluated.get(p.id, [])
+        rows.append({
+            "id": p.id,
+            "nom": p.nom,
+            "secteur": p.secteur,
+            "finance": finance.get(p.id, empty),
+            "indicateurs": inds,
+            "nb_ok": sum(1 for it in inds if it["status"] == "ok"),
+            "nb_warn": sum(1 for it in inds if it["status"] == "warn"),
+            "nb_bad": sum(1 for it in inds if it["status"] == "bad"),
+        })
+    return rows
+
+
+def save_snapshot(annee: Optional[int] = None) -> PortfolioSnapshot:
+    """Calcule le portefeuille de TOUS les projets et l'enregistre (les plus anciens sont purgés)."""
+    versions = data_versions()
+    projets = Projet.query.order_by(Projet.secteur.asc(), Projet.nom.asc()).all()
+    snap = PortfolioSnapshot(
+        annee=annee,
+        computed_at=datetime.utcnow(),
+        versions_json=json.dumps(versions),
+        payload_json=json.dumps(build_portfolio(projets, annee), ensure_ascii=False),
+    )
+    db.session.add(snap)
+    db.session.flush()
+    old_ids = [
+        sid for (sid,) in db.session.query(PortfolioSnapshot.id)
+        .filter(_same_annee(annee))
+        .order_by(PortfolioSnapshot.id.desc())
+        .offset(SNAPSHOTS_KEPT)
+    ]
+    if old_ids:
+        PortfolioSnapshot.query.filter(PortfolioSnapshot.id.in_(old_ids)).delete(synchronize_session=False)
+    db.session.commit()
+    return snap
+
+
+def latest_snapshot(annee: Optional[int] = None) -> Optional[PortfolioSnapshot]:
+    return PortfolioSnapshot.query.filter(_same_annee(annee)).order_by(PortfolioSnapshot.id.desc()).first()
+
+
+def snapshot_rows(snap: PortfolioSnapshot, projets: List[Projet]) -> List[Dict[str, Any]]:
+    """Lignes de l'instantané restreintes aux `projets` visibles, dans leur ordre.
+
+    Un projet créé après l'instantané n'y figure pas : il est absent de la liste.
+    """
+    by_id = {row["id"]: row for row in json.loads(snap.payload_json or "[]")}
+    return [by_id[p.id] for p in projets if p.id in by_id]
+
+
+def snapshot_is_fresh(snap: PortfolioSnapshot) -> bool:
+    try:
+        return json.loads(snap.versions_json or "{}") == data_versions()
+    except ValueError:
+        return False
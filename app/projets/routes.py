@@ -6,6 +6,9 @@ from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 
 from app.extensions import db
+from app.services.finance_snapshot import FinanceSnapshot
+from app.services import finance_aggregates, indicators
+from app.projets import portfolio
 from app.models import (
     Projet,
     Subvention,
@@ -92,7 +95,39 @@ def projets_list():
 
     projets = q.order_by(Projet.created_at.desc()).all()
     secteurs = current_app.config.get("SECTEURS", [])
-    return render_template("projets_list.html", projets=projets, secteurs=secteurs)
+    fin = FinanceSnapshot.load(projet_ids=[p.id for p in projets])
+    return render_template("projets_list.html", projets=projets, secteurs=secteurs, fin=fin)
+
+@bp.route("/projets/portefeuille")
+@login_required
+def projets_portfolio():
+    if current_user.role == "admin_tech":
+        abort(403)
+
+    q = Projet.query
+    if current_user.role == "responsable_secteur":
+        q = q.filter(Projet.secteur == current_user.secteur_assigne)
+    projets = q.order_by(Projet.secteur.asc(), Projet.nom.asc()).all()
+
+    annee = request.args.get("annee", type=int)
+    live = request.args.get("live") == "1"
+
+    snap = None if live else portfolio.latest_snapshot(annee)
+    if snap:
+        rows = portfolio.snapshot_rows(snap, projets)
+        fresh = portfolio.snapshot_is_fresh(snap)
+    else:
+        rows = portfolio.build_portfolio(projets, annee)
+        fresh = True
+
+    return render_template(
+        "projets_portfolio.html",
+        rows=rows,
+        snap=snap,
+        fresh=fresh,
+        annee=annee,
+        annees=finance_aggregates.annees_disponibles(),
+    )
 
 @bp.route("/projets/new", methods=["GET", "POST"])
 @login_required
@@ -359,11 +394,28 @@ def projets_edit(projet_id):
     subs_q = Subvention.query.filter_by(est_archive=False).filter(Subvention.secteur == p.secteur)
     subs = subs_q.order_by(Subvention.annee_exercice.desc(), Subvention.nom.asc()).all()
     linked_subs = set(sp.subvention_id for sp in p.subventions)
+    fin = FinanceSnapshot.load(subvention_ids=[s.id for s in subs], projet_ids=[p.id])
 
     ateliers = AtelierActivite.query.filter_by(secteur=p.secteur, is_deleted=False).order_by(AtelierActivite.nom.asc()).all()
     linked_ateliers = set(link.atelier_id for link in ProjetAtelier.query.filter_by(projet_id=p.id).all())
 
     indicateurs = ProjetIndicateur.query.filter_by(projet_id=p.id).order_by(ProjetIndicateur.created_at.asc()).all()
+    # Valeurs courantes (toutes périodes, ou année ?annee=) : même moteur que les stats
+    try:
+        annee = int(request.args.get("annee") or 0) or None
+    except ValueError:
+        annee = None
+    projet_sub_ids = db.select(SubventionProjet.subvention_id).where(SubventionProjet.projet_id == p.id)
+    if annee:
+        projet_sub_ids = projet_sub_ids.join(Subvention, Subvention.id == SubventionProjet.subvention_id)\
+            .where(Subvention.annee_exercice == annee)
+    evaluated = indicators.evaluate(
+        {p.id: indicateurs},
+        {p.id: sorted(linked_ateliers)},
+        {p.id: finance_aggregates.reel_par_nature(projet_sub_ids)},
+        selected_annee=annee,
+    )
+    indicator_values = {it["id"]: it for it in evaluated.get(p.id, [])}
     referentiels = Referentiel.query.order_by(Referentiel.nom.asc()).all()
     selected_competences = {c.id for c in p.competences}
 
@@ -372,9 +424,11 @@ def projets_edit(projet_id):
         projet=p,
         subs=subs,
         linked=linked_subs,
+        fin=fin,
         ateliers=ateliers,
         linked_ateliers=linked_ateliers,
         indicateurs=indicateurs,
+        indicator_values=indicator_values,
         indicator_templates=INDICATOR_TEMPLATES,
         indicator_packs=INDICATOR_PACKS,
         period_choices=PERIOD_CHOICES,
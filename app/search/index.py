@@ -0,0 +1,182 @@
+"""Index plein texte (SQLite FTS5) pour la recherche globale.
+
+Une table FTS5 "external content" par type d'objet : le texte n'est pas dupliqué,
+seul l'index est stocké. Les triggers SQLite maintiennent l'index à chaque
+INSERT / UPDATE / DELETE, y compris pour les écritures faites hors ORM.
+
+Si FTS5 n'est pas disponible (autre moteur, SQLite compilé sans FTS5), les
+helpers renvoient None et les appelants retombent sur leurs filtres LIKE.
+"""
+from __future__ import annotations
+
+import re
+from typing import Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import or_, text
+
+from app.extensions import db
+
+
+# kind -> (table source, colonnes indexées, poids BM25 par colonne)
+FTS_SOURCES: Dict[str, Tuple[str, Tuple[str, ...], Tuple[float, ...]]] = {
+    "participant": ("participant", ("nom", "prenom", "email", "telephone"), (10.0, 6.0, 2.0, 2.0)),
+    "atelier": ("atelier_activite", ("nom", "description"), (10.0, 1.0)),
+    "facture": ("facture_achat", ("fournisseur", "reference_facture"), (6.0, 8.0)),
+    "inventaire": (
+        "inventaire_item",
+        ("designation", "id_interne", "numero_serie", "marque", "modele"),
+        (10.0, 8.0, 8.0, 3.0, 3.0),
+    ),
+}
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+_available: Optional[bool] = None
+
+
+def fts_table(kind: str) -> str:
+    return f"fts_{kind}"
+
+
+def _create_statements(kind: str):
+    source, cols, _weights = FTS_SOURCES[kind]
+    fts = fts_table(kind)
+    col_list = ", ".join(cols)
+    new_vals = ", ".join(f"new.{c}" for c in cols)
+    old_vals = ", ".join(f"old.{c}" for c in cols)
+
+    yield (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{col_list}, content='{source}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    yield (
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {source} BEGIN "
+        f"INSERT INTO {fts}(rowid, {col_list}) VALUES (new.id, {new_vals}); END"
+    )
+    yield (
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {source} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {col_list}) VALUES ('delete', old.id, {old_vals}); END"
+    )
+    yield (
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {source} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {col_list}) VALUES ('delete', old.id, {old_vals}); "
+        f"INSERT INTO {fts}(rowid, {col_list}) VALUES (new.id, {new_vals}); END"
+    )
+
+
+def ensure_search_index() -> None:
+    """Crée les tables FTS5 + triggers si besoin (à appeler après create_all).
+
+    Une table FTS nouvellement créée est remplie via la commande 'rebuild'.
+    """
+    global _available
+    try:
+        existing = {
+            row[0]
+            for row in db.session.execute(
+                text("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'fts_%'")
+            ).all()
+        }
+        for kind in FTS_SOURCES:
+            fts = fts_table(kind)
+            for sql in _create_statements(kind):
+                db.session.execute(text(sql))
+            if fts not in existing:
+                db.session.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+        db.session.commit()
+        _available = True
+    except Exception:
+        db.session.rollback()
+        _available = False
+
+
+def rebuild_search_index() -> None:
+    """Reconstruit tous les index (utile après un import SQL brut)."""
+    if not is_available():
+        return
+    for kind in FTS_SOURCES:
+        fts = fts_table(kind)
+        db.session.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+    db.session.commit()
+
+
+def is_available() -> bool:
+    global _available
+    if _available is None:
+        ensure_search_index()
+    return bool(_available)
+
+
+def build_match_query(q: str, columns: Optional[Sequence[str]] = None) -> Optional[str]:
+    """Transforme une saisie libre en expression MATCH sûre.
+
+    Chaque mot devient un préfixe entre guillemets ("dup"*), combinés en ET.
+    Les caractères spéciaux FTS (guillemets, NEAR, -, :) sont neutralisés.
+    `columns` restreint la recherche à ces colonnes de l'index ({nom prenom} : ...).
+    """
+    tokens = _TOKEN_RE.findall(q or "")
+    tokens = [t for t in tokens if t]
+    if not tokens:
+        return None
+    expr = " ".join(f'"{t}"*' for t in tokens[:8])
+    if columns:
+        expr = "{" + " ".join(columns) + "} : (" + expr + ")"
+    return expr
+
+
+def match_ids_clause(kind: str, id_column, q: str, columns: Optional[Sequence[str]] = None):
+    """Critère SQLAlchemy `id IN (SELECT rowid FROM fts_<kind> WHERE ... MATCH q)`.
+
+    Retourne None si FTS indisponible ou recherche vide (l'appelant garde son LIKE).
+    """
+    expr = build_match_query(q, columns)
+    if not expr or not is_available():
+        return None
+    fts = fts_table(kind)
+    sub = (
+        text(f"SELECT rowid FROM {fts} WHERE {fts} MATCH :fts_q")
+        .bindparams(fts_q=expr)
+        .columns(db.column("rowid"))
+    )
+    return id_column.in_(sub)
+
+
+def match_or_like(kind: str, id_column, q: str, like_clause, columns: Optional[Sequence[str]] = None):
+    """Critère `FTS OU like_clause` ; `like_clause` seul si FTS indisponible.
+
+    L'index ne connaît que les débuts de mots : une sous-chaîne en milieu de mot
+    ("pont" pour "Dupont") ne sort que par le LIKE de l'appelant, qui n'est donc
+    jamais remplacé par le MATCH (mêmes résultats que la recherche LIKE seule).
+    """
+    crit = match_ids_clause(kind, id_column, q, columns)
+    if crit is None:
+        return like_clause
+    return or_(crit, like_clause)
+
+
+def bm25_expr(kind: str):
+    """Expression de score BM25 (plus petit = plus pertinent)."""
+    _source, _cols, weights = FTS_SOURCES[kind]
+    fts = fts_table(kind)
+    w = ", ".join(f"{x:.1f}" for x in weights)
+    return db.literal_column(f"bm25({fts}, {w})")
+
+
+def ranked_query(kind: str, model, q: str):
+    """Requête `model` jointe à son index FTS, filtrée par MATCH et triée par BM25.
+
+    Retourne None si FTS indisponible.
+    """
+    expr = build_match_query(q)
+    if not expr or not is_available():
+        return None
+    fts = fts_table(kind)
+    fts_t = db.table(fts, db.column("rowid"))
+    score = bm25_expr(kind)
+    return (
+        db.session.query(model, score.label("score"))
+        .join(fts_t, fts_t.c.rowid == model.id)
+        .filter(text(f"{fts} MATCH :fts_q").bindparams(fts_q=expr))
+        .order_by(score.asc())
+    )
@@ -0,0 +1,38 @@
+from flask import render_template, request, abort, jsonify
+from flask_login import login_required, current_user
+
+from . import bp
+from .services import SEARCH_KINDS, global_search
+
+
+@bp.route("/search")
+@login_required
+def search():
+    """Recherche globale (participants, ateliers, factures, inventaire).
+
+    ?q=...&type=participant&type=facture  (par défaut : tous les types)
+    ?format=json pour l'auto-complétion.
+    """
+    if current_user.role == "admin_tech":
+        abort(403)
+
+    q = (request.args.get("q") or "").strip()
+    kinds = [k for k in request.args.getlist("type") if k in SEARCH_KINDS] or list(SEARCH_KINDS)
+    try:
+        limit = max(1, min(int(request.args.get("limit") or 20), 100))
+    except ValueError:
+        limit = 20
+
+    results = global_search(current_user, q, kinds=kinds, limit=limit)
+
+    if request.args.get("format") == "json":
+        return jsonify({"q": q, "results": results})
+
+    return render_template(
+        "search/results.html",
+        q=q,
+        kinds=kinds,
+        kind_labels=SEARCH_KINDS,
+        results=results,
+        total=sum(len(v) for v in results.values()),
+    )
@@ -0,0 +1,145 @@
+"""Recherche globale : participants, ateliers, factures, inventaire.
+
+Résultats classés par BM25 (FTS5), par type, et cloisonnés par secteur selon le rôle.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional
+
+from flask import url_for
+from werkzeug.routing import BuildError
+
+from app.extensions import db
+from app.models import (
+    AtelierActivite,
+    FactureAchat,
+    InventaireItem,
+    Participant,
+)
+from app.participants.membership import secteur_participant_ids
+from app.search.index import FTS_SOURCES, is_available, ranked_query
+
+
+SEARCH_KINDS = {
+    "participant": "Participants",
+    "atelier": "Ateliers",
+    "facture": "Factures",
+    "inventaire": "Inventaire",
+}
+
+_MODELS = {
+    "participant": Participant,
+    "atelier": AtelierActivite,
+    "facture": FactureAchat,
+    "inventaire": InventaireItem,
+}
+
+
+def _safe(endpoint: str, fallback: str = "#", **values) -> str:
+    try:
+        return url_for(endpoint, **values)
+    except BuildError:
+        return fallback
+
+
+def _is_global_role(user) -> bool:
+    return getattr(user, "role", None) in ("directrice", "finance")
+
+
+def _user_secteur(user) -> str:
+    return (getattr(user, "secteur_assigne", "") or "").strip()
+
+
+def _scope(kind: str, query, user):
+    """Applique le cloisonnement secteur (mêmes règles que les listes existantes)."""
+    if kind == "atelier":
+        query = query.filter(AtelierActivite.is_deleted.is_(False))
+    if _is_global_role(user):
+        return query
+
+    sec = _user_secteur(user)
+    if not sec:
+        return query.filter(db.false())
+
+    if kind == "participant":
+        # secteur = (créé par secteur) OU (a une présence dans secteur)
+        return query.filter(
+            (Participant.created_secteur == sec) | (Participant.id.in_(secteur_participant_ids(sec)))
+        )
+    if kind == "atelier":
+        return query.filter(AtelierActivite.secteur == sec)
+    if kind == "facture":
+        return query.filter(FactureAchat.secteur_principal == sec)
+    if kind == "inventaire":
+        return query.filter(InventaireItem.secteur == sec)
+    return query.filter(db.false())
+
+
+def _like_query(kind: str, q: str):
+    """Fallback sans FTS5 : LIKE sur les mêmes colonnes, sans score."""
+    model = _MODELS[kind]
+    _source, cols, _weights = FTS_SOURCES[kind]
+    like = f"%{q.lower()}%"
+    conds = [db.func.lower(db.func.coalesce(getattr(model, c), "")).like(like) for c in cols]
+    return db.session.query(model, db.literal(0.0).label("score")).filter(db.or_(*conds))
+
+
+def _to_result(kind: str, obj, score: float) -> Dict[str, Any]:
+    if kind == "participant":
+        detail = " · ".join([x for x in (obj.ville, obj.email, obj.telephone) if x])
+        return {
+            "id": obj.id,
+            "label": f"{obj.nom} {obj.prenom}",
+            "detail": detail,
+            "secteur": obj.created_secteur or "",
+            "url": _safe("participants.edit_participant", participant_id=obj.id),
+            "score": score,
+        }
+    if kind == "atelier":
+        return {
+            "id": obj.id,
+            "label": obj.nom,
+            "detail": obj.type_atelier or "",
+            "secteur": obj.secteur,
+            "url": _safe("activite.sessions", atelier_id=obj.id),
+            "score": score,
+        }
+    if kind == "facture":
+        d = obj.date_facture.strftime("%d/%m/%Y") if obj.date_facture else ""
+        return {
+            "id": obj.id,
+            "label": " — ".join([x for x in (obj.fournisseur, obj.reference_facture) if x]) or f"Facture #{obj.id}",
+            "detail": " · ".join([x for x in (d, obj.statut) if x]),
+            "secteur": obj.secteur_principal,
+            "url": _safe("inventaire.facture_detail", facture_id=obj.id),
+            "score": score,
+        }
+    # inventaire
+    detail = " · ".join([x for x in (obj.marque, obj.modele, obj.numero_serie) if x])
+    return {
+        "id": obj.id,
+        "label": f"{obj.id_interne} — {obj.designation}",
+        "detail": detail,
+        "secteur": obj.secteur,
+        "url": _safe("inventaire_materiel.edit_item", item_id=obj.id),
+        "score": score,
+    }
+
+
+def global_search(user, q: str, kinds: Optional[List[str]] = None, limit: int = 20) -> Dict[str, List[Dict[str, Any]]]:
+    """Recherche sur tous les types demandés. Retourne {kind: [résultats]} (ordre BM25)."""
+    q = (q or "").strip()
+    kinds = [k for k in (kinds or list(SEARCH_KINDS)) if k in SEARCH_KINDS]
+    out: Dict[str, List[Dict[str, Any]]] = {k: [] for k in kinds}
+    if len(q) < 2:
+        return out
+
+    use_fts = is_available()
+    for kind in kinds:
+        query = ranked_query(kind, _MODELS[kind], q) if use_fts else None
+        if query is None:
+            query = _like_query(kind, q)
+        query = _scope(kind, query, user)
+        rows = query.limit(limit).all()
+        out[kind] = [_to_result(kind, obj, float(score or 0.0)) for obj, score in rows]
+    return out
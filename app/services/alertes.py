@@ -0,0 +1,299 @@
+"""Alertes de gestion persistées, réévaluées seulement pour les cibles modifiées.
+
+Table `alerte` : une ligne par (règle, cible) active, avec niveau, message,
+secteur et année pour filtrer par périmètre. Les pages (dashboard, bilan global,
+bilans) lisent cette table au lieu de recalculer les règles à chaque requête.
+
+Table `alerte_a_evaluer` : file des cibles à réévaluer, alimentée par des
+triggers SQLite (même principe que budget/engagement.py) sur les subventions,
+les lignes budgétaires (dont l'engagé, donc les dépenses), les factures, leurs
+lignes et l'inventaire. Toute écriture, y compris hors ORM, marque la cible.
+
+`sync_alertes()` vide la file et réévalue uniquement ces cibles. Elle est
+appelée en fin de requête d'écriture (`install_alertes_sync`) et par le
+rafraîchissement du dashboard ; les pages ne font que lire la table.
+"""
+from __future__ import annotations
+
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from flask import request
+from sqlalchemy import exists, text
+
+from app.extensions import db
+from app.models import Alerte, FactureAchat, FactureLigne, InventaireItem, Subvention
+from app.services.db_write import WriteBusyError, run_write
+from app.services.finance_snapshot import FinanceSnapshot
+
+log = logging.getLogger(__name__)
+
+# règle -> niveau (l'ordre est celui d'affichage pour une même cible)
+REGLES = {
+    "ventilation_manquante": "danger",
+    "ventilation_incomplete": "warning",
+    "depassement": "danger",
+    "consommation_80": "warning",
+    "facture_sans_inventaire": "info",
+}
+
+# règles affichées par page
+REGLES_DASHBOARD = ("ventilation_manquante", "depassement", "consommation_80")
+REGLES_BILAN = ("ventilation_manquante", "ventilation_incomplete", "depassement")
+
+BATCH_SIZE = 500
+
+
+def _mark(cible_type: str, id_expr: str) -> str:
+    return f"INSERT OR IGNORE INTO alerte_a_evaluer(cible_type, cible_id) SELECT '{cible_type}', {id_expr} WHERE {id_expr} IS NOT NULL;"
+
+
+def _mark_facture_of_ligne(ligne_expr: str) -> str:
+    return (
+        "INSERT OR IGNORE INTO alerte_a_evaluer(cible_type, cible_id)"
+        f" SELECT 'facture', facture_id FROM facture_ligne WHERE id = {ligne_expr};"
+    )
+
+
+_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS alerte_subvention_ai AFTER INSERT ON subvention BEGIN "
+    + _mark("subvention", "new.id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS alerte_subvention_au AFTER UPDATE ON subvention BEGIN "
+    + _mark("subvention", "new.id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS alerte_subvention_ad AFTER DELETE ON subvention BEGIN "
+    + _mark("subvention", "old.id") + " END",
+    # lignes : réel, nature, engagé (engage_cache est mis à jour par les dépenses)
+    "CREATE TRIGGER IF NOT EXISTS alerte_ligne_budget_ai AFTER INSERT ON ligne_budget BEGIN "
+    + _mark("subvention", "new.subvention_id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS alerte_ligne_budget_au AFTER UPDATE ON ligne_budget BEGIN "
+    + _mark("subvention", "old.subvention_id") + " " + _mark("subvention", "new.subvention_id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS alerte_ligne_budget_ad AFTER DELETE ON ligne_budget BEGIN "
+    + _mark("subvention", "old.subvention_id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS alerte_facture_achat_ai AFTER INSERT ON facture_achat BEGIN "
+    + _mark("facture", "new.id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS alerte_facture_achat_au AFTER UPDATE OF secteur_principal, date_facture"
+    " ON facture_achat BEGIN " + _mark("facture", "new.id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS alerte_facture_achat_ad AFTER DELETE ON facture_achat BEGIN "
+    + _mark("facture", "old.id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS alerte_facture_ligne_ai AFTER INSERT ON facture_ligne BEGIN "
+    + _mark("facture", "new.facture_id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS alerte_facture_ligne_au AFTER UPDATE OF facture_id ON facture_ligne BEGIN "
+    + _mark("facture", "old.facture_id") + " " + _mark("facture", "new.facture_id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS alerte_facture_ligne_ad AFTER DELETE ON facture_ligne BEGIN "
+    + _mark("facture", "old.facture_id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS alerte_inventaire_item_ai AFTER INSERT ON inventaire_item BEGIN "
+    + _mark_facture_of_ligne("new.facture_ligne_id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS alerte_inventaire_item_au AFTER UPDATE OF facture_ligne_id ON inventaire_item BEGIN "
+    + _mark_facture_of_ligne("old.facture_ligne_id") + " " + _mark_facture_of_ligne("new.facture_ligne_id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS alerte_inventaire_item_ad AFTER DELETE ON inventaire_item BEGIN "
+    + _mark_facture_of_ligne("old.facture_ligne_id") + " END",
+]
+
+
+# ---------------------------------------------------------------------------
+# Règles
+
+def _eval_subventions(ids: Sequence[int]) -> Dict[Tuple[str, int], List[dict]]:
+    out: Dict[Tuple[str, int], List[dict]] = {("subvention", sid): [] for sid in ids}
+    rows = (
+        db.session.query(Subvention.id, Subvention.nom, Subvention.secteur, Subvention.annee_exercice)
+        .filter(Subvention.id.in_(ids), Subvention.est_archive.is_(False))
+        .all()
+    )
+    fin = FinanceSnapshot.load(subvention_ids=[r[0] for r in rows])
+    for sid, nom, secteur, annee in rows:
+        st = fin.sub(sid)
+        recu = st.montant_recu
+        reel_lignes = st.total_reel_lignes
+        engage = st.total_engage
+        found = out[("subvention", sid)]
+
+        def add(regle: str, message: str) -> None:
+            found.append({"regle": regle, "secteur": secteur, "annee": annee, "message": message})
+
+        if recu > 0 and reel_lignes == 0:
+            add("ventilation_manquante", f"{nom} : reçu {recu:.2f}€ mais lignes réel = 0€ (ventilation manquante).")
+        if recu > 0 and 0 < reel_lignes < recu:
+            add("ventilation_incomplete",
+                f"{nom} : reçu {recu:.2f}€ mais lignes réel = {reel_lignes:.2f}€ (ventilation incomplète).")
+        if reel_lignes > 0 and engage > reel_lignes:
+            add("depassement", f"{nom} : engagé {engage:.2f}€ > lignes réel {reel_lignes:.2f}€ (dépassement).")
+        if st.montant_attribue > 0:
+            pct = (engage / st.montant_attribue) * 100
+            if pct >= 80:
+                add("consommation_80", f"{nom} : {pct:.0f}% consommé (reste {st.total_reste:.2f}€).")
+    return out
+
+
+def _eval_factures(ids: Sequence[int]) -> Dict[Tuple[str, int], List[dict]]:
+    out: Dict[Tuple[str, int], List[dict]] = {("facture", fid): [] for fid in ids}
+    has_inventaire = (
+        exists()
+        .where(FactureLigne.facture_id == FactureAchat.id)
+        .where(InventaireItem.facture_ligne_id == FactureLigne.id)
+    )
+    rows = (
+        db.session.query(FactureAchat.id, FactureAchat.reference_facture, FactureAchat.fournisseur,
+                         FactureAchat.secteur_principal, FactureAchat.date_facture)
+        .filter(FactureAchat.id.in_(ids), ~has_inventaire)
+        .all()
+    )
+    for fid, ref, fournisseur, secteur, date_facture in rows:
+        label = " — ".join(x for x in (fournisseur, ref) if x) or f"#{fid}"
+        out[("facture", fid)].append({
+            "regle": "facture_sans_inventaire",
+            "secteur": secteur,
+            "annee": date_facture.year if date_facture else None,
+            "message": f"Facture {label} : aucune entrée inventaire associée.",
+        })
+    return out
+
+
+def _apply(found: Dict[Tuple[str, int], List[dict]]) -> None:
+    """Remplace les alertes des cibles évaluées (conserve la date de première détection)."""
+    if not found:
+        return
+    now = datetime.utcnow()
+    by_type: Dict[str, List[int]] = {}
+    for cible_type, cible_id in found:
+        by_type.setdefault(cible_type, []).append(cible_id)
+    existing: Dict[Tuple[str, str, int], Alerte] = {}
+    for cible_type, ids in by_type.items():
+        for a in Alerte.query.filter(Alerte.cible_type == cible_type, Alerte.cible_id.in_(ids)):
+            existing[(a.regle, a.cible_type, a.cible_id)] = a
+
+    for (cible_type, cible_id), items in found.items():
+        for item in items:
+            key = (item["regle"], cible_type, cible_id)
+            a = existing.pop(key, None)
+            if a is None:
+                a = Alerte(regle=item["regle"], cible_type=cible_type, cible_id=cible_id, created_at=now)
+                db.session.add(a)
+            a.niveau = REGLES[item["regle"]]
+            a.secteur = item["secteur"]
+            a.annee = item["annee"]
+            a.message = item["message"]
+            a.updated_at = now
+    for a in existing.values():
+        db.session.delete(a)
+
+
+def _evaluate(targets: Iterable[Tuple[str, int]]) -> int:
+    subs = sorted({cid for ctype, cid in targets if ctype == "subvention"})
+    facts = sorted({cid for ctype, cid in targets if ctype == "facture"})
+    for i in range(0, len(subs), BATCH_SIZE):
+        _apply(_eval_subventions(subs[i:i + BATCH_SIZE]))
+    for i in range(0, len(facts), BATCH_SIZE):
+        _apply(_eval_factures(facts[i:i + BATCH_SIZE]))
+    return len(subs) + len(facts)
+
+
+# ---------------------------------------------------------------------------
+# File d'attente
+
+def _drain() -> int:
+    # DELETE ... RETURNING prend le verrou d'écriture avant de lire la file :
+    # aucune marque posée entre la lecture et la suppression ne peut être perdue.
+    targets = db.session.execute(text("DELETE FROM alerte_a_evaluer RETURNING cible_type, cible_id")).all()
+    return _evaluate([(t, int(i)) for t, i in targets])
+
+
+def sync_alertes() -> int:
+    """Réévalue les cibles marquées depuis le dernier passage. Retourne leur nombre.
+
+    Si la base est occupée, les alertes déjà stockées sont servies telles quelles :
+    la file reste en place pour le prochain passage.
+    """
+    pending = db.session.execute(text("SELECT 1 FROM alerte_a_evaluer LIMIT 1")).first()
+    if pending is None:
+        return 0
+    try:
+        return run_write(_drain)
+    except WriteBusyError:
+        log.warning("Alertes : base occupée, réévaluation reportée")
+        return 0
+
+
+def install_alertes_sync(app) -> None:
+    """Vide la file en fin de requête d'écriture réussie (les GET restent en lecture seule).
+
+    Ce qui reste non commité dans la session à ce stade est abandonné d'abord :
+    le commit de `run_write` ne doit enregistrer que la réévaluation des alertes.
+    """
+
+    @app.after_request
+    def _sync_after_write(response):
+        if request.method in ("GET", "HEAD", "OPTIONS") or response.status_code >= 400:
+            return response
+        try:
+            db.session.rollback()
+            sync_alertes()
+        except Exception:
+            db.session.rollback()
+            log.exception("Alertes : réévaluation en fin de requête en échec")
+        return response
+
+
+def rebuild_alertes() -> int:
+    """Réévalue toutes les subventions et factures (installation, contrôle)."""
+    db.session.execute(text(
+        "INSERT OR IGNORE INTO alerte_a_evaluer(cible_type, cible_id) SELECT 'subvention', id FROM subvention"
+    ))
+    db.session.execute(text(
+        "INSERT OR IGNORE INTO alerte_a_evaluer(cible_type, cible_id) SELECT 'facture', id FROM facture_achat"
+    ))
+    # cibles disparues (suppression avant la pose des triggers)
+    db.session.execute(text(
+        "INSERT OR IGNORE INTO alerte_a_evaluer(cible_type, cible_id) SELECT cible_type, cible_id FROM alerte"
+    ))
+    n = _drain()
+    db.session.commit()
+    return n
+
+
+def ensure_alertes() -> None:
+    """Pose les triggers (à appeler après create_all) ; évalue tout au premier passage."""
+    try:
+        existing = {
+            row[0]
+            for row in db.session.execute(
+                text("SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE 'alerte_%'")
+            ).all()
+        }
+        for sql in _TRIGGERS:
+            db.session.execute(text(sql))
+        db.session.commit()
+        if not existing:
+            rebuild_alertes()
+    except Exception:
+        db.session.rollback()
+
+
+# ---------------------------------------------------------------------------
+# Lecture
+
+def alertes_subventions(regles: Sequence[str], subvention_ids=None, secteur: Optional[str] = None,
+                        limit: Optional[int] = None) -> List[Alerte]:
+    """Alertes actives des subventions, par subvention puis dans l'ordre des règles.
+
+    `subvention_ids` : liste ou SELECT d'ids (périmètre filtré de la page).
+    """
+    q = Alerte.query.filter(Alerte.cible_type == "subvention", Alerte.regle.in_(regles))
+    if subvention_ids is not None:
+        q = q.filter(Alerte.cible_id.in_(subvention_ids))
+    if secteur is not None:
+        q = q.filter(Alerte.secteur == secteur)
+    order = {r: i for i, r in enumerate(REGLES)}
+    rows = sorted(q.all(), key=lambda a: (a.cible_id, order.get(a.regle, 99)))
+    return rows[:limit] if limit is not None else rows
+
+
+def count_alertes(regle: str, annee: Optional[int] = None, secteurs: Optional[List[str]] = None) -> int:
+    """Nombre d'alertes actives d'une règle (`secteurs=None` : tous)."""
+    q = db.session.query(db.func.count(Alerte.id)).filter(Alerte.regle == regle)
+    if annee is not None:
+        q = q.filter(Alerte.annee == annee)
+    if secteurs is not None:
+        q = q.filter(Alerte.secteur.in_(secteurs))
+    return int(q.scalar() or 0)
@@ -0,0 +1,50 @@
+"""Exports CSV en flux (Excel : UTF-8 avec BOM, séparateur ';', virgule décimale).
+
+Le fichier est produit ligne à ligne depuis un itérable (typiquement une requête
+colonnes `yield_per`) et envoyé par paquets : pas de Content-Length, donc envoi
+en chunked ; le téléchargement démarre tout de suite et la mémoire reste plate
+quel que soit le nombre de lignes.
+"""
+from __future__ import annotations
+
+import csv
+from io import StringIO
+from typing import Any, Iterable, Iterator, Sequence
+
+from flask import Response, stream_with_context
+
+BOM = "\ufeff"
+ROWS_PER_CHUNK = 500
+
+
+def fr_amount(value: Any) -> str:
+    """Montant au format français : 1234,50."""
+    return f"{float(value or 0):.2f}".replace(".", ",")
+
+
+def iter_csv(header: Sequence[Any], rows: Iterable[Sequence[Any]], delimiter: str = ";",
+             rows_per_chunk: int = ROWS_PER_CHUNK) -> Iterator[bytes]:
+    """Octets du fichier (BOM + en-tête, puis paquets de `rows_per_chunk` lignes)."""
+    buf = StringIO()
+    writer = csv.writer(buf, delimiter=delimiter)
+    buf.write(BOM)
+    writer.writerow(header)
+    n = 0
+    for row in rows:
+        writer.writerow(row)
+        n += 1
+        if n % rows_per_chunk == 0:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode("utf-8")
+
+
+def csv_response(filename: str, header: Sequence[Any], rows: Iterable[Sequence[Any]],
+                 delimiter: str = ";") -> Response:
+    """Réponse CSV en flux ; `rows` est consommé pendant l'envoi (contexte de requête conservé)."""
+    return Response(
+        stream_with_context(iter_csv(header, rows, delimiter=delimiter)),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
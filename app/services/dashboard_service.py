@@ -1,14 +1,34 @@
+"""Contexte du dashboard (page d'accueil après connexion).
+
+Les données (KPIs, alertes, séries mensuelles, récents) dépendent seulement du
+périmètre : (rôle, secteur, fenêtre en jours). Elles sont calculées en SQL
+groupé (une requête par série, sommes par mois côté SQLite) puis mises en cache
+en mémoire par périmètre :
+- une entrée sert tant qu'elle a moins de DASHBOARD_CACHE_TTL secondes et que
+  les versions de données (services/data_version.py) n'ont pas bougé ;
+- `start_refresher(app)` (lancé par run_waitress.py) recalcule en tâche de fond
+  les périmètres consultés récemment, pour que la première page après connexion
+  soit servie depuis le cache.
+
+Le cache ne contient que des valeurs simples (pas d'objets ORM) ; les URLs sont
+construites à chaque requête.
+"""
 from __future__ import annotations
 
-from dataclasses import dataclass
+import logging
+import threading
+import time
 from datetime import date, datetime, timedelta
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
-from flask import url_for
+from flask import current_app, url_for
 from werkzeug.routing import BuildError
 from sqlalchemy import func
 
 from app.extensions import db
+from app.services.alertes import REGLES_DASHBOARD, alertes_subventions, sync_alertes
+from app.services.data_version import data_versions
+from app.services.finance_snapshot import FinanceSnapshot
 from app.models import (
     Subvention,
     Depense,
@@ -18,9 +38,15 @@ from app.models import (
     Participant,
 )
 
+log = logging.getLogger(__name__)
 
-def _month_key(d: date) -> str:
-    return f"{d.year:04d}-{d.month:02d}"
+CACHE_TTL_SECONDS = 120
+REFRESH_SECONDS = 60
+# un périmètre non consulté depuis ce délai n'est plus rafraîchi
+REFRESH_IDLE_SECONDS = 3600
+CACHE_MAX_ENTRIES = 64
+
+PUBLIC_KEYS = ("H", "S", "B", "A", "P", "?")
 
 
 def _last_n_months(n: int, today: date | None = None) -> List[Tuple[int, int]]:
@@ -37,141 +63,100 @@ def _last_n_months(n: int, today: date | None = None) -> List[Tuple[int, int]]:
     return out
 
 
-def build_dashboard_context(user, *, days: int = 90) -> Dict[str, Any]:
-    """Construit un contexte riche pour le dashboard.
 
-    - Ne modifie pas la DB.
-    - Doit rester robuste : aucune url_for sur une route à paramètres obligatoires.
-    """
 
-    def _safe(endpoint: str, fallback: str = "#", **values) -> str:
-        try:
-            return url_for(endpoint, **values)
-        except BuildError:
-            return fallback
+def _month_expr(col):
+    return func.strftime("%Y-%m", col)
 
-    if user.role == "admin_tech":
-        return {
-            "mode": "admin_tech",
-            "kpis": {},
-            "alerts": [],
-            "shortcuts": [
-                {"label": "Gérer l’équipe", "url": _safe("admin.users"), "icon": "🛠️"},
-            ],
-            "recents": {"depenses": [], "sessions": [], "participants": []},
-            "charts": {},
-            "days": days,
-        }
 
-    # --- périmètre ---
-    subs_q = Subvention.query.filter_by(est_archive=False)
-    if user.role == "responsable_secteur":
-        subs_q = subs_q.filter(Subvention.secteur == user.secteur_assigne)
-    subs = subs_q.all()
-
-    # --- KPIs budget (déjà calculés via propriétés sur Subvention) ---
-    total_attribue = sum(float(s.montant_attribue or 0) for s in subs)
-    total_recu = sum(float(s.montant_recu or 0) for s in subs)
-    total_engage = sum(float(s.total_engage or 0) for s in subs)
-    total_reste = sum(float(s.total_reste or 0) for s in subs)
+def compute_dashboard_data(role: str, secteur: Optional[str], days: int = 90) -> Dict[str, Any]:
+    """Données du dashboard pour un périmètre (lecture seule, valeurs simples)."""
+    scoped = role == "responsable_secteur"
+
+    # --- périmètre budget ---
+    subs_q = db.session.query(Subvention.id).filter(Subvention.est_archive.is_(False))
+    if scoped:
+        subs_q = subs_q.filter(Subvention.secteur == secteur)
+
+    # --- KPIs budget (instantané ensembliste : une requête groupée) ---
+    fin = FinanceSnapshot.load(subvention_ids=[sid for (sid,) in subs_q])
+    tot = fin.total()
+    total_attribue = tot.montant_attribue
+    total_engage = tot.total_engage
     taux = 0.0
     if total_attribue > 0:
         taux = round((total_engage / total_attribue) * 100, 1)
 
-    # --- Alertes (pilotage) ---
-    alerts: List[Dict[str, Any]] = []
-    for s in subs:
-        recu = float(s.montant_recu or 0)
-        reel_lignes = float(s.total_reel_lignes or 0)
-        engage = float(s.total_engage or 0)
-        reste = float(s.total_reste or 0)
-
-        # reçu mais pas ventilé
-        if recu > 0 and reel_lignes == 0:
-            alerts.append({
-                "level": "danger",
-                "text": f"{s.nom} : reçu {recu:.2f}€ mais lignes réel = 0€ (ventilation manquante).",
-                "url": _safe("main.subvention_pilotage", subvention_id=s.id),
-            })
-        # engagé > réel lignes
-        if reel_lignes > 0 and engage > reel_lignes:
-            alerts.append({
-                "level": "danger",
-                "text": f"{s.nom} : engagé {engage:.2f}€ > lignes réel {reel_lignes:.2f}€ (dépassement).",
-                "url": _safe("main.subvention_pilotage", subvention_id=s.id),
-            })
-        # proche du plafond
-        if float(s.montant_attribue or 0) > 0:
-            pct = (engage / float(s.montant_attribue or 0)) * 100
-            if pct >= 80:
-                alerts.append({
-                    "level": "warning",
-                    "text": f"{s.nom} : {pct:.0f}% consommé (reste {reste:.2f}€).",
-                    "url": _safe("main.subvention_pilotage", subvention_id=s.id),
-                })
+    # --- Alertes (pilotage, table `alerte` tenue à jour par services/alertes.py) ---
+    alerts = [
+        {"level": a.niveau, "text": a.message, "subvention_id": a.cible_id}
+        for a in alertes_subventions(REGLES_DASHBOARD, secteur=secteur if scoped else None, limit=12)
+    ]
 
     # --- Activité (fenêtre) ---
     since = datetime.utcnow() - timedelta(days=days)
 
-    # Sessions / présences / uniques
-    sessions_q = SessionActivite.query.filter_by(is_deleted=False)
-    pres_q = PresenceActivite.query
-    if user.role == "responsable_secteur":
-        sessions_q = sessions_q.filter(SessionActivite.secteur == user.secteur_assigne)
-        pres_q = pres_q.join(SessionActivite).filter(SessionActivite.secteur == user.secteur_assigne)
+    sessions_q = SessionActivite.query.filter(SessionActivite.is_deleted.is_(False))
+    if scoped:
+        sessions_q = sessions_q.filter(SessionActivite.secteur == secteur)
 
     sessions_recent = sessions_q.filter(SessionActivite.created_at >= since).count()
-    uniques_recent = pres_q.join(Participant).filter(PresenceActivite.created_at >= since).with_entities(Participant.id).distinct().count()
 
-    # --- Graphiques ---
+    # Participants uniques par type_public : chaque participant n'a qu'un type,
+    # la somme des comptes distincts donne donc le nombre d'uniques.
+    pub_q = (
+        db.session.query(Participant.type_public, func.count(func.distinct(Participant.id)))
+        .select_from(PresenceActivite)
+        .join(Participant, Participant.id == PresenceActivite.participant_id)
+        .filter(PresenceActivite.created_at >= since)
+    )
+    if scoped:
+        pub_q = (
+            pub_q.join(SessionActivite, SessionActivite.id == PresenceActivite.session_id)
+            .filter(SessionActivite.secteur == secteur)
+        )
+    pub_counts = dict.fromkeys(PUBLIC_KEYS, 0)
+    for tp, n in pub_q.group_by(Participant.type_public).all():
+        key = (tp or "?").strip().upper()
+        if key not in pub_counts:
+            key = "?"
+        pub_counts[key] += int(n or 0)
+    uniques_recent = sum(pub_counts.values())
+
+    # --- Graphiques : séries des 6 derniers mois, groupées en SQL ---
     months = _last_n_months(6)
     month_labels = [f"{y}-{m:02d}" for (y, m) in months]
+    first_month = month_labels[0]
+    last_month = month_labels[-1]
 
     # Dépenses par mois (date_paiement sinon created_at)
-    dep_q = Depense.query.filter_by(est_supprimee=False)
-    if user.role == "responsable_secteur":
+    dep_q = Depense.query.filter(Depense.est_supprimee.is_(False))
+    if scoped:
         # LigneBudget n'a pas de colonne 'secteur' : le secteur est porté par la
         # Subvention (et/ou par les Projets). On filtre donc via Subvention.secteur.
         dep_q = (
             dep_q.join(LigneBudget)
             .join(Subvention, LigneBudget.subvention_id == Subvention.id)
-            .filter(Subvention.secteur == user.secteur_assigne)
+            .filter(Subvention.secteur == secteur)
         )
-    dep_rows = dep_q.with_entities(Depense.montant, Depense.date_paiement, Depense.created_at).all()
-
-    dep_by_month = {k: 0.0 for k in month_labels}
-    for montant, date_paiement, created_at in dep_rows:
-        d = date_paiement or (created_at.date() if created_at else None)
-        if not d:
-            continue
-        mk = _month_key(d)
-        if mk in dep_by_month:
-            dep_by_month[mk] += float(montant or 0)
-
-    # Sessions par mois (réalisées / créées)
-    sess_rows = sessions_q.with_entities(SessionActivite.created_at).all()
-    sess_by_month = {k: 0 for k in month_labels}
-    for (created_at,) in sess_rows:
-        if not created_at:
-            continue
-        mk = _month_key(created_at.date())
-        if mk in sess_by_month:
-            sess_by_month[mk] += 1
-
-    # Répartition des participants (uniques) par type_public sur la période
-    pub_counts = {"H": 0, "S": 0, "B": 0, "A": 0, "P": 0, "?": 0}
-    pub_rows = (
-        pres_q.join(Participant)
-        .filter(PresenceActivite.created_at >= since)
-        .with_entities(Participant.id, Participant.type_public)
-        .distinct()
-        .all()
-    )
-    for _pid, tp in pub_rows:
-        key = (tp or "?").strip().upper()
-        if key not in pub_counts:
-            key = "?"
-        pub_counts[key] += 1
+    dep_month = _month_expr(func.coalesce(Depense.date_paiement, Depense.created_at))
+    dep_by_month = dict.fromkeys(month_labels, 0.0)
+    dep_by_month.update({
+        mk: float(total or 0)
+        for mk, total in dep_q.with_entities(dep_month, func.sum(Depense.montant))
+        .filter(dep_month.between(first_month, last_month))
+        .group_by(dep_month)
+    })
+
+    # Sessions par mois (créées)
+    sess_month = _month_expr(SessionActivite.created_at)
+    sess_by_month = dict.fromkeys(month_labels, 0)
+    sess_by_month.update({
+        mk: int(n or 0)
+        for mk, n in sessions_q.with_entities(sess_month, func.count(SessionActivite.id))
+        .filter(sess_month.between(first_month, last_month))
+        .group_by(sess_month)
+    })
 
     charts = {
         "budget_donut": {
@@ -188,42 +173,42 @@ def build_dashboard_context(user, *, days: int = 90) -> Dict[str, Any]:
         },
         "public_pie": {
             "labels": ["Habitants", "Seniors", "Bénévoles", "Allophones", "Parents", "Autre"],
-            "values": [pub_counts["H"], pub_counts["S"], pub_counts["B"], pub_counts["A"], pub_counts["P"], pub_counts["?"]],
+            "values": [pub_counts[k] for k in PUBLIC_KEYS],
         },
     }
 
-    # --- récents ---
-    recent_depenses = dep_q.order_by(Depense.created_at.desc()).limit(6).all()
-    recent_sessions = sessions_q.order_by(SessionActivite.created_at.desc()).limit(6).all()
-    recent_participants_q = Participant.query
-    if user.role == "responsable_secteur":
-        recent_participants_q = recent_participants_q.filter(Participant.created_secteur == user.secteur_assigne)
-    recent_participants = recent_participants_q.order_by(Participant.created_at.desc()).limit(6).all()
-
-    shortcuts = [
-        {"label": "Nouvelle dépense", "url": _safe("budget.depense_new"), "icon": "➕"},
-        # route à paramètres -> on renvoie vers la liste des ateliers
-        {"label": "Nouvelle session", "url": _safe("activite.index"), "icon": "📅"},
-        {"label": "Participants", "url": _safe("activite.participants", fallback=_safe("activite.index")), "icon": "👥"},
-        {"label": "Inventaire", "url": _safe("inventaire_materiel.list_items"), "icon": "📦"},
-        {"label": "Données activités", "url": _safe("statsimpact.dashboard"), "icon": "📊"},
-        {"label": "Stats & bilans", "url": _safe("main.stats_bilans", fallback=_safe("main.dashboard")), "icon": "🧾"},
+    # --- récents (colonnes affichées seulement) ---
+    recent_depenses = [
+        {"libelle": libelle, "montant": montant}
+        for libelle, montant in dep_q.with_entities(Depense.libelle, Depense.montant)
+        .order_by(Depense.created_at.desc()).limit(6)
+    ]
+    recent_sessions = [
+        {"atelier_id": aid, "session_type": stype, "date_session": ds, "rdv_date": rd}
+        for aid, stype, ds, rd in sessions_q.with_entities(
+            SessionActivite.atelier_id, SessionActivite.session_type,
+            SessionActivite.date_session, SessionActivite.rdv_date,
+        ).order_by(SessionActivite.created_at.desc()).limit(6)
+    ]
+    part_q = db.session.query(Participant.nom, Participant.prenom)
+    if scoped:
+        part_q = part_q.filter(Participant.created_secteur == secteur)
+    recent_participants = [
+        {"nom": nom, "prenom": prenom}
+        for nom, prenom in part_q.order_by(Participant.created_at.desc()).limit(6)
     ]
 
     return {
-        "mode": user.role,
-        "days": days,
         "kpis": {
             "attribue": round(total_attribue, 2),
-            "recu": round(total_recu, 2),
+            "recu": round(tot.montant_recu, 2),
             "engage": round(total_engage, 2),
-            "reste": round(total_reste, 2),
+            "reste": round(tot.total_reste, 2),
             "taux": taux,
             "sessions": sessions_recent,
             "uniques": uniques_recent,
         },
-        "alerts": alerts[:12],
-        "shortcuts": shortcuts,
+        "alerts": alerts,
         "recents": {
             "depenses": recent_depenses,
             "sessions": recent_sessions,
@@ -231,3 +216,147 @@ def build_dashboard_context(user, *, days: int = 90) -> Dict[str, Any]:
         },
         "charts": charts,
     }
+
+
+# ---------------------------------------------------------------------------
+# Cache par périmètre
+
+_lock = threading.Lock()
+# (rôle, secteur, jours) -> (horodatage, versions, données)
+_cache: Dict[Tuple[str, Optional[str], int], Tuple[float, Dict[str, int], Dict[str, Any]]] = {}
+# (rôle, secteur, jours) -> dernière consultation
+_seen: Dict[Tuple[str, Optional[str], int], float] = {}
+_refresher: Optional[threading.Thread] = None
+
+
+def _scope_key(user, days: int) -> Tuple[str, Optional[str], int]:
+    secteur = user.secteur_assigne if user.role == "responsable_secteur" else None
+    return (user.role, secteur, int(days))
+
+
+def _ttl() -> float:
+    try:
+        return float(current_app.config.get("DASHBOARD_CACHE_TTL", CACHE_TTL_SECONDS))
+    except RuntimeError:
+        return CACHE_TTL_SECONDS
+
+
+def _store(key, versions: Dict[str, int]) -> Dict[str, Any]:
+    data = compute_dashboard_data(*key)
+    with _lock:
+        if key not in _cache and len(_cache) >= CACHE_MAX_ENTRIES:
+            _cache.clear()
+        _cache[key] = (time.monotonic(), versions, data)
+    return data
+
+
+def dashboard_data(role: str, secteur: Optional[str], days: int = 90) -> Dict[str, Any]:
+    """Données du périmètre, depuis le cache si elles sont encore valables."""
+    key = (role, secteur, int(days))
+    versions = data_versions()
+    now = time.monotonic()
+    with _lock:
+        _seen[key] = now
+        hit = _cache.get(key)
+    if hit and hit[1] == versions and (now - hit[0]) < _ttl():
+        return hit[2]
+    return _store(key, versions)
+
+
+def clear_cache() -> None:
+    with _lock:
+        _cache.clear()
+
+
+def refresh_recent_scopes() -> int:
+    """Recalcule les périmètres consultés récemment ; retourne leur nombre."""
+    now = time.monotonic()
+    with _lock:
+        for key in [k for k, t in _seen.items() if now - t > REFRESH_IDLE_SECONDS]:
+            del _seen[key]
+            _cache.pop(key, None)
+        keys = list(_seen)
+    # écritures hors requête (CLI, imports) : la file des alertes est vidée ici
+    sync_alertes()
+    versions = data_versions()
+    for key in keys:
+        _store(key, versions)
+    return len(keys)
+
+
+def start_refresher(app) -> None:
+    """Lance le thread de rafraîchissement (DASHBOARD_REFRESH_SECONDS, 0 = désactivé)."""
+    global _refresher
+    interval = float(app.config.get("DASHBOARD_REFRESH_SECONDS", REFRESH_SECONDS) or 0)
+    if interval <= 0 or _refresher is not None:
+        return
+
+    def _loop():
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    refresh_recent_scopes()
+                except Exception:
+                    log.exception("Rafraîchissement du dashboard en échec")
+                finally:
+                    db.session.remove()
+
+    _refresher = threading.Thread(target=_loop, name="dashboard-refresher", daemon=True)
+    _refresher.start()
+
+
+# ---------------------------------------------------------------------------
+
+def build_dashboard_context(user, *, days: int = 90) -> Dict[str, Any]:
+    """Construit un contexte riche pour le dashboard.
+
+    - Ne modifie pas la DB.
+    - Doit rester robuste : aucune url_for sur une route à paramètres obligatoires.
+    """
+
+    def _safe(endpoint: str, fallback: str = "#", **values) -> str:
+        try:
+            return url_for(endpoint, **values)
+        except BuildError:
+            return fallback
+
+    if user.role == "admin_tech":
+        return {
+            "mode": "admin_tech",
+            "kpis": {},
+            "alerts": [],
+            "shortcuts": [
+                {"label": "Gérer l’équipe", "url": _safe("admin.users"), "icon": "🛠️"},
+            ],
+            "recents": {"depenses": [], "sessions": [], "participants": []},
+            "charts": {},
+            "days": days,
+        }
+
+    data = dashboard_data(*_scope_key(user, days))
+
+    alerts = [
+        dict(a, url=_safe("main.subvention_pilotage", subvention_id=a["subvention_id"]))
+        for a in data["alerts"]
+    ]
+
+    shortcuts = [
+        {"label": "Nouvelle dépense", "url": _safe("budget.depense_new"), "icon": "➕"},
+        # route à paramètres -> on renvoie vers la liste des ateliers
+        {"label": "Nouvelle session", "url": _safe("activite.index"), "icon": "📅"},
+        {"label": "Participants", "url": _safe("activite.participants", fallback=_safe("activite.index")), "icon": "👥"},
+        {"label": "Inventaire", "url": _safe("inventaire_materiel.list_items"), "icon": "📦"},
+        {"label": "Données activités", "url": _safe("statsimpact.dashboard"), "icon": "📊"},
+        {"label": "Stats & bilans", "url": _safe("main.stats_bilans", fallback=_safe("main.dashboard")), "icon": "🧾"},
+    ]
+
+    return {
+        "mode": user.role,
+        "days": days,
+        "kpis": data["kpis"],
+        "alerts": alerts,
+        "shortcuts": shortcuts,
+        "recents": data["recents"],
+        "charts": data["charts"],
+    }
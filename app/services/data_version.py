@@ -0,0 +1,65 @@
+"""Versions de données par domaine, pour invalider les caches de calcul.
+
+Table `data_version` (name, version) : chaque écriture sur les tables d'un
+domaine incrémente son compteur via un trigger SQLite, dans la même transaction.
+Un cache indexé par la version ne peut donc pas servir un résultat périmé, même
+après une écriture hors ORM (imports, fusion, kiosque) ou depuis un autre
+processus. Lire les versions coûte une requête.
+
+- "activite" : sessions, présences, liens projet <-> atelier ;
+- "finance"  : subventions, lignes, dépenses, liens subvention <-> projet ;
+- "achats"   : factures, lignes de facture, inventaire ;
+- "projets"  : projets et paramètres de leurs indicateurs.
+"""
+from __future__ import annotations
+
+from typing import Dict
+
+from sqlalchemy import text
+
+from app.extensions import db
+from app.models import DataVersion
+
+
+DOMAINS = {
+    "activite": ("session_activite", "presence_activite", "projet_atelier"),
+    # dépenses : statut, dates, imputation (l'engagé passe aussi par ligne_budget.engage_cache)
+    "finance": ("subvention", "ligne_budget", "subvention_projet", "depense"),
+    "achats": ("facture_achat", "facture_ligne", "inventaire_item"),
+    "projets": ("projet", "projet_indicateur"),
+}
+
+
+def _triggers():
+    for domain, tables in DOMAINS.items():
+        bump = f"UPDATE data_version SET version = version + 1 WHERE name = '{domain}';"
+        for table in tables:
+            for op, suffix in (("INSERT", "ai"), ("UPDATE", "au"), ("DELETE", "ad")):
+                yield (
+                    f"CREATE TRIGGER IF NOT EXISTS data_version_{table}_{suffix} AFTER {op} ON {table}"
+                    f" BEGIN {bump} END"
+                )
+
+
+def ensure_data_version() -> None:
+    """Crée les compteurs et pose les triggers (après create_all)."""
+    try:
+        for domain in DOMAINS:
+            db.session.execute(
+                text("INSERT OR IGNORE INTO data_version(name, version) VALUES (:n, 0)"), {"n": domain}
+            )
+        for sql in _triggers():
+            db.session.execute(text(sql))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+
+
+def data_versions() -> Dict[str, int]:
+    return {name: int(v or 0) for name, v in db.session.query(DataVersion.name, DataVersion.version)}
+
+
+def data_version(domain: str) -> int:
+    return int(
+        db.session.query(DataVersion.version).filter(DataVersion.name == domain).scalar() or 0
+    )
@@ -0,0 +1,117 @@
+"""Écritures SQLite sous concurrence (kiosque, émargements, 12 threads waitress).
+
+- `install_sqlite_pragmas(engine)` : WAL + busy_timeout posés à chaque connexion
+  (les lecteurs ne bloquent plus l'écrivain, un écrivain attend au lieu d'échouer).
+- `run_write(fn)` : exécute fn() puis commit, et rejoue avec backoff si SQLite
+  répond "database is locked". Une IntegrityError (vrai doublon) n'est JAMAIS
+  rejouée : elle remonte telle quelle à l'appelant.
+- `run_write(fn, serialize=True)` : en plus, chaque tentative passe par un
+  verrou de processus (émargements : évite la course au verrou fichier entre
+  threads). Le verrou est pris par tentative, avec délai d'attente, et jamais
+  gardé pendant le backoff ; s'il n'est pas obtenu, la tentative compte comme
+  un verrou SQLite.
+"""
+from __future__ import annotations
+
+import random
+import threading
+import time
+from typing import Callable, TypeVar
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+from app.extensions import db
+
+
+T = TypeVar("T")
+
+DEFAULT_BUSY_TIMEOUT_MS = 10000
+DEFAULT_ATTEMPTS = 5
+DEFAULT_BASE_DELAY = 0.05
+DEFAULT_WRITER_LOCK_TIMEOUT = 2.0
+
+_LOCK_MESSAGES = ("database is locked", "database table is locked", "database is busy")
+
+_writer_lock = threading.RLock()
+
+
+class WriteBusyError(RuntimeError):
+    """La base est restée verrouillée malgré les tentatives (à présenter comme 'réessaie')."""
+
+
+def install_sqlite_pragmas(engine, busy_timeout_ms: int = DEFAULT_BUSY_TIMEOUT_MS, wal: bool = True) -> None:
+    """Branche les PRAGMA SQLite sur l'événement 'connect' du moteur."""
+
+    @event.listens_for(engine, "connect")
+    def _sqlite_on_connect(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        try:
+            cur.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+            if wal:
+                # ignoré pour une base :memory: (le mode reste "memory")
+                cur.execute("PRAGMA journal_mode = WAL")
+                cur.execute("PRAGMA synchronous = NORMAL")
+        finally:
+            cur.close()
+
+
+def is_lock_error(exc: BaseException) -> bool:
+    """True si l'exception est un verrou SQLite transitoire (à rejouer)."""
+    if not isinstance(exc, OperationalError):
+        return False
+    msg = str(getattr(exc, "orig", exc) or "").lower()
+    return any(m in msg for m in _LOCK_MESSAGES)
+
+
+class _WriterLockTimeout(Exception):
+    """Verrou d'écrivain du processus non obtenu à temps (traité comme un verrou SQLite)."""
+
+
+def _attempt(fn: Callable[[], T], serialize: bool, lock_timeout: float) -> T:
+    if not serialize:
+        result = fn()
+        db.session.commit()
+        return result
+    if not _writer_lock.acquire(timeout=lock_timeout):
+        raise _WriterLockTimeout()
+    try:
+        result = fn()
+        db.session.commit()
+        return result
+    finally:
+        _writer_lock.release()
+
+
+def run_write(fn: Callable[[], T], attempts: int | None = None, base_delay: float | None = None,
+              serialize: bool = False) -> T:
+    """Exécute `fn()` puis `db.session.commit()`, avec rejeu sur verrou SQLite.
+
+    `fn` doit être rejouable : après un rollback, les objets ajoutés sont détachés,
+    donc fn() doit (re)construire et ajouter ses objets à chaque appel.
+    `serialize=True` : chaque tentative prend le verrou d'écrivain du processus.
+    Lève WriteBusyError si la base reste verrouillée ; laisse passer IntegrityError.
+    """
+    if attempts is None:
+        attempts = int(current_app.config.get("SQLITE_WRITE_ATTEMPTS", DEFAULT_ATTEMPTS))
+    if base_delay is None:
+        base_delay = float(current_app.config.get("SQLITE_WRITE_BASE_DELAY", DEFAULT_BASE_DELAY))
+    lock_timeout = float(current_app.config.get("SQLITE_WRITER_LOCK_TIMEOUT", DEFAULT_WRITER_LOCK_TIMEOUT))
+
+    for attempt in range(1, attempts + 1):
+        try:
+            return _attempt(fn, serialize, lock_timeout)
+        except (OperationalError, _WriterLockTimeout) as exc:
+            db.session.rollback()
+            if isinstance(exc, OperationalError) and not is_lock_error(exc):
+                raise
+            if attempt >= attempts:
+                current_app.logger.warning("Écriture abandonnée après %s tentatives : base verrouillée", attempts)
+                raise WriteBusyError("Base occupée, réessaie dans un instant.") from exc
+            # backoff exponentiel + gigue pour désynchroniser les threads (verrou relâché)
+            time.sleep(base_delay * (2 ** (attempt - 1)) * (0.5 + random.random()))
+        except Exception:
+            db.session.rollback()
+            raise
+    raise WriteBusyError("Base occupée, réessaie dans un instant.")
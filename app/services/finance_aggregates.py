@@ -0,0 +1,171 @@
+"""Agrégats financiers en SQL groupé (vue `main.stats`).
+
+Là où `FinanceSnapshot` rapatrie une ligne par ligne budgétaire, ces fonctions
+laissent SQLite faire les sommes : une requête par axe (compte, secteur, projet,
+total), quel que soit le nombre de subventions, de lignes ou de dépenses.
+L'engagé provient de `ligne_budget.engage_cache` (voir budget/engagement.py).
+
+Mêmes règles que les propriétés du modèle : engagé et reste ne concernent que
+les lignes de charge ; engagé et reste sont arrondis au centime par ligne avant
+d'être sommés, les cumuls par subvention aussi, puis les totaux.
+
+Toutes les fonctions prennent `sub_ids`, un SELECT d'ids de subventions (le
+périmètre filtré de la vue), utilisé en `IN (SELECT ...)`.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import case, func
+
+from app.extensions import db
+from app.models import LigneBudget, Subvention, SubventionProjet
+
+
+def _r(v: Any) -> float:
+    return round(float(v or 0), 2)
+
+
+def _charge(expr):
+    return case((LigneBudget.nature == "charge", expr), else_=0.0)
+
+
+def _ligne_values():
+    reel = func.coalesce(LigneBudget.montant_reel, 0.0)
+    engage = func.round(func.coalesce(LigneBudget.engage_cache, 0.0), 2)
+    return reel, engage, func.round(reel - engage, 2)
+
+
+def _lignes_par_sub():
+    """Sous-requête : cumuls des lignes par subvention."""
+    reel, engage, reste = _ligne_values()
+    return (
+        db.select(
+            LigneBudget.subvention_id.label("sid"),
+            func.round(func.sum(_charge(reel)), 2).label("reel_lignes"),
+            func.round(func.sum(_charge(engage)), 2).label("engage"),
+            func.round(func.sum(_charge(reste)), 2).label("reste"),
+        )
+        .group_by(LigneBudget.subvention_id)
+        .subquery()
+    )
+
+
+def _sub_columns(agg):
+    return (
+        func.sum(func.coalesce(Subvention.montant_demande, 0.0)),
+        func.sum(func.coalesce(Subvention.montant_attribue, 0.0)),
+        func.sum(func.coalesce(Subvention.montant_recu, 0.0)),
+        func.sum(func.coalesce(agg.c.reel_lignes, 0.0)),
+        func.sum(func.coalesce(agg.c.engage, 0.0)),
+        func.sum(func.coalesce(agg.c.reste, 0.0)),
+    )
+
+
+_KEYS = ("demande", "attribue", "recu", "reel_lignes", "engage", "reste")
+
+
+def totals(sub_ids) -> Dict[str, float]:
+    agg = _lignes_par_sub()
+    row = (
+        db.session.query(*_sub_columns(agg))
+        .select_from(Subvention)
+        .outerjoin(agg, agg.c.sid == Subvention.id)
+        .filter(Subvention.id.in_(sub_ids))
+        .one()
+    )
+    return {k: _r(v) for k, v in zip(_KEYS, row)}
+
+
+def by_secteur(sub_ids) -> Dict[str, Dict[str, float]]:
+    agg = _lignes_par_sub()
+    rows = (
+        db.session.query(Subvention.secteur, *_sub_columns(agg))
+        .outerjoin(agg, agg.c.sid == Subvention.id)
+        .filter(Subvention.id.in_(sub_ids))
+        .group_by(Subvention.secteur)
+        .order_by(Subvention.secteur.asc())
+        .all()
+    )
+    return {sec: {k: _r(v) for k, v in zip(_KEYS, vals)} for sec, *vals in rows}
+
+
+def by_projet(projet_ids, annee: Optional[int] = None, exclude_archived: bool = False) -> Dict[int, Dict[str, float]]:
+    """Totaux par projet sur TOUTES ses subventions liées (comme `Projet.total_*`).
+
+    `annee` : celles d'un exercice ; `exclude_archived` : sans les subventions archivées.
+    """
+    agg = _lignes_par_sub()
+    q = (
+        db.session.query(SubventionProjet.projet_id, *_sub_columns(agg))
+        .join(Subvention, Subvention.id == SubventionProjet.subvention_id)
+        .outerjoin(agg, agg.c.sid == Subvention.id)
+        .filter(SubventionProjet.projet_id.in_(projet_ids))
+    )
+    if annee:
+        q = q.filter(Subvention.annee_exercice == annee)
+    if exclude_archived:
+        q = q.filter(Subvention.est_archive.is_(False))
+    rows = q.group_by(SubventionProjet.projet_id).all()
+    return {pid: {k: _r(v) for k, v in zip(_KEYS, vals)} for pid, *vals in rows}
+
+
+def by_compte(sub_ids) -> Dict[str, Dict[str, float]]:
+    """{compte: {reel, engage, reste}} ; le réel inclut les lignes de produit."""
+    reel, engage, reste = _ligne_values()
+    rows = (
+        db.session.query(
+            LigneBudget.compte,
+            func.sum(reel),
+            func.sum(_charge(engage)),
+            func.sum(_charge(reste)),
+        )
+        .filter(LigneBudget.subvention_id.in_(sub_ids))
+        .group_by(LigneBudget.compte)
+        .order_by(LigneBudget.compte.asc())
+        .all()
+    )
+    return {compte: {"reel": _r(r), "engage": _r(e), "reste": _r(x)} for compte, r, e, x in rows}
+
+
+def reel_par_nature(sub_ids) -> Dict[str, float]:
+    """{"charge": ..., "produit": ...} : total réel ventilé par nature de ligne."""
+    nature = func.lower(func.coalesce(LigneBudget.nature, ""))
+    rows = (
+        db.session.query(nature, func.sum(func.coalesce(LigneBudget.montant_reel, 0.0)))
+        .filter(LigneBudget.subvention_id.in_(sub_ids))
+        .group_by(nature)
+        .all()
+    )
+    out = {"charge": 0.0, "produit": 0.0}
+    out.update({n: _r(v) for n, v in rows})
+    return out
+
+
+def annees_disponibles() -> List[int]:
+    rows = (
+        db.session.query(Subvention.annee_exercice)
+        .filter(Subvention.est_archive.is_(False))
+        .distinct()
+        .order_by(Subvention.annee_exercice.desc())
+        .all()
+    )
+    return [a for (a,) in rows if a is not None]
+
+
+def reel_par_nature_par_projet(projet_ids, annee: Optional[int] = None) -> Dict[int, Dict[str, float]]:
+    """{projet_id: {"charge", "produit"}} : réel ventilé des subventions liées non archivées (année optionnelle)."""
+    nature = func.lower(func.coalesce(LigneBudget.nature, ""))
+    q = (
+        db.session.query(SubventionProjet.projet_id, nature, func.sum(func.coalesce(LigneBudget.montant_reel, 0.0)))
+        .join(Subvention, Subvention.id == SubventionProjet.subvention_id)
+        .join(LigneBudget, LigneBudget.subvention_id == SubventionProjet.subvention_id)
+        .filter(SubventionProjet.projet_id.in_(projet_ids))
+        .filter(Subvention.est_archive.is_(False))
+    )
+    if annee:
+        q = q.filter(Subvention.annee_exercice == annee)
+    out: Dict[int, Dict[str, float]] = {}
+    for pid, n, v in q.group_by(SubventionProjet.projet_id, nature).all():
+        out.setdefault(pid, {"charge": 0.0, "produit": 0.0})[n] = _r(v)
+    return out
@@ -0,0 +1,306 @@
+"""Instantané financier ensembliste : base / réel / engagé / reste.
+
+Les propriétés `Subvention.total_*`, `LigneBudget.engage/reste` et
+`Projet.total_*` parcourent `self.lignes` puis `self.depenses` : sur une liste de
+subventions, chaque page chargeait paresseusement toutes les lignes et toutes les
+dépenses, parfois plusieurs fois.
+
+Ici, une seule requête lit les lignes avec leur engagé dénormalisé
+(`engage_cache` / `nb_depenses`, tenus par triggers, voir budget/engagement.py),
+puis les cumuls par subvention, projet et secteur sont faits en Python sur ce
+résultat. Les règles (et les arrondis) sont celles des propriétés :
+
+- engagé / reste ne concernent que les lignes `nature == "charge"` ;
+- engagé d'une ligne = somme des dépenses non `est_supprimee`, arrondie au centime ;
+- les totaux de subvention somment les valeurs de ligne arrondies.
+
+Usage :
+
+    fin = FinanceSnapshot.load(subvention_ids=[s.id for s in subs])
+    fin.sub(s.id).total_engage ; fin.ligne(l.id).reste ; fin.projet(p.id).total_recu
+
+`projet_ids` ajoute les subventions liées à ces projets (totaux projet).
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from app.extensions import db
+from app.models import LigneBudget, Subvention, SubventionProjet
+
+
+@dataclass
+class LigneTotals:
+    id: int
+    subvention_id: int
+    nature: str
+    compte: str
+    libelle: str
+    montant_base: float = 0.0
+    montant_reel: float = 0.0
+    engage: float = 0.0
+    reste: float = 0.0
+    nb_depenses: int = 0
+
+
+@dataclass
+class SubTotals:
+    id: Optional[int] = None
+    secteur: str = ""
+    annee_exercice: Optional[int] = None
+    montant_demande: float = 0.0
+    montant_attribue: float = 0.0
+    montant_recu: float = 0.0
+    total_base_lignes: float = 0.0  # charges (compat propriétés)
+    total_reel_lignes: float = 0.0  # charges (compat propriétés)
+    total_base_produits: float = 0.0
+    total_reel_produits: float = 0.0
+    total_engage: float = 0.0
+    total_reste: float = 0.0
+    nb_depenses: int = 0
+
+    @property
+    def solde_base(self) -> float:
+        # Produits - Charges
+        return round(self.total_base_produits - self.total_base_lignes, 2)
+
+    @property
+    def solde_reel(self) -> float:
+        return round(self.total_reel_produits - self.total_reel_lignes, 2)
+
+    # alias courts (dicts des vues stats / bilan)
+    @property
+    def demande(self) -> float:
+        return self.montant_demande
+
+    @property
+    def attribue(self) -> float:
+        return self.montant_attribue
+
+    @property
+    def recu(self) -> float:
+        return self.montant_recu
+
+    @property
+    def reel_lignes(self) -> float:
+        return self.total_reel_lignes
+
+    @property
+    def engage(self) -> float:
+        return self.total_engage
+
+    @property
+    def reste(self) -> float:
+        return self.total_reste
+
+    def add(self, other: "SubTotals") -> None:
+        for attr in _SUM_FIELDS:
+            setattr(self, attr, getattr(self, attr) + getattr(other, attr))
+
+    def rounded(self, fields=None) -> "SubTotals":
+        for attr in (fields or _SUM_FIELDS):
+            if attr != "nb_depenses":
+                setattr(self, attr, round(getattr(self, attr), 2))
+        return self
+
+
+_LIGNE_FIELDS = (
+    "total_base_lignes", "total_reel_lignes", "total_base_produits", "total_reel_produits",
+    "total_engage", "total_reste",
+)
+_SUM_FIELDS = ("montant_demande", "montant_attribue", "montant_recu") + _LIGNE_FIELDS + ("nb_depenses",)
+
+
+@dataclass
+class ProjetTotals:
+    id: int
+    subvention_ids: List[int] = field(default_factory=list)
+    total_demande: float = 0.0
+    total_attribue: float = 0.0
+    total_recu: float = 0.0
+    total_reel_lignes: float = 0.0
+    total_engage: float = 0.0
+    total_reste: float = 0.0
+
+
+_EMPTY_SUB = SubTotals()
+
+
+class FinanceSnapshot:
+    """Totaux financiers d'un ensemble de subventions, calculés en une passe."""
+
+    def __init__(self) -> None:
+        self.lignes: Dict[int, LigneTotals] = {}
+        self.subs: Dict[int, SubTotals] = {}
+        self.projets: Dict[int, ProjetTotals] = {}
+        self._lignes_by_sub: Dict[int, List[LigneTotals]] = {}
+
+    # ------------------------------------------------------------------
+    @classmethod
+    def load(cls, subvention_ids: Optional[Iterable[int]] = None, projet_ids: Optional[Iterable[int]] = None,
+             all_subventions: bool = False) -> "FinanceSnapshot":
+        """Charge les subventions `subvention_ids` (+ celles liées à `projet_ids`).
+
+        `all_subventions=True` charge toute la base (pas de filtre d'id).
+        """
+        snap = cls()
+        projet_ids = [int(pid) for pid in (projet_ids or [])]
+
+        links: List[tuple] = []
+        if projet_ids:
+            links = (
+                db.session.query(SubventionProjet.projet_id, SubventionProjet.subvention_id)
+                .filter(SubventionProjet.projet_id.in_(projet_ids))
+                .all()
+            )
+
+        if all_subventions:
+            sub_filter = None
+        else:
+            ids = {int(i) for i in (subvention_ids or [])} | {sid for _pid, sid in links}
+            if not ids:
+                snap._link_projets(projet_ids, links)
+                return snap
+            sub_filter = sorted(ids)
+
+        snap._load_subventions(sub_filter)
+        snap._load_lignes(sub_filter)
+        snap._link_projets(projet_ids, links)
+        return snap
+
+    def _load_subventions(self, sub_filter) -> None:
+        q = db.session.query(
+            Subvention.id, Subvention.secteur, Subvention.annee_exercice,
+            Subvention.montant_demande, Subvention.montant_attribue, Subvention.montant_recu,
+        )
+        if sub_filter is not None:
+            q = q.filter(Subvention.id.in_(sub_filter))
+        for sid, secteur, annee, demande, attribue, recu in q:
+            self.subs[sid] = SubTotals(
+                id=sid,
+                secteur=secteur or "",
+                annee_exercice=annee,
+                montant_demande=float(demande or 0),
+                montant_attribue=float(attribue or 0),
+                montant_recu=float(recu or 0),
+            )
+
+    def _load_lignes(self, sub_filter) -> None:
+        q = (
+            db.session.query(
+                LigneBudget.id,
+                LigneBudget.subvention_id,
+                LigneBudget.nature,
+                LigneBudget.compte,
+                LigneBudget.libelle,
+                LigneBudget.montant_base,
+                LigneBudget.montant_reel,
+                LigneBudget.engage_cache,
+                LigneBudget.nb_depenses,
+            )
+            .order_by(LigneBudget.compte.asc(), LigneBudget.libelle.asc(), LigneBudget.id.asc())
+        )
+        if sub_filter is not None:
+            q = q.filter(LigneBudget.subvention_id.in_(sub_filter))
+
+        for lid, sid, nature, compte, libelle, base, reel, dep_sum, nb in q:
+            nature = nature or "charge"
+            base = float(base or 0)
+            reel = float(reel or 0)
+            lt = LigneTotals(
+                id=lid, subvention_id=sid, nature=nature, compte=compte, libelle=libelle,
+                montant_base=base, montant_reel=reel, nb_depenses=int(nb or 0),
+            )
+            if nature == "charge":
+                lt.engage = round(float(dep_sum or 0), 2)
+                lt.reste = round(reel - lt.engage, 2)
+            self.lignes[lid] = lt
+            self._lignes_by_sub.setdefault(sid, []).append(lt)
+
+            st = self.subs.get(sid)
+            if st is None:
+                continue
+            st.nb_depenses += lt.nb_depenses
+            if nature == "charge":
+                st.total_base_lignes += base
+                st.total_reel_lignes += reel
+                st.total_engage += lt.engage
+                st.total_reste += lt.reste
+            elif nature == "produit":
+                st.total_base_produits += base
+                st.total_reel_produits += reel
+
+        # montants de la subvention laissés bruts (les totaux projet arrondissent la somme)
+        for st in self.subs.values():
+            st.rounded(_LIGNE_FIELDS)
+
+    def _link_projets(self, projet_ids: List[int], links: List[tuple]) -> None:
+        for pid in projet_ids:
+            self.projets.setdefault(pid, ProjetTotals(id=pid))
+        for pid, sid in links:
+            pt = self.projets[pid]
+            st = self.subs.get(sid)
+            if st is None:
+                continue
+            pt.subvention_ids.append(sid)
+            pt.total_demande += st.montant_demande
+            pt.total_attribue += st.montant_attribue
+            pt.total_recu += st.montant_recu
+            pt.total_reel_lignes += st.total_reel_lignes
+            pt.total_engage += st.total_engage
+            pt.total_reste += st.total_reste
+        for pt in self.projets.values():
+            for attr in ("total_demande", "total_attribue", "total_recu",
+                         "total_reel_lignes", "total_engage", "total_reste"):
+                setattr(pt, attr, round(getattr(pt, attr), 2))
+
+    # ------------------------------------------------------------------
+    def sub(self, subvention_id: int) -> SubTotals:
+        return self.subs.get(subvention_id, _EMPTY_SUB)
+
+    def ligne(self, ligne_id: int) -> Optional[LigneTotals]:
+        return self.lignes.get(ligne_id)
+
+    def lignes_of(self, subvention_id: int) -> List[LigneTotals]:
+        """Lignes de la subvention, triées par compte puis libellé."""
+        return self._lignes_by_sub.get(subvention_id, [])
+
+    def projet(self, projet_id: int) -> ProjetTotals:
+        return self.projets.get(projet_id) or ProjetTotals(id=projet_id)
+
+    def total(self, subvention_ids: Optional[Iterable[int]] = None) -> SubTotals:
+        """Somme des subventions (toutes celles chargées par défaut)."""
+        out = SubTotals()
+        ids = self.subs.keys() if subvention_ids is None else subvention_ids
+        for sid in ids:
+            st = self.subs.get(sid)
+            if st is not None:
+                out.add(st)
+        return out.rounded()
+
+    def by_secteur(self, subvention_ids: Optional[Iterable[int]] = None) -> Dict[str, SubTotals]:
+        out: Dict[str, SubTotals] = {}
+        ids = self.subs.keys() if subvention_ids is None else subvention_ids
+        for sid in ids:
+            st = self.subs.get(sid)
+            if st is not None:
+                out.setdefault(st.secteur, SubTotals(secteur=st.secteur)).add(st)
+        for st in out.values():
+            st.rounded()
+        return out
+
+    def by_compte(self, subvention_ids: Optional[Iterable[int]] = None) -> Dict[str, Dict[str, float]]:
+        """{compte: {reel, engage, reste}} sur toutes les lignes (charges et produits)."""
+        out: Dict[str, Dict[str, float]] = {}
+        ids = self.subs.keys() if subvention_ids is None else subvention_ids
+        for sid in ids:
+            for lt in self._lignes_by_sub.get(sid, []):
+                d = out.setdefault(lt.compte, {"reel": 0.0, "engage": 0.0, "reste": 0.0})
+                d["reel"] += lt.montant_reel
+                d["engage"] += lt.engage
+                d["reste"] += lt.reste
+        for vals in out.values():
+            for k in vals:
+                vals[k] = round(vals[k], 2)
+        return out
@@ -0,0 +1,127 @@
+"""Soumissions de formulaire à usage unique (double tap sur "Signer", double clic "Créer").
+
+Chaque formulaire sensible porte un champ caché `form_token` (global Jinja
+`form_token()`). Le serveur garde, pour une durée courte, token -> résultat :
+- premier POST : le token est "réservé", le traitement s'exécute, le résultat
+  (messages flash + redirection, ou message de la page) est mémorisé ;
+- POST rejoué avec le même token : le résultat d'origine est renvoyé tel quel,
+  sans toucher à la base ni au disque. Un rejeu qui arrive pendant le premier
+  traitement attend sa fin.
+
+Un POST sans token (vieil onglet, client non web) est traité normalement.
+Mémoire par processus : suffisant pour le double tap, qui arrive sur le même serveur.
+"""
+from __future__ import annotations
+
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from flask import flash, redirect
+
+
+TOKEN_TTL_SECONDS = 15 * 60
+WAIT_IN_FLIGHT_SECONDS = 10
+MAX_TOKENS = 5000
+
+_lock = threading.Lock()
+# token -> (horodatage, résultat ou None si en cours, évènement de fin)
+_entries: Dict[str, Tuple[float, Optional[Dict[str, Any]], threading.Event]] = {}
+
+
+def issue_form_token() -> str:
+    """Nouveau token (à poser dans un champ caché `form_token`)."""
+    return secrets.token_urlsafe(16)
+
+
+def _purge(now: float) -> None:
+    expired = [k for k, (ts, _res, _ev) in _entries.items() if now - ts > TOKEN_TTL_SECONDS]
+    for k in expired:
+        _entries.pop(k, None)
+    if len(_entries) > MAX_TOKENS:
+        # garde les plus récents
+        for k, _v in sorted(_entries.items(), key=lambda kv: kv[1][0])[: len(_entries) - MAX_TOKENS]:
+            _entries.pop(k, None)
+
+
+class Submission:
+    def __init__(self, token: Optional[str]):
+        self.token = token
+        self.outcome: Optional[Dict[str, Any]] = None
+        self.owner = False
+
+    @property
+    def replayed(self) -> bool:
+        return self.outcome is not None
+
+    def record(self, outcome: Dict[str, Any]) -> Dict[str, Any]:
+        """Mémorise le résultat (à appeler une fois l'écriture commitée)."""
+        if self.owner and self.token:
+            with _lock:
+                entry = _entries.get(self.token)
+                if entry is not None:
+                    _entries[self.token] = (entry[0], outcome, entry[2])
+                    entry[2].set()
+        self.outcome = outcome
+        return outcome
+
+    def done(self, url: str, *messages: Tuple[str, str]):
+        """Mémorise puis applique un résultat "flash + redirection"."""
+        self.record({"redirect": url, "flashes": list(messages)})
+        return self.replay()
+
+    def replay(self):
+        """Rejoue un résultat "flash + redirection" mémorisé."""
+        for msg, cat in (self.outcome or {}).get("flashes", []):
+            flash(msg, cat)
+        return redirect((self.outcome or {}).get("redirect") or "/")
+
+
+def _claim(sub: Submission) -> None:
+    token = sub.token
+    if not token:
+        return
+    now = time.monotonic()
+    with _lock:
+        _purge(now)
+        entry = _entries.get(token)
+        if entry is None:
+            _entries[token] = (now, None, threading.Event())
+            sub.owner = True
+            return
+    # déjà vu : on attend la fin du premier traitement
+    _ts, outcome, done = entry
+    if outcome is None:
+        done.wait(WAIT_IN_FLIGHT_SECONDS)
+        with _lock:
+            entry = _entries.get(token)
+        outcome = entry[1] if entry else None
+    if outcome is None:
+        # le premier traitement a échoué sans résultat : on retraite
+        with _lock:
+            _entries[token] = (time.monotonic(), None, threading.Event())
+        sub.owner = True
+        return
+    sub.outcome = outcome
+
+
+@contextmanager
+def form_once(token: Optional[str]) -> Iterator[Submission]:
+    """Réserve `token` pour ce POST. `sub.replayed` indique un rejeu (utiliser `sub.outcome`).
+
+    Si le bloc se termine sans `record()` (erreur de saisie, exception), le token est
+    libéré : le formulaire corrigé pourra être renvoyé.
+    """
+    sub = Submission((token or "").strip() or None)
+    _claim(sub)
+    try:
+        yield sub
+    finally:
+        if sub.owner and sub.token:
+            with _lock:
+                entry = _entries.get(sub.token)
+                if entry is not None and entry[1] is None:
+                    _entries.pop(sub.token, None)
+                    entry[2].set()
@@ -0,0 +1,287 @@
+"""Évaluation des indicateurs de projet (`ProjetIndicateur`), par lots.
+
+Un indicateur "participants" dépend d'un périmètre : (ateliers, période). Les
+indicateurs sont regroupés par périmètre ; chaque périmètre distinct est calculé
+une seule fois, en une requête agrégée sur sessions + présences, quel que soit
+le nombre d'indicateurs (ou de projets) qui le partagent.
+
+Les métriques sont mises en cache en mémoire, indexées par le périmètre et la
+version "activite" des données (voir services/data_version.py) : toute écriture
+de session / présence / lien projet-atelier invalide le cache. Un TTL reste en
+filet de sécurité.
+
+Les indicateurs financiers (dépenses / recettes, coûts unitaires) utilisent les
+totaux réels charges / produits fournis par l'appelant pour chaque projet.
+
+Utilisé par `main.stats`, `projets.projets_edit` et le portefeuille de projets.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.extensions import db
+from app.models import ProjetAtelier, ProjetIndicateur
+from app.services.data_version import data_version
+
+
+PARTICIPANT_CODES = ("participants_uniques", "presences_totales", "sessions_totales", "recurrence_2plus")
+
+UNITS = {
+    "depenses_totales": "€",
+    "recettes_totales": "€",
+    "cout_par_participant": "€",
+    "cout_par_presence": "€",
+}
+
+CACHE_TTL_SECONDS = 600
+CACHE_MAX_ENTRIES = 2000
+
+_EMPTY_METRICS = {code: 0 for code in PARTICIPANT_CODES}
+
+
+# ---------------------------------------------------------------------------
+# Paramètres d'un indicateur
+
+def _parse_iso_date(s: str):
+    try:
+        if not s:
+            return None
+        return date.fromisoformat(s)
+    except Exception:
+        return None
+
+
+def indicator_date_range(params: dict, selected_annee: Optional[int]):
+    period = (params.get("period") or "context").strip()
+    if period == "custom":
+        d1 = _parse_iso_date(params.get("start") or "")
+        d2 = _parse_iso_date(params.get("end") or "")
+        if d1 and d2 and d2 < d1:
+            d1, d2 = d2, d1
+        return d1, d2
+    if period == "year" or period == "context":
+        if selected_annee:
+            return date(selected_annee, 1, 1), date(selected_annee, 12, 31)
+    return None, None
+
+
+def indicator_target_status(value, target, op: str):
+    if target is None or value is None:
+        return None
+    try:
+        v = float(value)
+        t = float(target)
+    except Exception:
+        return None
+    if t == 0:
+        return None
+    op = (op or "ge").strip()
+
+    # ge : on veut v >= t ; le : on veut v <= t
+    if op == "le":
+        ratio = t / v if v != 0 else float("inf")
+        ok = v <= t
+    else:
+        ratio = v / t
+        ok = v >= t
+
+    if ok:
+        return "ok"
+    if ratio >= 0.75:
+        return "warn"
+    return "bad"
+
+
+@dataclass(frozen=True)
+class Scope:
+    atelier_ids: Tuple[int, ...]
+    dmin: Optional[date]
+    dmax: Optional[date]
+
+
+def indicator_scope(params: dict, projet_atelier_ids: Iterable[int], selected_annee: Optional[int]) -> Scope:
+    """Périmètre d'un indicateur : ateliers du projet (ou l'atelier choisi) et période."""
+    atelier_ids = sorted(set(projet_atelier_ids))
+    try:
+        atelier_id = int(params.get("atelier_id") or 0)
+    except (TypeError, ValueError):
+        atelier_id = 0
+    if atelier_id and atelier_id in atelier_ids:
+        atelier_ids = [atelier_id]
+    dmin, dmax = indicator_date_range(params, selected_annee)
+    if not (dmin and dmax):
+        dmin = dmax = None  # borne incomplète : pas de filtre de date
+    return Scope(tuple(atelier_ids), dmin, dmax)
+
+
+# ---------------------------------------------------------------------------
+# Métriques participants (une requête par périmètre, cache par version)
+
+_lock = threading.Lock()
+# (périmètre, version) -> (horodatage, métriques)
+_cache: Dict[Tuple[Scope, int], Tuple[float, Dict[str, int]]] = {}
+
+
+def _compute_scope(scope: Scope) -> Dict[str, int]:
+    if not scope.atelier_ids:
+        return dict(_EMPTY_METRICS)
+    params: Dict[str, Any] = {f"a{i}": aid for i, aid in enumerate(scope.atelier_ids)}
+    in_list = ", ".join(f":a{i}" for i in range(len(scope.atelier_ids)))
+    date_filter = ""
+    if scope.dmin and scope.dmax:
+        date_filter = " AND COALESCE(s.date_session, s.rdv_date) BETWEEN :dmin AND :dmax"
+        params.update(dmin=scope.dmin.isoformat(), dmax=scope.dmax.isoformat())
+    row = db.session.execute(text(
+        "WITH sess AS ("
+        "  SELECT s.id FROM session_activite s"
+        f"  WHERE s.atelier_id IN ({in_list}) AND s.is_deleted = 0"
+        "   AND s.statut != 'annulee'" + date_filter +
+        "), pres AS ("
+        "  SELECT p.participant_id, COUNT(p.id) AS c FROM presence_activite p"
+        "  WHERE p.session_id IN (SELECT id FROM sess) GROUP BY p.participant_id"
+        ")"
+        " SELECT (SELECT COUNT(*) FROM sess),"
+        "        COALESCE(SUM(c), 0),"
+        "        COUNT(participant_id),"
+        "        COALESCE(SUM(CASE WHEN c >= 2 THEN 1 ELSE 0 END), 0)"
+        " FROM pres"
+    ), params).one()
+    return {
+        "sessions_totales": int(row[0] or 0),
+        "presences_totales": int(row[1] or 0),
+        "participants_uniques": int(row[2] or 0),
+        "recurrence_2plus": int(row[3] or 0),
+    }
+
+
+def participant_metrics(scopes: Iterable[Scope]) -> Dict[Scope, Dict[str, int]]:
+    """Métriques de chaque périmètre distinct (calculées une fois, puis en cache)."""
+    wanted = set(scopes)
+    if not wanted:
+        return {}
+    version = data_version("activite")
+    now = time.monotonic()
+    out: Dict[Scope, Dict[str, int]] = {}
+    missing: List[Scope] = []
+    with _lock:
+        for scope in wanted:
+            hit = _cache.get((scope, version))
+            if hit and (now - hit[0]) < CACHE_TTL_SECONDS:
+                out[scope] = hit[1]
+            else:
+                missing.append(scope)
+
+    computed = {scope: _compute_scope(scope) for scope in missing}
+    out.update(computed)
+    if computed:
+        with _lock:
+            # les entrées d'anciennes versions ne peuvent plus servir
+            stale = [k for k in _cache if k[1] != version]
+            for k in stale:
+                del _cache[k]
+            if len(_cache) + len(computed) > CACHE_MAX_ENTRIES:
+                _cache.clear()
+            for scope, metrics in computed.items():
+                _cache[(scope, version)] = (now, metrics)
+    return out
+
+
+def clear_cache() -> None:
+    with _lock:
+        _cache.clear()
+
+
+# ---------------------------------------------------------------------------
+# Évaluation
+
+def projet_atelier_ids(projet_ids: Iterable[int]) -> Dict[int, List[int]]:
+    """{projet_id: [atelier_id, ...]} en une requête."""
+    out: Dict[int, List[int]] = {pid: [] for pid in projet_ids}
+    if not out:
+        return out
+    rows = (
+        db.session.query(ProjetAtelier.projet_id, ProjetAtelier.atelier_id)
+        .filter(ProjetAtelier.projet_id.in_(list(out)))
+        .all()
+    )
+    for pid, aid in rows:
+        out[pid].append(aid)
+    return out
+
+
+def active_indicators(projet_ids: Iterable[int]) -> Dict[int, List[ProjetIndicateur]]:
+    """{projet_id: [indicateurs actifs, par date de création]} en une requête."""
+    out: Dict[int, List[ProjetIndicateur]] = {pid: [] for pid in projet_ids}
+    if not out:
+        return out
+    rows = (
+        ProjetIndicateur.query.filter(ProjetIndicateur.projet_id.in_(list(out)), ProjetIndicateur.is_active.is_(True))
+        .order_by(ProjetIndicateur.created_at.asc(), ProjetIndicateur.id.asc())
+        .all()
+    )
+    for ind in rows:
+        out[ind.projet_id].append(ind)
+    return out
+
+
+def _value(code: str, metrics: Dict[str, int], dep: float, rec: float):
+    if code in PARTICIPANT_CODES:
+        return metrics.get(code, 0)
+    if code == "depenses_totales":
+        return dep
+    if code == "recettes_totales":
+        return rec
+    if code == "cout_par_participant":
+        u = metrics.get("participants_uniques", 0) or 0
+        return round(dep / u, 2) if u else None
+    if code == "cout_par_presence":
+        u = metrics.get("presences_totales", 0) or 0
+        return round(dep / u, 2) if u else None
+    return None
+
+
+def evaluate(indicators_by_projet: Dict[int, List[ProjetIndicateur]],
+             ateliers_by_projet: Dict[int, List[int]],
+             finance_by_projet: Dict[int, Dict[str, float]],
+             selected_annee: Optional[int] = None) -> Dict[int, List[Dict[str, Any]]]:
+    """Évalue tous les indicateurs de plusieurs projets en un lot.
+
+    `finance_by_projet` : {projet_id: {"charge": réel charges, "produit": réel produits}}.
+    Retourne {projet_id: [dict prêt pour le gabarit, dans l'ordre des indicateurs]}.
+    """
+    plan: List[Tuple[int, ProjetIndicateur, dict, Scope]] = []
+    for pid, inds in indicators_by_projet.items():
+        for ind in inds:
+            params = ind.params() or {}
+            plan.append((pid, ind, params, indicator_scope(params, ateliers_by_projet.get(pid, []), selected_annee)))
+
+    metrics = participant_metrics(scope for _pid, _ind, _params, scope in plan)
+
+    out: Dict[int, List[Dict[str, Any]]] = {pid: [] for pid in indicators_by_projet}
+    for pid, ind, params, scope in plan:
+        fin = finance_by_projet.get(pid) or {}
+        val = _value(ind.code, metrics.get(scope, _EMPTY_METRICS),
+                     float(fin.get("charge", 0.0)), float(fin.get("produit", 0.0)))
+        target = params.get("target", None)
+        op = params.get("target_op", "ge")
+        out[pid].append({
+            "id": ind.id,
+            "label": ind.label,
+            "code": ind.code,
+            "value": val,
+            "unit": UNITS.get(ind.code, ""),
+            "target": target,
+            "target_op": op,
+            "status": indicator_target_status(val, target, op),
+            "period": (params.get("period") or "context"),
+            "start": params.get("start"),
+            "end": params.get("end"),
+            "atelier_id": params.get("atelier_id"),
+        })
+    return out
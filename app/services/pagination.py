@@ -0,0 +1,188 @@
+"""Pagination par clé ("keyset") pour les listes longues.
+
+Au lieu de OFFSET (coût proportionnel au numéro de page) ou de tout charger,
+on trie sur des clés stables terminées par une clé unique (l'id), et on
+reprend "après la dernière ligne vue" :
+
+    WHERE (nom > :nom) OR (nom = :nom AND id > :id)  ORDER BY nom, id  LIMIT n+1
+
+Le curseur (valeurs de clé de la première/dernière ligne + sens) est signé et
+opaque dans l'URL. Un curseur invalide ou périmé renvoie simplement la 1re page.
+
+Les clés doivent être non NULL (envelopper les colonnes nullables dans coalesce).
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, List, Optional, Sequence, Tuple
+
+from flask import current_app, request, url_for
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import and_, or_
+
+from app.extensions import db
+
+
+DEFAULT_PER_PAGE = 50
+MIN_PER_PAGE = 10
+MAX_PER_PAGE = 200
+COUNT_CAP = 5000
+
+# (expression SQL, tri décroissant ?)
+SortKey = Tuple[Any, bool]
+
+
+def _serializer() -> URLSafeSerializer:
+    return URLSafeSerializer(current_app.config["SECRET_KEY"], salt="keyset-cursor")
+
+
+def _dump_value(v):
+    if isinstance(v, datetime):
+        return {"dt": v.isoformat()}
+    if isinstance(v, date):
+        return {"d": v.isoformat()}
+    return v
+
+
+def _load_value(v):
+    if isinstance(v, dict):
+        if "dt" in v:
+            return datetime.fromisoformat(v["dt"])
+        if "d" in v:
+            return date.fromisoformat(v["d"])
+    return v
+
+
+def encode_cursor(values: Sequence[Any], backward: bool = False) -> str:
+    return _serializer().dumps({"k": [_dump_value(v) for v in values], "b": bool(backward)})
+
+
+def decode_cursor(token: Optional[str], n_keys: int) -> Optional[Tuple[List[Any], bool]]:
+    if not token:
+        return None
+    try:
+        data = _serializer().loads(token)
+        values = [_load_value(v) for v in data["k"]]
+    except (BadSignature, KeyError, TypeError, ValueError):
+        return None
+    if len(values) != n_keys:
+        return None
+    return values, bool(data.get("b"))
+
+
+def _after(keys: Sequence[SortKey], values: Sequence[Any], backward: bool):
+    """Condition "strictement après `values`" dans l'ordre des clés (avant, si backward)."""
+    ors = []
+    for i, (expr, desc) in enumerate(keys):
+        go_down = desc != backward
+        cmp = expr < values[i] if go_down else expr > values[i]
+        eqs = [keys[j][0] == values[j] for j in range(i)]
+        ors.append(and_(*eqs, cmp) if eqs else cmp)
+    return or_(*ors)
+
+
+@dataclass
+class KeysetPage:
+    items: List[Any]
+    per_page: int
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+    total: Optional[int] = None
+    total_capped: bool = False
+    is_first: bool = True
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self) -> bool:
+        return self.prev_cursor is not None
+
+    def url(self, cursor: Optional[str]) -> str:
+        """URL de la même page (mêmes filtres) avec un autre curseur."""
+        args = request.args.to_dict(flat=False)
+        args.pop("cursor", None)
+        if cursor:
+            args["cursor"] = cursor
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+    @property
+    def next_url(self) -> Optional[str]:
+        return self.url(self.next_cursor) if self.next_cursor else None
+
+    @property
+    def prev_url(self) -> Optional[str]:
+        return self.url(self.prev_cursor) if self.prev_cursor else None
+
+    @property
+    def first_url(self) -> str:
+        return self.url(None)
+
+    @property
+    def total_label(self) -> str:
+        if self.total is None:
+            return ""
+        return f"{self.total}+" if self.total_capped else str(self.total)
+
+
+def page_args(default_per_page: int = DEFAULT_PER_PAGE) -> Tuple[Optional[str], int]:
+    """(cursor, per_page) depuis la query string, per_page borné."""
+    try:
+        per_page = int(request.args.get("per_page") or default_per_page)
+    except ValueError:
+        per_page = default_per_page
+    per_page = max(MIN_PER_PAGE, min(per_page, MAX_PER_PAGE))
+    return (request.args.get("cursor") or None), per_page
+
+
+def estimate_count(query, cap: int = COUNT_CAP) -> Tuple[int, bool]:
+    """Comptage borné : on s'arrête à `cap` lignes (affiché "5000+")."""
+    sub = query.order_by(None).limit(cap + 1).subquery()
+    n = db.session.query(db.func.count()).select_from(sub).scalar() or 0
+    return (min(n, cap), n > cap)
+
+
+def keyset_paginate(query, keys: Sequence[SortKey], cursor: Optional[str] = None,
+                    per_page: int = DEFAULT_PER_PAGE, count: bool = True) -> KeysetPage:
+    """Page de `query` triée par `keys` (la dernière clé doit être unique, ex. id).
+
+    `query` ne doit pas être déjà triée. Les éléments renvoyés ont la même forme
+    que ceux de la requête (entité seule ou tuple).
+    """
+    keys = list(keys)
+    n = len(keys)
+    decoded = decode_cursor(cursor, n)
+    backward = bool(decoded and decoded[1])
+
+    total, capped = (estimate_count(query) if count else (None, False))
+
+    q = query.add_columns(*[expr for expr, _desc in keys])
+    if decoded:
+        q = q.filter(_after(keys, decoded[0], backward))
+    q = q.order_by(*[
+        (expr.desc() if (desc != backward) else expr.asc()) for expr, desc in keys
+    ])
+    rows = q.limit(per_page + 1).all()
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backward:
+        rows.reverse()
+
+    items, key_values = [], []
+    for row in rows:
+        payload, kv = tuple(row[:-n]), list(row[-n:])
+        items.append(payload[0] if len(payload) == 1 else payload)
+        key_values.append(kv)
+
+    page = KeysetPage(items=items, per_page=per_page, total=total, total_capped=capped)
+    page.is_first = not decoded or (backward and not has_more)
+    if key_values:
+        # suivant : existe si on avançait et qu'il restait des lignes, ou si on reculait
+        if (not backward and has_more) or backward:
+            page.next_cursor = encode_cursor(key_values[-1])
+        if not page.is_first:
+            page.prev_cursor = encode_cursor(key_values[0], backward=True)
+    return page
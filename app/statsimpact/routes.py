@@ -469,19 +469,13 @@ def dashboard():
             try:
                 from app.extensions import db
 
-                # Supprime d'abord les signatures des présences
-                presences = PresenceActivite.query.filter_by(participant_id=participant_id).all()
-                for pr in presences:
-                    if pr.signature_path:
-                        try:
-                            if os.path.exists(pr.signature_path):
-                                os.remove(pr.signature_path)
-                        except Exception:
-                            pass
-                    db.session.delete(pr)
+                from app.participants.retention import delete_presences, remove_signature_files
 
+                # Présences supprimées en masse ; fichiers de signature effacés après le commit
+                sig_paths = delete_presences([participant_id])
                 db.session.delete(participant)
                 db.session.commit()
+                remove_signature_files(sig_paths)
                 flash("Participant supprimé définitivement.", "success")
             except Exception:
                 db.session.rollback()
@@ -0,0 +1,46 @@
+// Service worker du kiosque (portée /kiosk/).
+// Réseau d'abord, cache en secours : une tablette qui perd le Wi-Fi peut recharger
+// la page d'émargement. Les émargements eux-mêmes sont mis en file par la page
+// (localStorage) et envoyés à /kiosk/session/<token>/batch au retour du réseau.
+const CACHE = 'kiosk-v1';
+const STATIC = ['{{ url_for("static", filename="style.css") }}'];
+
+self.addEventListener('install', (event) => {
+  event.waitUntil(caches.open(CACHE).then((c) => c.addAll(STATIC)).then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', (event) => {
+  event.waitUntil(
+    caches.keys()
+      .then((keys) => Promise.all(keys.filter((k) => k !== CACHE).map((k) => caches.delete(k))))
+      .then(() => self.clients.claim())
+  );
+});
+
+function cacheable(request) {
+  if (request.method !== 'GET') return false;
+  const url = new URL(request.url);
+  if (url.origin !== self.location.origin) return false;
+  // jamais de cache pour les API (recherche, liste, lot)
+  if (/\/(search|roster|batch)$/.test(url.pathname)) return false;
+  return url.pathname.startsWith('{{ url_for("kiosk.kiosk_home") }}') || STATIC.includes(url.pathname);
+}
+
+self.addEventListener('fetch', (event) => {
+  const request = event.request;
+  if (!cacheable(request)) return;
+  // la page est mise en cache sans ses paramètres (?highlight=...)
+  const key = new URL(request.url);
+  key.search = '';
+  event.respondWith(
+    fetch(request)
+      .then((resp) => {
+        if (resp.ok) {
+          const copy = resp.clone();
+          caches.open(CACHE).then((c) => c.put(key.toString(), copy));
+        }
+        return resp;
+      })
+      .catch(() => caches.match(key.toString()))
+  );
+});
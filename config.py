@@ -16,9 +16,27 @@ class Config:
     os.makedirs(INSTANCE_DIR, exist_ok=True)
 
     DB_PATH = os.path.join(INSTANCE_DIR, "database.db")
+    # SQLite uniquement (triggers, FTS5, INSERT OR IGNORE) : create_app refuse
+    # tout autre moteur au démarrage, DATABASE_URL doit être une URL sqlite:///
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", f"sqlite:///{DB_PATH}")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # SQLite sous charge (kiosque) : WAL + attente sur verrou, puis rejeu applicatif
+    SQLITE_WAL = os.environ.get("SQLITE_WAL", "1") in {"1", "true", "True", "yes", "YES"}
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "10000"))
+    SQLITE_WRITE_ATTEMPTS = int(os.environ.get("SQLITE_WRITE_ATTEMPTS", "5"))
+    # émargements : attente max du verrou d'écrivain du processus, par tentative (secondes)
+    SQLITE_WRITER_LOCK_TIMEOUT = float(os.environ.get("SQLITE_WRITER_LOCK_TIMEOUT", "2"))
+
+    # RGPD : anonymisation des participants sans venue depuis N années (flask rgpd sweep)
+    RGPD_RETENTION_YEARS = int(os.environ.get("RGPD_RETENTION_YEARS", "3"))
+    RGPD_SWEEP_CHUNK = int(os.environ.get("RGPD_SWEEP_CHUNK", "200"))
+    RGPD_SWEEP_PAUSE_SECONDS = float(os.environ.get("RGPD_SWEEP_PAUSE_SECONDS", "0.2"))
+
+    # Dashboard : cache par périmètre (rôle, secteur) et rafraîchissement en tâche de fond
+    DASHBOARD_CACHE_TTL = int(os.environ.get("DASHBOARD_CACHE_TTL", "120"))
+    DASHBOARD_REFRESH_SECONDS = int(os.environ.get("DASHBOARD_REFRESH_SECONDS", "60"))
+
     SECTEURS = [
         "Numérique",
         "Familles",
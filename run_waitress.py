@@ -1,9 +1,11 @@
 from waitress import serve
 from app import create_app
+from app.services.dashboard_service import start_refresher
 
 app = create_app()
+start_refresher(app)
 
-print("🚀 Démarrage PRO (Compat. PostgreSQL & SQLite)")
+print("🚀 Démarrage PRO (SQLite uniquement)")
 print("👥 12 personnes MAX (12 threads)")
 
 serve(